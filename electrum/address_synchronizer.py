@@ -25,8 +25,8 @@ import asyncio
 import threading
 import asyncio
 import itertools
-from collections import defaultdict
-from typing import TYPE_CHECKING, Dict, Optional, Set, Tuple, NamedTuple, Sequence, List
+from collections import defaultdict, deque
+from typing import TYPE_CHECKING, Dict, Optional, Set, Tuple, NamedTuple, Sequence, List, Iterable
 
 from . import bitcoin
 from .bitcoin import COINBASE_MATURITY
@@ -34,7 +34,6 @@ from .util import profiler, bfh, TxMinedInfo
 from .transaction import Transaction, TxOutput, TxInput, PartialTxInput, TxOutpoint, PartialTransaction
 from .synchronizer import Synchronizer
 from .verifier import SPV
-from .blockchain import hash_header
 from .i18n import _
 from .logging import Logger
 
@@ -65,6 +64,47 @@ class HistoryItem(NamedTuple):
     balance: Optional[int]
 
 
+class ChangeLog:
+    """Bounded log of the wallet items that changed: txids, payment hashes,
+    addresses and label keys. Consumers remember the position they last
+    read up to, and ask for the keys that changed since.
+    """
+
+    MAX_ENTRIES = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = deque(maxlen=self.MAX_ENTRIES)  # type: deque  # of (pos, key)
+        self._pos = 0
+
+    def add(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._pos += 1
+                self._entries.append((self._pos, key))
+
+    def get_position(self) -> int:
+        with self._lock:
+            return self._pos
+
+    def get_changes_since(self, pos: Optional[int]) -> Tuple[int, Optional[Set[str]]]:
+        """Returns the current position, and the set of keys that changed
+        after 'pos'. The set is None if 'pos' is None, or if the log no
+        longer goes back that far; the caller should then reload everything.
+        """
+        with self._lock:
+            if pos == self._pos:
+                return pos, set()
+            if pos is None or pos > self._pos or not self._entries or self._entries[0][0] > pos + 1:
+                return self._pos, None
+            keys = set()
+            for p, key in reversed(self._entries):
+                if p <= pos:
+                    break
+                keys.add(key)
+            return self._pos, keys
+
+
 class AddressSynchronizer(Logger):
     """
     inherited by wallet
@@ -89,6 +129,8 @@ class AddressSynchronizer(Logger):
         self.threadlocal_cache = threading.local()
 
         self._get_addr_balance_cache = {}
+        # txids and addresses that changed, for incremental GUI updates
+        self.changes = ChangeLog()
 
         self.load_and_cleanup()
 
@@ -174,6 +216,7 @@ class AddressSynchronizer(Logger):
         if not self.db.get_addr_history(address):
             self.db.history[address] = []
             self.set_up_to_date(False)
+            self.changes.add(address)
         if self.synchronizer:
             self.synchronizer.add(address)
 
@@ -255,10 +298,8 @@ class AddressSynchronizer(Logger):
                 # keep this txn and remove all conflicting
                 to_remove = set()
                 to_remove |= conflicting_txns
-                for conflicting_tx_hash in conflicting_txns:
-                    to_remove |= self.get_depending_transactions(conflicting_tx_hash)
-                for tx_hash2 in to_remove:
-                    self.remove_transaction(tx_hash2)
+                to_remove |= self.get_depending_transactions(*conflicting_txns)
+                self.remove_transactions(to_remove)
             # add inputs
             def add_value_from_prev_output():
                 # note: this nested loop takes linear time in num is_mine outputs of prev_tx
@@ -302,49 +343,51 @@ class AddressSynchronizer(Logger):
             return True
 
     def remove_transaction(self, tx_hash: str) -> None:
-        def remove_from_spent_outpoints():
-            # undo spends in spent_outpoints
-            if tx is not None:
-                # if we have the tx, this branch is faster
-                for txin in tx.inputs():
-                    if txin.is_coinbase():
-                        continue
-                    prevout_hash = txin.prevout.txid.hex()
-                    prevout_n = txin.prevout.out_idx
-                    self.db.remove_spent_outpoint(prevout_hash, prevout_n)
-            else:
-                # expensive but always works
-                for prevout_hash, prevout_n in self.db.list_spent_outpoints():
-                    spending_txid = self.db.get_spent_outpoint(prevout_hash, prevout_n)
-                    if spending_txid == tx_hash:
-                        self.db.remove_spent_outpoint(prevout_hash, prevout_n)
-
+        self.remove_transactions([tx_hash])
+
+    def remove_transactions(self, tx_hashes: Iterable[str]) -> None:
+        """Removes the given transactions from history, typically a tx
+        and its descendants, taking the locks once for the whole set."""
+        tx_hashes = list(tx_hashes)
+        if not tx_hashes:
+            return
         with self.lock, self.transaction_lock:
-            self.logger.info(f"removing tx from history {tx_hash}")
-            tx = self.db.remove_transaction(tx_hash)
-            remove_from_spent_outpoints()
-            self._remove_tx_from_local_history(tx_hash)
-            for addr in itertools.chain(self.db.get_txi_addresses(tx_hash), self.db.get_txo_addresses(tx_hash)):
-                self._get_addr_balance_cache.pop(addr, None)  # invalidate cache
-            self.db.remove_txi(tx_hash)
-            self.db.remove_txo(tx_hash)
-            self.db.remove_tx_fee(tx_hash)
-            self.db.remove_verified_tx(tx_hash)
-            self.unverified_tx.pop(tx_hash, None)
-            if tx:
-                for idx, txo in enumerate(tx.outputs()):
-                    scripthash = bitcoin.script_to_scripthash(txo.scriptpubkey.hex())
-                    prevout = TxOutpoint(bfh(tx_hash), idx)
-                    self.db.remove_prevout_by_scripthash(scripthash, prevout=prevout, value=txo.value)
-
-    def get_depending_transactions(self, tx_hash):
-        """Returns all (grand-)children of tx_hash in this wallet."""
+            self.logger.info(f"removing {len(tx_hashes)} tx(s) from history: {tx_hashes[0]}"
+                             + (" ..." if len(tx_hashes) > 1 else ""))
+            for tx_hash in tx_hashes:
+                self._remove_transaction(tx_hash)
+
+    def _remove_transaction(self, tx_hash: str) -> None:
+        tx = self.db.remove_transaction(tx_hash)
+        # undo spends in spent_outpoints. The db indexes them by spender,
+        # so this works even if we do not have the tx.
+        for prevout_hash, prevout_n in self.db.get_spent_prevouts(tx_hash):
+            self.db.remove_spent_outpoint(prevout_hash, prevout_n)
+        self._remove_tx_from_local_history(tx_hash)
+        for addr in itertools.chain(self.db.get_txi_addresses(tx_hash), self.db.get_txo_addresses(tx_hash)):
+            self._get_addr_balance_cache.pop(addr, None)  # invalidate cache
+        self.db.remove_txi(tx_hash)
+        self.db.remove_txo(tx_hash)
+        self.db.remove_tx_fee(tx_hash)
+        self.db.remove_verified_tx(tx_hash)
+        self.unverified_tx.pop(tx_hash, None)
+        if tx:
+            for idx, txo in enumerate(tx.outputs()):
+                scripthash = bitcoin.script_to_scripthash(txo.scriptpubkey.hex())
+                prevout = TxOutpoint(bfh(tx_hash), idx)
+                self.db.remove_prevout_by_scripthash(scripthash, prevout=prevout, value=txo.value)
+
+    def get_depending_transactions(self, *tx_hashes: str) -> Set[str]:
+        """Returns all (grand-)children of tx_hashes in this wallet."""
         with self.transaction_lock:
             children = set()
-            for n in self.db.get_spent_outpoints(tx_hash):
-                other_hash = self.db.get_spent_outpoint(tx_hash, n)
-                children.add(other_hash)
-                children |= self.get_depending_transactions(other_hash)
+            todo = list(tx_hashes)
+            while todo:
+                tx_hash = todo.pop()
+                for child in self.db.get_spending_txids(tx_hash):
+                    if child not in children:
+                        children.add(child)
+                        todo.append(child)
             return children
 
     def receive_tx_callback(self, tx_hash: str, tx: Transaction, tx_height: int) -> None:
@@ -361,7 +404,9 @@ class AddressSynchronizer(Logger):
                     self.db.remove_verified_tx(tx_hash)
                     if self.verifier:
                         self.verifier.remove_spv_proof_for_tx(tx_hash)
+                    self.changes.add(tx_hash)
             self.db.set_addr_history(addr, hist)
+            self.changes.add(addr)
 
         for tx_hash, tx_height in hist:
             # add it in case it was previously unconfirmed
@@ -487,6 +532,8 @@ class AddressSynchronizer(Logger):
                 cur_hist.add(txid)
                 self._history_local[addr] = cur_hist
                 self._mark_address_history_changed(addr)
+                self.changes.add(addr)
+            self.changes.add(txid)
 
     def _remove_tx_from_local_history(self, txid):
         with self.transaction_lock:
@@ -498,6 +545,8 @@ class AddressSynchronizer(Logger):
                     pass
                 else:
                     self._history_local[addr] = cur_hist
+                    self.changes.add(addr)
+            self.changes.add(txid)
 
     def _mark_address_history_changed(self, addr: str) -> None:
         # history for this address changed, wake up coroutines:
@@ -521,22 +570,27 @@ class AddressSynchronizer(Logger):
                     self.db.remove_verified_tx(tx_hash)
                 if self.verifier:
                     self.verifier.remove_spv_proof_for_tx(tx_hash)
+                self.changes.add(tx_hash)
         else:
             with self.lock:
                 # tx will be verified only if height > 0
-                self.unverified_tx[tx_hash] = tx_height
+                if self.unverified_tx.get(tx_hash) != tx_height:
+                    self.unverified_tx[tx_hash] = tx_height
+                    self.changes.add(tx_hash)
 
     def remove_unverified_tx(self, tx_hash, tx_height):
         with self.lock:
             new_height = self.unverified_tx.get(tx_hash)
             if new_height == tx_height:
                 self.unverified_tx.pop(tx_hash, None)
+                self.changes.add(tx_hash)
 
     def add_verified_tx(self, tx_hash: str, info: TxMinedInfo):
         # Remove from the unverified map and add to the verified map
         with self.lock:
             self.unverified_tx.pop(tx_hash, None)
             self.db.add_verified_tx(tx_hash, info)
+        self.changes.add(tx_hash)
         tx_mined_status = self.get_tx_height(tx_hash)
         self.network.trigger_callback('verified', self, tx_hash, tx_mined_status)
 
@@ -549,24 +603,25 @@ class AddressSynchronizer(Logger):
         '''Used by the verifier when a reorg has happened'''
         txs = set()
         with self.lock:
-            for tx_hash in self.db.list_verified_tx():
-                info = self.db.get_verified_tx(tx_hash)
+            verified = [(tx_hash, self.db.get_verified_tx(tx_hash))
+                        for tx_hash in self.db.list_verified_tx_above(above_height)]
+            header_hashes = blockchain.get_header_hashes(info.height for _, info in verified)
+            for tx_hash, info in verified:
                 tx_height = info.height
-                if tx_height > above_height:
-                    header = blockchain.read_header(tx_height)
-                    if not header or hash_header(header) != info.header_hash:
-                        self.db.remove_verified_tx(tx_hash)
-                        # NOTE: we should add these txns to self.unverified_tx,
-                        # but with what height?
-                        # If on the new fork after the reorg, the txn is at the
-                        # same height, we will not get a status update for the
-                        # address. If the txn is not mined or at a diff height,
-                        # we should get a status update. Unless we put tx into
-                        # unverified_tx, it will turn into local. So we put it
-                        # into unverified_tx with the old height, and if we get
-                        # a status update, that will overwrite it.
-                        self.unverified_tx[tx_hash] = tx_height
-                        txs.add(tx_hash)
+                if header_hashes.get(tx_height) != info.header_hash:
+                    self.db.remove_verified_tx(tx_hash)
+                    # NOTE: we should add these txns to self.unverified_tx,
+                    # but with what height?
+                    # If on the new fork after the reorg, the txn is at the
+                    # same height, we will not get a status update for the
+                    # address. If the txn is not mined or at a diff height,
+                    # we should get a status update. Unless we put tx into
+                    # unverified_tx, it will turn into local. So we put it
+                    # into unverified_tx with the old height, and if we get
+                    # a status update, that will overwrite it.
+                    self.unverified_tx[tx_hash] = tx_height
+                    txs.add(tx_hash)
+        self.changes.add(*txs)
         return txs
 
     def get_local_height(self) -> int:
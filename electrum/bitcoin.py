@@ -24,6 +24,7 @@
 # SOFTWARE.
 
 import hashlib
+import functools
 from typing import List, Tuple, TYPE_CHECKING, Optional, Union
 from enum import IntEnum
 
@@ -399,8 +400,19 @@ def script_to_address(script: str, *, net=None) -> str:
     return get_address_from_output_script(bfh(script), net=net)
 
 
+# address strings are decoded over and over again (history, imports, GUI);
+# the results only depend on the string and the network, so cache them
+ADDRESS_CACHE_SIZE = 2**15
+
+
 def address_to_script(addr: str, *, net=None) -> str:
     if net is None: net = constants.net
+    if not isinstance(addr, str):
+        raise BitcoinException(f"invalid bitcoin address: {addr}")
+    return _address_to_script(addr, net)
+
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def _address_to_script(addr: str, net) -> str:
     if not is_address(addr, net=net):
         raise BitcoinException(f"invalid bitcoin address: {addr}")
     witver, witprog = segwit_addr.decode(net.SEGWIT_HRP, addr)
@@ -422,7 +434,13 @@ def address_to_script(addr: str, *, net=None) -> str:
     return script
 
 def address_to_scripthash(addr: str) -> str:
-    script = address_to_script(addr)
+    if not isinstance(addr, str):
+        raise BitcoinException(f"invalid bitcoin address: {addr}")
+    return _address_to_scripthash(addr, constants.net)
+
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def _address_to_scripthash(addr: str, net) -> str:
+    script = address_to_script(addr, net=net)
     return script_to_scripthash(script)
 
 def script_to_scripthash(script: str) -> str:
@@ -446,31 +464,42 @@ __b43chars = b'0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ$*+-./:'
 assert len(__b43chars) == 43
 
 
+def _make_decode_table(chars: bytes) -> bytes:
+    table = bytearray([0xff]) * 256
+    for digit, c in enumerate(chars):
+        table[c] = digit
+    return bytes(table)
+
+
+# per base: (chars, char -> digit table, digits per chunk, base**digits per chunk)
+# Chunks of digits are converted with small ints, so the big int is only
+# multiplied/divided once per chunk instead of once per digit.
+__base_params = {
+    58: (__b58chars, _make_decode_table(__b58chars), 10, 58**10),
+    43: (__b43chars, _make_decode_table(__b43chars), 11, 43**11),
+}
+
+
 def base_encode(v: bytes, base: int) -> str:
     """ encode v, which is a string of bytes, to base58."""
     assert_bytes(v)
     if base not in (58, 43):
         raise ValueError('not supported base: {}'.format(base))
-    chars = __b58chars
-    if base == 43:
-        chars = __b43chars
-    long_value = 0
-    for (i, c) in enumerate(v[::-1]):
-        long_value += (256**i) * c
+    chars, _, chunk_len, chunk_base = __base_params[base]
+    long_value = int.from_bytes(v, byteorder='big')
     result = bytearray()
+    while long_value >= chunk_base:
+        long_value, chunk = divmod(long_value, chunk_base)
+        for _ in range(chunk_len):
+            chunk, mod = divmod(chunk, base)
+            result.append(chars[mod])
     while long_value >= base:
-        div, mod = divmod(long_value, base)
+        long_value, mod = divmod(long_value, base)
         result.append(chars[mod])
-        long_value = div
     result.append(chars[long_value])
     # Bitcoin does a little leading-zero-compression:
     # leading 0-bytes in the input become leading-1s
-    nPad = 0
-    for c in v:
-        if c == 0x00:
-            nPad += 1
-        else:
-            break
+    nPad = len(v) - len(v.lstrip(b'\x00'))
     result.extend([chars[0]] * nPad)
     result.reverse()
     return result.decode('ascii')
@@ -482,32 +511,24 @@ def base_decode(v: Union[bytes, str], length: Optional[int], base: int) -> Optio
     v = to_bytes(v, 'ascii')
     if base not in (58, 43):
         raise ValueError('not supported base: {}'.format(base))
-    chars = __b58chars
-    if base == 43:
-        chars = __b43chars
+    chars, decode_table, chunk_len, chunk_base = __base_params[base]
+    digits = v.translate(decode_table)
+    bad_pos = digits.rfind(b'\xff')
+    if bad_pos != -1:
+        raise ValueError('Forbidden character {} for base {}'.format(v[bad_pos], base))
     long_value = 0
-    for (i, c) in enumerate(v[::-1]):
-        digit = chars.find(bytes([c]))
-        if digit == -1:
-            raise ValueError('Forbidden character {} for base {}'.format(c, base))
-        long_value += digit * (base**i)
-    result = bytearray()
-    while long_value >= 256:
-        div, mod = divmod(long_value, 256)
-        result.append(mod)
-        long_value = div
-    result.append(long_value)
-    nPad = 0
-    for c in v:
-        if c == chars[0]:
-            nPad += 1
-        else:
-            break
-    result.extend(b'\x00' * nPad)
+    for i in range(0, len(digits), chunk_len):
+        chunk = digits[i:i+chunk_len]
+        chunk_value = 0
+        for digit in chunk:
+            chunk_value = chunk_value * base + digit
+        long_value = long_value * (chunk_base if len(chunk) == chunk_len else base**len(chunk)) + chunk_value
+    result = long_value.to_bytes(max(1, (long_value.bit_length() + 7) // 8), byteorder='big')
+    nPad = len(v) - len(v.lstrip(chars[0:1]))
+    result = bytes(nPad) + result
     if length is not None and len(result) != length:
         return None
-    result.reverse()
-    return bytes(result)
+    return result
 
 
 class InvalidChecksum(Exception):
@@ -623,6 +644,8 @@ def address_from_private_key(sec: str) -> str:
 
 def is_segwit_address(addr: str, *, net=None) -> bool:
     if net is None: net = constants.net
+    if not isinstance(addr, str) or not addr.lower().startswith(net.SEGWIT_HRP + '1'):
+        return False
     try:
         witver, witprog = segwit_addr.decode(net.SEGWIT_HRP, addr)
     except Exception as e:
@@ -641,6 +664,12 @@ def is_b58_address(addr: str, *, net=None) -> bool:
 
 def is_address(addr: str, *, net=None) -> bool:
     if net is None: net = constants.net
+    if not isinstance(addr, str):
+        return False
+    return _is_address(addr, net)
+
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def _is_address(addr: str, net) -> bool:
     return is_segwit_address(addr, net=net) \
            or is_b58_address(addr, net=net)
 
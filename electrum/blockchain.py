@@ -22,7 +22,7 @@
 # SOFTWARE.
 import os
 import threading
-from typing import Optional, Dict, Mapping, Sequence
+from typing import Optional, Dict, Mapping, Sequence, Iterable
 
 from . import util
 from .bitcoin import hash_encode, int_to_hex, rev_hex
@@ -36,6 +36,8 @@ from .logging import get_logger, Logger
 _logger = get_logger(__name__)
 
 HEADER_SIZE = 80  # bytes
+# heights closer than this are read from the headers file in one go
+MAX_HEADER_READ_GAP = 2016
 MAX_TARGET = 0x00000000FFFF0000000000000000000000000000000000000000000000000000
 
 
@@ -464,6 +466,41 @@ class Blockchain(Logger):
             return None
         return deserialize_header(h, height)
 
+    @with_lock
+    def get_header_hashes(self, heights: Iterable[int]) -> Dict[int, Optional[str]]:
+        """Returns the hashes of the headers at the given heights, with None
+        for the heights we do not have a header for. Nearby heights are
+        read from the headers file with a single read.
+        """
+        heights = sorted(set(heights))
+        result = {height: None for height in heights}
+        below = [height for height in heights if 0 <= height < self.forkpoint]
+        if below:
+            result.update(self.parent.get_header_hashes(below))
+        heights = [height for height in heights if self.forkpoint <= height <= self.height()]
+        if not heights:
+            return result
+        runs = [[heights[0]]]
+        for height in heights[1:]:
+            if height - runs[-1][-1] < MAX_HEADER_READ_GAP:
+                runs[-1].append(height)
+            else:
+                runs.append([height])
+        name = self.path()
+        self.assert_headers_file_available(name)
+        with open(name, 'rb') as f:
+            for run in runs:
+                start = run[0]
+                f.seek((start - self.forkpoint) * HEADER_SIZE)
+                data = f.read((run[-1] - start + 1) * HEADER_SIZE)
+                for height in run:
+                    offset = (height - start) * HEADER_SIZE
+                    h = data[offset:offset + HEADER_SIZE]
+                    if len(h) < HEADER_SIZE or h == bytes([0])*HEADER_SIZE:
+                        continue
+                    result[height] = hash_encode(sha256d(h))
+        return result
+
     def header_at_tip(self) -> Optional[dict]:
         """Return latest header."""
         height = self.height()
@@ -27,10 +27,15 @@ import time
 import random
 import os
 from collections import defaultdict
-from typing import Sequence, List, Tuple, Optional, Dict, NamedTuple, TYPE_CHECKING, Set
+from typing import Sequence, List, Tuple, Optional, Dict, NamedTuple, TYPE_CHECKING, Set, Iterable
 import binascii
 import base64
 import asyncio
+import struct
+import mmap
+import hashlib
+import bisect
+from array import array
 
 
 from .sql_db import SqlDB, sql
@@ -56,6 +61,8 @@ def validate_features(features : int):
 FLAG_DISABLE   = 1 << 1
 FLAG_DIRECTION = 1 << 0
 
+_NO_HTLC_MAX = 2**64 - 1  # stands for htlc_maximum_msat=None in fixed-width encodings
+
 class ChannelInfo(NamedTuple):
     short_channel_id: ShortChannelID
     node1_id: bytes
@@ -235,35 +242,462 @@ PRIMARY KEY(node_id)
 )"""
 
 
+create_graph_version = """
+CREATE TABLE IF NOT EXISTS graph_version (
+version INTEGER NOT NULL
+)"""
+
+
+# Binary snapshot of the channel graph (channel_info and policy tables).
+# Layout: header, node ids, channel records, policy records, sha256 of all that.
+# Channel and policy records refer to nodes by their index in the node id array.
+GRAPH_SNAPSHOT_MAGIC = b'ELGS'
+GRAPH_SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct('>4sHQIII')  # magic, format version, graph version, #nodes, #channels, #policies
+_SNAPSHOT_CHANNEL = struct.Struct('>8sIIq')  # scid, node1 index, node2 index, capacity (-1 if unknown)
+_SNAPSHOT_POLICY = struct.Struct('>8sIHQQIIBBI')  # scid, start node index, then the Policy fields
+_SNAPSHOT_NODE_ID_LEN = 33
+# the same records, with the scid read as an integer
+_SNAPSHOT_CHANNEL_COLUMNS = struct.Struct('>QIIq')
+_SNAPSHOT_POLICY_COLUMNS = struct.Struct('>QIHQQIIBBI')
+
+
+def serialize_graph_snapshot(graph_version: int, channels: Sequence[ChannelInfo],
+                             policies: Sequence[Policy]) -> bytes:
+    node_ids = {}  # type: Dict[bytes, int]
+    def node_index(node_id: bytes) -> int:
+        idx = node_ids.get(node_id)
+        if idx is None:
+            if len(node_id) != _SNAPSHOT_NODE_ID_LEN:
+                raise ValueError(f'unexpected node_id length: {len(node_id)}')
+            idx = node_ids[node_id] = len(node_ids)
+        return idx
+    chan_records = [_SNAPSHOT_CHANNEL.pack(bytes(ci.short_channel_id),
+                                           node_index(ci.node1_id),
+                                           node_index(ci.node2_id),
+                                           -1 if ci.capacity_sat is None else ci.capacity_sat)
+                    for ci in channels]
+    policy_records = [_SNAPSHOT_POLICY.pack(bytes(p.short_channel_id),
+                                            node_index(p.start_node),
+                                            p.cltv_expiry_delta,
+                                            p.htlc_minimum_msat,
+                                            _NO_HTLC_MAX if p.htlc_maximum_msat is None else p.htlc_maximum_msat,
+                                            p.fee_base_msat,
+                                            p.fee_proportional_millionths,
+                                            p.channel_flags,
+                                            p.message_flags,
+                                            p.timestamp)
+                      for p in policies]
+    header = _SNAPSHOT_HEADER.pack(GRAPH_SNAPSHOT_MAGIC, GRAPH_SNAPSHOT_VERSION, graph_version,
+                                   len(node_ids), len(chan_records), len(policy_records))
+    body = b''.join([header, *node_ids.keys(), *chan_records, *policy_records])
+    return body + hashlib.sha256(body).digest()
+
+
+def _split_graph_snapshot(data) -> Tuple[int, List[bytes], bytes, bytes]:
+    """Checks the framing of a snapshot. Returns its graph version, its
+    node ids, and its channel and policy records.
+    """
+    data = memoryview(data)
+    body = data[:-32]
+    try:
+        if len(data) < _SNAPSHOT_HEADER.size + 32:
+            raise ValueError('graph snapshot too short')
+        if hashlib.sha256(body).digest() != data[-32:]:
+            raise ValueError('graph snapshot checksum mismatch')
+        magic, fmt_version, graph_version, num_nodes, num_channels, num_policies = _SNAPSHOT_HEADER.unpack_from(body)
+        if magic != GRAPH_SNAPSHOT_MAGIC or fmt_version != GRAPH_SNAPSHOT_VERSION:
+            raise ValueError('unknown graph snapshot format')
+        pos = _SNAPSHOT_HEADER.size
+        nodes_end = pos + num_nodes * _SNAPSHOT_NODE_ID_LEN
+        chans_end = nodes_end + num_channels * _SNAPSHOT_CHANNEL.size
+        policies_end = chans_end + num_policies * _SNAPSHOT_POLICY.size
+        if policies_end != len(body):
+            raise ValueError('graph snapshot has unexpected length')
+        node_bytes = bytes(body[pos:nodes_end])
+        node_ids = [node_bytes[i:i + _SNAPSHOT_NODE_ID_LEN]
+                    for i in range(0, len(node_bytes), _SNAPSHOT_NODE_ID_LEN)]
+        return graph_version, node_ids, bytes(body[nodes_end:chans_end]), bytes(body[chans_end:])
+    finally:
+        # views on a mmap must be released before it can be closed
+        body.release()
+        data.release()
+
+
+def deserialize_graph_snapshot(data) -> Tuple[int, List[ChannelInfo], List[Policy]]:
+    """Parses the output of serialize_graph_snapshot.
+    'data' can be any buffer (e.g. a mmap). Raises ValueError if it is malformed.
+    """
+    graph_version, node_ids, chan_records, policy_records = _split_graph_snapshot(data)
+    try:
+        channels = [ChannelInfo(short_channel_id=ShortChannelID(scid),
+                                node1_id=node_ids[n1],
+                                node2_id=node_ids[n2],
+                                capacity_sat=None if capacity < 0 else capacity)
+                    for scid, n1, n2, capacity in _SNAPSHOT_CHANNEL.iter_unpack(chan_records)]
+        policies = [Policy(key=scid + node_ids[node],
+                           cltv_expiry_delta=cltv,
+                           htlc_minimum_msat=htlc_min,
+                           htlc_maximum_msat=None if htlc_max == _NO_HTLC_MAX else htlc_max,
+                           fee_base_msat=fee_base,
+                           fee_proportional_millionths=fee_prop,
+                           channel_flags=channel_flags,
+                           message_flags=message_flags,
+                           timestamp=timestamp)
+                    for (scid, node, cltv, htlc_min, htlc_max, fee_base, fee_prop,
+                         channel_flags, message_flags, timestamp) in _SNAPSHOT_POLICY.iter_unpack(policy_records)]
+    except (struct.error, IndexError) as e:
+        raise ValueError(f'malformed graph snapshot: {e!r}') from e
+    return graph_version, channels, policies
+
+
+class GraphStore:
+    """Compact in-memory representation of the channel graph.
+
+    Node ids are interned to integer indices. Channels are stored in
+    parallel arrays indexed by a slot number, and every slot owns two
+    fixed-width policy records, one per direction. short_channel_ids are
+    found through a sorted array (plus a dict of recent additions), and
+    the channels of a node through CSR offset arrays (plus a dict of
+    recent additions). compact() folds the recent additions back in.
+
+    ChannelInfo and Policy objects are only created when requested.
+    """
+
+    # present, cltv_expiry_delta, htlc_minimum_msat, htlc_maximum_msat, fee_base_msat,
+    # fee_proportional_millionths, channel_flags, message_flags, timestamp
+    _POLICY = struct.Struct('<BHQQIIBBI')
+    _NONE = 0xffffffff  # unused slot / node index
+
+    def __init__(self):
+        self._node_index = {}  # type: Dict[bytes, int]
+        self._node_ids = []  # type: List[bytes]
+        # channels, indexed by slot
+        self._scids = array('Q')
+        self._node1 = array('I')
+        self._node2 = array('I')
+        self._capacity = array('q')  # -1 if unknown
+        self._policy_records = bytearray()  # two records per slot
+        self._free_slots = []  # type: List[int]
+        self.num_channels = 0
+        self.num_policies = 0
+        # scid -> slot: (sorted scids, corresponding slots), and recent additions
+        self._index = (array('Q'), array('I'))
+        self._recent_slots = {}  # type: Dict[int, int]
+        # node index -> slots: (offsets, slots) in CSR form, and recent additions
+        self._adjacency = (array('I', [0]), array('I'))
+        self._recent_adjacency = defaultdict(list)  # type: Dict[int, List[int]]
+
+    def load_snapshot(self, data) -> Tuple[int, List[bytes]]:
+        """Fills an empty store from the output of serialize_graph_snapshot,
+        without creating ChannelInfo and Policy objects. Returns the graph
+        version, and the keys of the policies that do not belong to any
+        channel of the snapshot. Raises ValueError if it is malformed.
+        """
+        assert self.num_channels == 0 and not self._node_ids
+        graph_version, node_ids, chan_records, policy_records = _split_graph_snapshot(data)
+        try:
+            columns = list(zip(*_SNAPSHOT_CHANNEL_COLUMNS.iter_unpack(chan_records))) or [(), (), (), ()]
+            scids, node1, node2, capacity = columns
+            num_channels = len(scids)
+            if num_channels and max(max(node1), max(node2)) >= len(node_ids):
+                raise ValueError('unknown node index')
+            slots = dict(zip(scids, range(num_channels)))
+            if len(slots) != num_channels:
+                raise ValueError('duplicate channel')
+            records = bytearray(2 * num_channels * self._POLICY.size)
+            pack_into = self._POLICY.pack_into
+            size = self._POLICY.size
+            num_policies = 0
+            orphaned = []
+            for (scid, node, cltv, htlc_min, htlc_max, fee_base, fee_prop,
+                 channel_flags, message_flags, timestamp) in _SNAPSHOT_POLICY_COLUMNS.iter_unpack(policy_records):
+                slot = slots.get(scid)
+                if slot is not None and node == node1[slot]:
+                    offset = 2 * slot * size
+                elif slot is not None and node == node2[slot]:
+                    offset = (2 * slot + 1) * size
+                else:
+                    orphaned.append(scid.to_bytes(8, 'big') + node_ids[node])
+                    continue
+                if not records[offset]:
+                    num_policies += 1
+                pack_into(records, offset, 1, cltv, htlc_min, htlc_max, fee_base, fee_prop,
+                          channel_flags, message_flags, timestamp)
+        except (struct.error, IndexError) as e:
+            raise ValueError(f'malformed graph snapshot: {e!r}') from e
+        self._node_ids = node_ids
+        self._node_index = {node_id: idx for idx, node_id in enumerate(node_ids)}
+        self._scids = array('Q', scids)
+        self._node1 = array('I', node1)
+        self._node2 = array('I', node2)
+        self._capacity = array('q', capacity)
+        self._policy_records = records
+        self.num_channels = num_channels
+        self.num_policies = num_policies
+        self.compact()
+        return graph_version, orphaned
+
+    def _intern_node(self, node_id: bytes) -> int:
+        idx = self._node_index.get(node_id)
+        if idx is None:
+            idx = self._node_index[node_id] = len(self._node_ids)
+            self._node_ids.append(node_id)
+        return idx
+
+    def _find_slot(self, short_channel_id: bytes) -> Optional[int]:
+        scid = int.from_bytes(short_channel_id, 'big')
+        slot = self._recent_slots.get(scid)
+        if slot is not None:
+            return slot
+        scids, slots = self._index
+        i = bisect.bisect_left(scids, scid)
+        if i < len(scids) and scids[i] == scid and slots[i] != self._NONE:
+            return slots[i]
+        return None
+
+    def _unindex_slot(self, scid: int):
+        if self._recent_slots.pop(scid, None) is not None:
+            return
+        scids, slots = self._index
+        i = bisect.bisect_left(scids, scid)
+        if i < len(scids) and scids[i] == scid:
+            slots[i] = self._NONE
+
+    def has_node(self, node_id: bytes) -> bool:
+        return node_id in self._node_index
+
+    def num_nodes(self) -> int:
+        return len(self._node_ids)
+
+    def has_channel(self, short_channel_id: bytes) -> bool:
+        return self._find_slot(short_channel_id) is not None
+
+    def add_channel(self, channel_info: ChannelInfo) -> bool:
+        if not self._add_channel(channel_info):
+            return False
+        if len(self._recent_slots) > max(1024, self.num_channels // 8):
+            self.compact()
+        return True
+
+    def add_channels(self, channel_infos: Iterable[ChannelInfo]) -> int:
+        """Adds many channels, and rebuilds the indexes once at the end.
+        Returns the number of channels that were added."""
+        num_added = sum(self._add_channel(ci) for ci in channel_infos)
+        self.compact()
+        return num_added
+
+    def _add_channel(self, channel_info: ChannelInfo) -> bool:
+        if self.has_channel(channel_info.short_channel_id):
+            return False
+        n1 = self._intern_node(channel_info.node1_id)
+        n2 = self._intern_node(channel_info.node2_id)
+        scid = int.from_bytes(channel_info.short_channel_id, 'big')
+        capacity = -1 if channel_info.capacity_sat is None else channel_info.capacity_sat
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self._scids[slot] = scid
+            self._node1[slot] = n1
+            self._node2[slot] = n2
+            self._capacity[slot] = capacity
+        else:
+            slot = len(self._scids)
+            self._scids.append(scid)
+            self._node1.append(n1)
+            self._node2.append(n2)
+            self._capacity.append(capacity)
+            self._policy_records.extend(bytes(2 * self._POLICY.size))
+        self._recent_slots[scid] = slot
+        self._recent_adjacency[n1].append(slot)
+        self._recent_adjacency[n2].append(slot)
+        self.num_channels += 1
+        return True
+
+    def remove_channel(self, short_channel_id: bytes) -> Optional[ChannelInfo]:
+        """Removes the channel and its policies."""
+        slot = self._find_slot(short_channel_id)
+        if slot is None:
+            return None
+        channel_info = self._channel_info_at(slot)
+        for direction in (0, 1):
+            self._clear_policy(slot, direction)
+        self._unindex_slot(self._scids[slot])
+        self._node1[slot] = self._node2[slot] = self._NONE
+        self._free_slots.append(slot)
+        self.num_channels -= 1
+        return channel_info
+
+    def _channel_info_at(self, slot: int) -> ChannelInfo:
+        capacity = self._capacity[slot]
+        return ChannelInfo(short_channel_id=ShortChannelID(self._scids[slot].to_bytes(8, 'big')),
+                           node1_id=self._node_ids[self._node1[slot]],
+                           node2_id=self._node_ids[self._node2[slot]],
+                           capacity_sat=None if capacity < 0 else capacity)
+
+    def get_channel_info(self, short_channel_id: bytes) -> Optional[ChannelInfo]:
+        slot = self._find_slot(short_channel_id)
+        return self._channel_info_at(slot) if slot is not None else None
+
+    def channel_ids(self) -> Iterable[ShortChannelID]:
+        for slot, n1 in enumerate(self._node1):
+            if n1 != self._NONE:
+                yield ShortChannelID(self._scids[slot].to_bytes(8, 'big'))
+
+    def _direction(self, slot: int, node_id: bytes) -> Optional[int]:
+        idx = self._node_index.get(node_id)
+        if idx is None:
+            return None
+        if self._node1[slot] == idx:
+            return 0
+        if self._node2[slot] == idx:
+            return 1
+        return None
+
+    def _clear_policy(self, slot: int, direction: int):
+        offset = (2 * slot + direction) * self._POLICY.size
+        if self._policy_records[offset]:
+            self._policy_records[offset:offset + self._POLICY.size] = bytes(self._POLICY.size)
+            self.num_policies -= 1
+
+    def set_policy(self, policy: Policy) -> bool:
+        """Stores the policy. Returns False if it does not belong to a known channel."""
+        slot = self._find_slot(policy.short_channel_id)
+        if slot is None:
+            return False
+        direction = self._direction(slot, policy.start_node)
+        if direction is None:
+            return False
+        offset = (2 * slot + direction) * self._POLICY.size
+        if not self._policy_records[offset]:
+            self.num_policies += 1
+        self._POLICY.pack_into(self._policy_records, offset, 1,
+                               policy.cltv_expiry_delta,
+                               policy.htlc_minimum_msat,
+                               _NO_HTLC_MAX if policy.htlc_maximum_msat is None else policy.htlc_maximum_msat,
+                               policy.fee_base_msat,
+                               policy.fee_proportional_millionths,
+                               policy.channel_flags,
+                               policy.message_flags,
+                               policy.timestamp)
+        return True
+
+    def remove_policy(self, short_channel_id: bytes, node_id: bytes):
+        slot = self._find_slot(short_channel_id)
+        if slot is None:
+            return
+        direction = self._direction(slot, node_id)
+        if direction is not None:
+            self._clear_policy(slot, direction)
+
+    def _policy_at(self, slot: int, direction: int) -> Optional[Policy]:
+        (present, cltv, htlc_min, htlc_max, fee_base, fee_prop, channel_flags, message_flags,
+         timestamp) = self._POLICY.unpack_from(self._policy_records, (2 * slot + direction) * self._POLICY.size)
+        if not present:
+            return None
+        node = self._node1[slot] if direction == 0 else self._node2[slot]
+        return Policy(key=self._scids[slot].to_bytes(8, 'big') + self._node_ids[node],
+                      cltv_expiry_delta=cltv,
+                      htlc_minimum_msat=htlc_min,
+                      htlc_maximum_msat=None if htlc_max == _NO_HTLC_MAX else htlc_max,
+                      fee_base_msat=fee_base,
+                      fee_proportional_millionths=fee_prop,
+                      channel_flags=channel_flags,
+                      message_flags=message_flags,
+                      timestamp=timestamp)
+
+    def get_policy(self, short_channel_id: bytes, node_id: bytes) -> Optional[Policy]:
+        slot = self._find_slot(short_channel_id)
+        if slot is None:
+            return None
+        direction = self._direction(slot, node_id)
+        if direction is None:
+            return None
+        return self._policy_at(slot, direction)
+
+    def policies(self) -> Iterable[Policy]:
+        for slot, n1 in enumerate(self._node1):
+            if n1 == self._NONE:
+                continue
+            for direction in (0, 1):
+                policy = self._policy_at(slot, direction)
+                if policy is not None:
+                    yield policy
+
+    def orphaned_channels(self) -> List[ShortChannelID]:
+        """Channels without any policy."""
+        size = self._POLICY.size
+        records = self._policy_records
+        return [ShortChannelID(self._scids[slot].to_bytes(8, 'big'))
+                for slot, n1 in enumerate(self._node1)
+                if n1 != self._NONE and not records[2 * slot * size] and not records[(2 * slot + 1) * size]]
+
+    def get_channels_for_node(self, node_id: bytes) -> Set[ShortChannelID]:
+        idx = self._node_index.get(node_id)
+        if idx is None:
+            return set()
+        offsets, adjacent = self._adjacency
+        slots = list(adjacent[offsets[idx]:offsets[idx + 1]]) if idx + 1 < len(offsets) else []
+        slots += self._recent_adjacency.get(idx, [])
+        # slots may have been freed, or reused by another channel, since they were added
+        return {ShortChannelID(self._scids[slot].to_bytes(8, 'big'))
+                for slot in slots
+                if self._node1[slot] == idx or self._node2[slot] == idx}
+
+    def compact(self):
+        """Rebuilds the sorted scid index and the CSR adjacency arrays."""
+        live = [slot for slot, n1 in enumerate(self._node1) if n1 != self._NONE]
+        live.sort(key=self._scids.__getitem__)
+        index = (array('Q', (self._scids[slot] for slot in live)), array('I', live))
+        counts = [0] * (len(self._node_ids) + 1)
+        for slot in live:
+            counts[self._node1[slot] + 1] += 1
+            counts[self._node2[slot] + 1] += 1
+        for i in range(1, len(counts)):
+            counts[i] += counts[i - 1]
+        offsets = array('I', counts)
+        fill = counts[:-1]
+        adjacent = array('I', [0]) * counts[-1]
+        for slot in live:
+            for node in (self._node1[slot], self._node2[slot]):
+                adjacent[fill[node]] = slot
+                fill[node] += 1
+        # replace whole tuples, so that concurrent readers see consistent arrays
+        self._index = index
+        self._recent_slots = {}
+        self._adjacency = (offsets, adjacent)
+        self._recent_adjacency = defaultdict(list)
+
+
 class ChannelDB(SqlDB):
 
     NUM_MAX_RECENT_PEERS = 20
 
     def __init__(self, network: 'Network'):
         path = os.path.join(get_headers_dir(network.config), 'channel_db')
+        # set before starting the sql thread, which uses them
+        self.snapshot_path = os.path.join(get_headers_dir(network.config), 'channel_db_graph')
+        self._snapshot_version = None  # graph_version of the snapshot on disk, if known to be valid
         super().__init__(network, path, commit_interval=100)
         self.num_nodes = 0
         self.num_channels = 0
         self._channel_updates_for_private_channels = {}  # type: Dict[Tuple[bytes, bytes], dict]
         self.ca_verifier = LNChannelVerifier(network, self)
         # initialized in load_data
-        self._channels = {}  # type: Dict[bytes, ChannelInfo]
-        self._policies = {}
+        self._graph = GraphStore()
         self._nodes = {}
         # node_id -> (host, port, ts)
         self._addresses = defaultdict(set)  # type: Dict[bytes, Set[Tuple[str, int, int]]]
-        self._channels_for_node = defaultdict(set)
         self.data_loaded = asyncio.Event()
         self.network = network # only for callback
 
     def update_counts(self):
         self.num_nodes = len(self._nodes)
-        self.num_channels = len(self._channels)
-        self.num_policies = len(self._policies)
+        self.num_channels = self._graph.num_channels
+        self.num_policies = self._graph.num_policies
         self.network.trigger_callback('channel_db', self.num_nodes, self.num_channels, self.num_policies)
 
     def get_channel_ids(self):
-        return set(self._channels.keys())
+        return set(self._graph.channel_ids())
 
     def add_recent_peer(self, peer: LNPeerAddr):
         now = int(time.time())
@@ -298,10 +732,10 @@ class ChannelDB(SqlDB):
     def add_channel_announcement(self, msg_payloads, trusted=True):
         if type(msg_payloads) is dict:
             msg_payloads = [msg_payloads]
-        added = 0
+        added = []
         for msg in msg_payloads:
             short_channel_id = ShortChannelID(msg['short_channel_id'])
-            if short_channel_id in self._channels:
+            if self._graph.has_channel(short_channel_id):
                 continue
             if constants.net.rev_genesis_bytes() != msg['chain_hash']:
                 self.logger.info("ChanAnn has unexpected chain_hash {}".format(bh2u(msg['chain_hash'])))
@@ -311,16 +745,14 @@ class ChannelDB(SqlDB):
             except UnknownEvenFeatureBits:
                 self.logger.info("unknown feature bits")
                 continue
-            added += 1
-            self._channels[short_channel_id] = channel_info
-            self._channels_for_node[channel_info.node1_id].add(channel_info.short_channel_id)
-            self._channels_for_node[channel_info.node2_id].add(channel_info.short_channel_id)
-            self.save_channel(channel_info)
+            added.append(channel_info)
+            self._graph.add_channel(channel_info)
             if not trusted:
                 self.ca_verifier.add_new_channel_info(channel_info.short_channel_id, msg)
-
+        if added:
+            self.save_channels(added)
         self.update_counts()
-        self.logger.debug('add_channel_announcement: %d/%d'%(added, len(msg_payloads)))
+        self.logger.debug('add_channel_announcement: %d/%d'%(len(added), len(msg_payloads)))
 
     def print_change(self, old_policy: Policy, new_policy: Policy):
         # print what changed between policies
@@ -354,7 +786,7 @@ class ChannelDB(SqlDB):
             if max_age and now - timestamp > max_age:
                 expired.append(payload)
                 continue
-            channel_info = self._channels.get(short_channel_id)
+            channel_info = self._graph.get_channel_info(short_channel_id)
             if not channel_info:
                 orphaned.append(payload)
                 continue
@@ -364,12 +796,12 @@ class ChannelDB(SqlDB):
             payload['start_node'] = start_node
             known.append(payload)
         # compare updates to existing database entries
+        new_policies = []
         for payload in known:
             timestamp = int.from_bytes(payload['timestamp'], "big")
             start_node = payload['start_node']
             short_channel_id = ShortChannelID(payload['short_channel_id'])
-            key = (start_node, short_channel_id)
-            old_policy = self._policies.get(key)
+            old_policy = self._graph.get_policy(short_channel_id, start_node)
             if old_policy and timestamp <= old_policy.timestamp:
                 deprecated.append(payload)
                 continue
@@ -377,8 +809,10 @@ class ChannelDB(SqlDB):
             if verify:
                 self.verify_channel_update(payload)
             policy = Policy.from_msg(payload)
-            self._policies[key] = policy
-            self.save_policy(policy)
+            self._graph.set_policy(policy)
+            new_policies.append(policy)
+        if new_policies:
+            self.save_policies(new_policies)
         #
         self.update_counts()
         return CategorizedChannelUpdates(
@@ -400,33 +834,49 @@ class ChannelDB(SqlDB):
         c.execute(create_address)
         c.execute(create_policy)
         c.execute(create_channel_info)
+        c.execute(create_graph_version)
+        c.execute("SELECT count(*) FROM graph_version")
+        if c.fetchone()[0] == 0:
+            c.execute("INSERT INTO graph_version (version) VALUES (0)")
         self.conn.commit()
 
+    def _bump_graph_version(self, c):
+        # lets us tell whether a graph snapshot still matches the tables
+        c.execute("UPDATE graph_version SET version = version + 1")
+
+    def _get_graph_version(self) -> int:
+        c = self.conn.cursor()
+        c.execute("SELECT version FROM graph_version")
+        return int(c.fetchone()[0])
+
     @sql
-    def save_policy(self, policy):
+    def save_policies(self, policies: Sequence[Policy]):
         c = self.conn.cursor()
-        c.execute("""REPLACE INTO policy (key, cltv_expiry_delta, htlc_minimum_msat, htlc_maximum_msat, fee_base_msat, fee_proportional_millionths, channel_flags, message_flags, timestamp) VALUES (?,?,?,?,?,?,?,?,?)""", list(policy))
+        c.executemany("""REPLACE INTO policy (key, cltv_expiry_delta, htlc_minimum_msat, htlc_maximum_msat, fee_base_msat, fee_proportional_millionths, channel_flags, message_flags, timestamp) VALUES (?,?,?,?,?,?,?,?,?)""", [tuple(p) for p in policies])
+        self._bump_graph_version(c)
 
     @sql
-    def delete_policy(self, node_id, short_channel_id):
-        key = short_channel_id + node_id
+    def delete_policies(self, keys: Sequence[Tuple[bytes, bytes]]):
         c = self.conn.cursor()
-        c.execute("""DELETE FROM policy WHERE key=?""", (key,))
+        c.executemany("""DELETE FROM policy WHERE key=?""", [(short_channel_id + node_id,) for node_id, short_channel_id in keys])
+        self._bump_graph_version(c)
 
     @sql
-    def save_channel(self, channel_info):
+    def save_channels(self, channel_infos: Sequence[ChannelInfo]):
         c = self.conn.cursor()
-        c.execute("REPLACE INTO channel_info (short_channel_id, node1_id, node2_id, capacity_sat) VALUES (?,?,?,?)", list(channel_info))
+        c.executemany("REPLACE INTO channel_info (short_channel_id, node1_id, node2_id, capacity_sat) VALUES (?,?,?,?)", [tuple(ci) for ci in channel_infos])
+        self._bump_graph_version(c)
 
     @sql
-    def delete_channel(self, short_channel_id):
+    def delete_channels(self, short_channel_ids: Sequence[bytes]):
         c = self.conn.cursor()
-        c.execute("""DELETE FROM channel_info WHERE short_channel_id=?""", (short_channel_id,))
+        c.executemany("""DELETE FROM channel_info WHERE short_channel_id=?""", [(scid,) for scid in short_channel_ids])
+        self._bump_graph_version(c)
 
     @sql
-    def save_node(self, node_info):
+    def save_nodes(self, node_infos: Sequence[NodeInfo]):
         c = self.conn.cursor()
-        c.execute("REPLACE INTO node_info (node_id, features, timestamp, alias) VALUES (?,?,?,?)", list(node_info))
+        c.executemany("REPLACE INTO node_info (node_id, features, timestamp, alias) VALUES (?,?,?,?)", [tuple(ni) for ni in node_infos])
 
     @sql
     def save_node_address(self, node_id, peer, now):
@@ -434,13 +884,11 @@ class ChannelDB(SqlDB):
         c.execute("REPLACE INTO address (node_id, host, port, timestamp) VALUES (?,?,?,?)", (node_id, peer.host, peer.port, now))
 
     @sql
-    def save_node_addresses(self, node_id, node_addresses):
+    def save_node_addresses(self, node_addresses: Sequence[Address]):
+        # existing rows are kept, so that we do not reset their timestamp
         c = self.conn.cursor()
-        for addr in node_addresses:
-            c.execute("SELECT * FROM address WHERE node_id=? AND host=? AND port=?", (addr.node_id, addr.host, addr.port))
-            r = c.fetchall()
-            if r == []:
-                c.execute("INSERT INTO address (node_id, host, port, timestamp) VALUES (?,?,?,?)", (addr.node_id, addr.host, addr.port, 0))
+        c.executemany("INSERT OR IGNORE INTO address (node_id, host, port, timestamp) VALUES (?,?,?,?)",
+                      [(addr.node_id, addr.host, addr.port, 0) for addr in node_addresses])
 
     def verify_channel_update(self, payload):
         short_channel_id = payload['short_channel_id']
@@ -453,8 +901,8 @@ class ChannelDB(SqlDB):
     def add_node_announcement(self, msg_payloads):
         if type(msg_payloads) is dict:
             msg_payloads = [msg_payloads]
-        old_addr = None
         new_nodes = {}
+        new_addresses = []
         for msg_payload in msg_payloads:
             try:
                 node_info, node_addresses = NodeInfo.from_msg(msg_payload)
@@ -462,7 +910,7 @@ class ChannelDB(SqlDB):
                 continue
             node_id = node_info.node_id
             # Ignore node if it has no associated channel (DoS protection)
-            if node_id not in self._channels_for_node:
+            if not self._graph.has_node(node_id):
                 #self.logger.info('ignoring orphan node_announcement')
                 continue
             node = self._nodes.get(node_id)
@@ -472,12 +920,15 @@ class ChannelDB(SqlDB):
             if node and node.timestamp >= node_info.timestamp:
                 continue
             # save
+            new_nodes[node_id] = node_info
             self._nodes[node_id] = node_info
-            self.save_node(node_info)
             for addr in node_addresses:
                 self._addresses[node_id].add((addr.host, addr.port, 0))
-            self.save_node_addresses(node_id, node_addresses)
-
+            new_addresses.extend(node_addresses)
+        if new_nodes:
+            self.save_nodes(list(new_nodes.values()))
+        if new_addresses:
+            self.save_node_addresses(new_addresses)
         self.logger.debug("on_node_announcement: %d/%d"%(len(new_nodes), len(msg_payloads)))
         self.update_counts()
 
@@ -494,26 +945,26 @@ class ChannelDB(SqlDB):
 
     def get_old_policies(self, delta):
         now = int(time.time())
-        return list(k for k, v in list(self._policies.items()) if v.timestamp <= now - delta)
+        return [(p.start_node, p.short_channel_id) for p in self._graph.policies() if p.timestamp <= now - delta]
 
     def prune_old_policies(self, delta):
         l = self.get_old_policies(delta)
         if l:
-            for k in l:
-                self._policies.pop(k)
-                self.delete_policy(*k)
+            for node_id, short_channel_id in l:
+                self._graph.remove_policy(short_channel_id, node_id)
+            self.delete_policies(l)
             self.update_counts()
             self.logger.info(f'Deleting {len(l)} old policies')
 
     def get_orphaned_channels(self):
-        ids = set(x[1] for x in self._policies.keys())
-        return list(x for x in self._channels.keys() if x not in ids)
+        return self._graph.orphaned_channels()
 
     def prune_orphaned_channels(self):
         l = self.get_orphaned_channels()
         if l:
             for short_channel_id in l:
-                self.remove_channel(short_channel_id)
+                self._graph.remove_channel(short_channel_id)
+            self.delete_channels(l)
             self.update_counts()
             self.logger.info(f'Deleting {len(l)} orphaned channels')
 
@@ -525,12 +976,13 @@ class ChannelDB(SqlDB):
         self._channel_updates_for_private_channels[(start_node_id, short_channel_id)] = msg_payload
 
     def remove_channel(self, short_channel_id: ShortChannelID):
-        channel_info = self._channels.pop(short_channel_id, None)
-        if channel_info:
-            self._channels_for_node[channel_info.node1_id].remove(channel_info.short_channel_id)
-            self._channels_for_node[channel_info.node2_id].remove(channel_info.short_channel_id)
+        channel_info = self._graph.remove_channel(short_channel_id)
         # delete from database
-        self.delete_channel(short_channel_id)
+        self.delete_channels([short_channel_id])
+        if channel_info:
+            # the in-memory graph does not keep policies of unknown channels
+            self.delete_policies([(channel_info.node1_id, short_channel_id),
+                                  (channel_info.node2_id, short_channel_id)])
 
     def get_node_addresses(self, node_id):
         return self._addresses.get(node_id)
@@ -543,42 +995,87 @@ class ChannelDB(SqlDB):
         for x in c:
             node_id, host, port, timestamp = x
             self._addresses[node_id].add((str(host), int(port), int(timestamp or 0)))
-        c.execute("""SELECT * FROM channel_info""")
-        for x in c:
-            x = (ShortChannelID.normalize(x[0]), *x[1:])
-            ci = ChannelInfo(*x)
-            self._channels[ci.short_channel_id] = ci
         c.execute("""SELECT * FROM node_info""")
         for x in c:
             ni = NodeInfo(*x)
             self._nodes[ni.node_id] = ni
-        c.execute("""SELECT * FROM policy""")
-        for x in c:
-            p = Policy(*x)
-            self._policies[(p.start_node, p.short_channel_id)] = p
-        for channel_info in self._channels.values():
-            self._channels_for_node[channel_info.node1_id].add(channel_info.short_channel_id)
-            self._channels_for_node[channel_info.node2_id].add(channel_info.short_channel_id)
-        self.logger.info(f'load data {len(self._channels)} {len(self._policies)} {len(self._channels_for_node)}')
+        graph_version = self._get_graph_version()
+        orphaned_policies = self._load_snapshot(graph_version)
+        loaded = orphaned_policies is not None
+        if not loaded:
+            channels, policies = self._read_graph_from_db()
+            self._graph.add_channels(channels)
+            orphaned_policies = [p.key for p in policies if not self._graph.set_policy(p)]
+        if orphaned_policies:
+            c.executemany("DELETE FROM policy WHERE key=?", [(key,) for key in orphaned_policies])
+            self._bump_graph_version(c)
+            self.logger.info(f'deleted {len(orphaned_policies)} policies without channel')
+        self.logger.info(f'load data {self._graph.num_channels} {self._graph.num_policies} {self._graph.num_nodes()}'
+                         f' (from snapshot: {loaded})')
         self.update_counts()
-        self.count_incomplete_channels()
         self.data_loaded.set()
 
-    def count_incomplete_channels(self):
-        out = set()
-        for short_channel_id, ci in self._channels.items():
-            p1 = self.get_policy_for_node(short_channel_id, ci.node1_id)
-            p2 = self.get_policy_for_node(short_channel_id, ci.node2_id)
-            if p1 is None or p2 is not None:
-                out.add(short_channel_id)
-        self.logger.info(f'semi-orphaned: {len(out)}')
+    def _read_graph_from_db(self) -> Tuple[List[ChannelInfo], List[Policy]]:
+        c = self.conn.cursor()
+        c.execute("""SELECT * FROM channel_info""")
+        channels = [ChannelInfo(ShortChannelID.normalize(x[0]), *x[1:]) for x in c]
+        c.execute("""SELECT * FROM policy""")
+        policies = [Policy(*x) for x in c]
+        return channels, policies
+
+    def _load_snapshot(self, graph_version: int) -> Optional[List[bytes]]:
+        """Loads the graph from the snapshot, if it is up to date.
+        Returns the keys of the policies without channel, or None."""
+        if not os.path.exists(self.snapshot_path):
+            return None
+        graph = GraphStore()
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    snapshot_version, orphaned_policies = graph.load_snapshot(m)
+        except (OSError, ValueError) as e:
+            self.logger.info(f'cannot load graph snapshot: {e!r}')
+            return None
+        if snapshot_version != graph_version:
+            self.logger.info(f'graph snapshot is stale ({snapshot_version} != {graph_version})')
+            return None
+        self._graph = graph
+        self._snapshot_version = graph_version
+        return orphaned_policies
+
+    @sql
+    def save_snapshot(self):
+        self._save_snapshot()
+
+    def _save_snapshot(self):
+        # commit first: a snapshot must never be ahead of the database on disk
+        self.conn.commit()
+        graph_version = self._get_graph_version()
+        if graph_version == self._snapshot_version:
+            return
+        channels, policies = self._read_graph_from_db()
+        data = serialize_graph_snapshot(graph_version, channels, policies)
+        temp_path = "%s.tmp.%s" % (self.snapshot_path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.snapshot_path)
+        self._snapshot_version = graph_version
+        self.logger.info(f'saved graph snapshot ({len(channels)} channels, {len(policies)} policies)')
+
+    def on_close(self):
+        try:
+            self._save_snapshot()
+        except Exception as e:
+            self.logger.info(f'failed to save graph snapshot: {e!r}')
 
     def get_policy_for_node(self, short_channel_id: bytes, node_id: bytes) -> Optional['Policy']:
-        return self._policies.get((node_id, short_channel_id))
+        return self._graph.get_policy(short_channel_id, node_id)
 
     def get_channel_info(self, channel_id: bytes) -> ChannelInfo:
-        return self._channels.get(channel_id)
+        return self._graph.get_channel_info(channel_id)
 
     def get_channels_for_node(self, node_id) -> Set[bytes]:
         """Returns the set of channels that have node_id as one of the endpoints."""
-        return self._channels_for_node.get(node_id) or set()
+        return self._graph.get_channels_for_node(node_id)
@@ -79,6 +79,9 @@ class Command:
         self.requires_network = 'n' in s
         self.requires_wallet = 'w' in s
         self.requires_password = 'p' in s
+        self.modifies_wallet = 'm' in s
+        # synchronous commands are run in a thread pool by the daemon
+        self.blocking = not asyncio.iscoroutinefunction(func)
         self.description = func.__doc__
         self.help = self.description.split('.')[0] if self.description else None
         varnames = func.__code__.co_varnames[1:func.__code__.co_argcount]
@@ -118,6 +121,10 @@ def command(s):
                 wallet = kwargs.get('wallet')
             if cmd.requires_password and password is None and wallet.has_password():
                 raise Exception('Password required')
+            if daemon:
+                return await daemon.cmd_scheduler.run(cmd, func, args, kwargs, wallet=kwargs.get('wallet'))
+            if cmd.blocking:
+                return func(*args, **kwargs)
             return await func(*args, **kwargs)
         return func_wrapper
     return decorator
@@ -246,8 +253,8 @@ class Commands:
             'msg': d['msg'],
         }
 
-    @command('wp')
-    async def password(self, password=None, new_password=None, wallet: Abstract_Wallet = None):
+    @command('wmp')
+    def password(self, password=None, new_password=None, wallet: Abstract_Wallet = None):
         """Change wallet password. """
         if wallet.storage.is_encrypted_with_hw_device() and new_password:
             raise Exception("Can't change the password of a wallet encrypted with a hw device.")
@@ -299,7 +306,7 @@ class Commands:
         return await self.network.get_history_for_scripthash(sh)
 
     @command('w')
-    async def listunspent(self, wallet: Abstract_Wallet = None):
+    def listunspent(self, wallet: Abstract_Wallet = None):
         """List unspent outputs. Returns the list of unspent transaction
         outputs in your wallet."""
         coins = []
@@ -353,7 +360,7 @@ class Commands:
         return tx.serialize()
 
     @command('wp')
-    async def signtransaction(self, tx, privkey=None, password=None, wallet: Abstract_Wallet = None):
+    def signtransaction(self, tx, privkey=None, password=None, wallet: Abstract_Wallet = None):
         """Sign a transaction. The wallet keys will be used unless a private key is provided."""
         tx = PartialTransaction(tx)
         if privkey:
@@ -385,18 +392,18 @@ class Commands:
         address = bitcoin.hash160_to_p2sh(hash_160(bfh(redeem_script)))
         return {'address':address, 'redeemScript':redeem_script}
 
-    @command('w')
+    @command('wm')
     async def freeze(self, address, wallet: Abstract_Wallet = None):
         """Freeze address. Freeze the funds at one of your wallet\'s addresses"""
         return wallet.set_frozen_state_of_addresses([address], True)
 
-    @command('w')
+    @command('wm')
     async def unfreeze(self, address, wallet: Abstract_Wallet = None):
         """Unfreeze address. Unfreeze the funds at one of your wallet\'s address"""
         return wallet.set_frozen_state_of_addresses([address], False)
 
     @command('wp')
-    async def getprivatekeys(self, address, password=None, wallet: Abstract_Wallet = None):
+    def getprivatekeys(self, address, password=None, wallet: Abstract_Wallet = None):
         """Get private keys of addresses. You may pass a single wallet address, or a list of wallet addresses."""
         if isinstance(address, str):
             address = address.strip()
@@ -426,7 +433,7 @@ class Commands:
         return wallet.get_public_keys(address)
 
     @command('w')
-    async def getbalance(self, wallet: Abstract_Wallet = None):
+    def getbalance(self, wallet: Abstract_Wallet = None):
         """Return the balance of your wallet. """
         c, u, x = wallet.get_balance()
         l = wallet.lnworker.get_balance() if wallet.lnworker else None
@@ -492,8 +499,8 @@ class Commands:
         s = wallet.get_seed(password)
         return s
 
-    @command('wp')
-    async def importprivkey(self, privkey, password=None, wallet: Abstract_Wallet = None):
+    @command('wmp')
+    def importprivkey(self, privkey, password=None, wallet: Abstract_Wallet = None):
         """Import a private key."""
         if not wallet.can_import_privkey():
             return "Error: This type of wallet cannot import private keys. Try to create a new wallet with that key."
@@ -580,7 +587,7 @@ class Commands:
         return tx
 
     @command('wp')
-    async def payto(self, destination, amount, fee=None, feerate=None, from_addr=None, from_coins=None, change_addr=None,
+    def payto(self, destination, amount, fee=None, feerate=None, from_addr=None, from_coins=None, change_addr=None,
                     nocheck=False, unsigned=False, rbf=None, password=None, locktime=None, wallet: Abstract_Wallet = None):
         """Create a transaction. """
         tx_fee = satoshis(fee)
@@ -601,7 +608,7 @@ class Commands:
         return tx.serialize()
 
     @command('wp')
-    async def paytomany(self, outputs, fee=None, feerate=None, from_addr=None, from_coins=None, change_addr=None,
+    def paytomany(self, outputs, fee=None, feerate=None, from_addr=None, from_coins=None, change_addr=None,
                         nocheck=False, unsigned=False, rbf=None, password=None, locktime=None, wallet: Abstract_Wallet = None):
         """Create a multi-output transaction. """
         tx_fee = satoshis(fee)
@@ -622,7 +629,7 @@ class Commands:
         return tx.serialize()
 
     @command('w')
-    async def onchain_history(self, year=None, show_addresses=False, show_fiat=False, wallet: Abstract_Wallet = None):
+    def onchain_history(self, year=None, show_addresses=False, show_fiat=False, wallet: Abstract_Wallet = None):
         """Wallet onchain history. Returns the transaction history of your wallet."""
         kwargs = {
             'show_addresses': show_addresses,
@@ -639,13 +646,13 @@ class Commands:
             kwargs['fx'] = fx
         return json_encode(wallet.get_detailed_history(**kwargs))
 
-    @command('w')
+    @command('wm')
     async def init_lightning(self, wallet: Abstract_Wallet = None):
         """Enable lightning payments"""
         wallet.init_lightning()
         return "Lightning keys have been created."
 
-    @command('w')
+    @command('wm')
     async def remove_lightning(self, wallet: Abstract_Wallet = None):
         """Disable lightning payments"""
         wallet.remove_lightning()
@@ -656,7 +663,7 @@ class Commands:
         lightning_history = wallet.lnworker.get_history() if wallet.lnworker else []
         return json_encode(lightning_history)
 
-    @command('w')
+    @command('wm')
     async def setlabel(self, key, label, wallet: Abstract_Wallet = None):
         """Assign a label to an item. Item may be a bitcoin address or a
         transaction ID"""
@@ -682,7 +689,7 @@ class Commands:
         return results
 
     @command('w')
-    async def listaddresses(self, receiving=False, change=False, labels=False, frozen=False, unused=False, funded=False, balance=False, wallet: Abstract_Wallet = None):
+    def listaddresses(self, receiving=False, change=False, labels=False, frozen=False, unused=False, funded=False, balance=False, wallet: Abstract_Wallet = None):
         """List wallet addresses. Returns the list of all addresses in your wallet. Use optional arguments to filter the results."""
         out = []
         for addr in wallet.get_addresses():
@@ -765,7 +772,7 @@ class Commands:
     #    pass
 
     @command('w')
-    async def list_requests(self, pending=False, expired=False, paid=False, wallet: Abstract_Wallet = None):
+    def list_requests(self, pending=False, expired=False, paid=False, wallet: Abstract_Wallet = None):
         """List the payment requests you made."""
         out = wallet.get_sorted_requests()
         if pending:
@@ -780,7 +787,7 @@ class Commands:
             out = list(filter(lambda x: x.get('status')==f, out))
         return list(map(self._format_request, out))
 
-    @command('w')
+    @command('wm')
     async def createnewaddress(self, wallet: Abstract_Wallet = None):
         """Create a new receiving address, beyond the gap limit of the wallet"""
         return wallet.create_new_address(False)
@@ -791,7 +798,7 @@ class Commands:
         An address is considered as used if it has received a transaction, or if it is used in a payment request."""
         return wallet.get_unused_address()
 
-    @command('w')
+    @command('wm')
     async def add_request(self, amount, memo='', expiration=3600, force=False, wallet: Abstract_Wallet = None):
         """Create a payment request, using the first unused address of the wallet.
         The address will be considered as used after this operation.
@@ -809,14 +816,14 @@ class Commands:
         out = wallet.get_request(addr)
         return self._format_request(out)
 
-    @command('wn')
+    @command('wmn')
     async def add_lightning_request(self, amount, memo='', expiration=3600, wallet: Abstract_Wallet = None):
         amount_sat = int(satoshis(amount))
         key = await wallet.lnworker._add_request_coro(amount_sat, memo, expiration)
         return wallet.get_request(key)['invoice']
 
-    @command('w')
-    async def addtransaction(self, tx, wallet: Abstract_Wallet = None):
+    @command('wm')
+    def addtransaction(self, tx, wallet: Abstract_Wallet = None):
         """ Add a transaction to the wallet history """
         tx = Transaction(tx)
         if not wallet.add_transaction(tx):
@@ -824,7 +831,7 @@ class Commands:
         wallet.storage.write()
         return tx.txid()
 
-    @command('wp')
+    @command('wmp')
     async def signrequest(self, address, password=None, wallet: Abstract_Wallet = None):
         "Sign payment request with an OpenAlias"
         alias = self.config.get('alias')
@@ -833,18 +840,18 @@ class Commands:
         alias_addr = wallet.contacts.resolve(alias)['address']
         wallet.sign_payment_request(address, alias, alias_addr, password)
 
-    @command('w')
+    @command('wm')
     async def rmrequest(self, address, wallet: Abstract_Wallet = None):
         """Remove a payment request"""
         return wallet.remove_payment_request(address)
 
-    @command('w')
+    @command('wm')
     async def clear_requests(self, wallet: Abstract_Wallet = None):
         """Remove all payment requests"""
         for k in list(wallet.receive_requests.keys()):
             wallet.remove_payment_request(k)
 
-    @command('w')
+    @command('wm')
     async def clear_invoices(self, wallet: Abstract_Wallet = None):
         """Remove all invoices"""
         wallet.clear_invoices()
@@ -882,8 +889,8 @@ class Commands:
             fee_level = Decimal(fee_level)
         return self.config.fee_per_kb(dyn=dyn, mempool=mempool, fee_level=fee_level)
 
-    @command('w')
-    async def removelocaltx(self, txid, wallet: Abstract_Wallet = None):
+    @command('wm')
+    def removelocaltx(self, txid, wallet: Abstract_Wallet = None):
         """Remove a 'local' transaction from the wallet, and its dependent
         transactions.
         """
@@ -895,8 +902,7 @@ class Commands:
             raise Exception(f'Only local transactions can be removed. '
                             f'This tx has height: {height} != {TX_HEIGHT_LOCAL}')
         to_delete |= wallet.get_depending_transactions(txid)
-        for tx_hash in to_delete:
-            wallet.remove_transaction(tx_hash)
+        wallet.remove_transactions(to_delete)
         wallet.storage.write()
 
     @command('wn')
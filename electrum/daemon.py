@@ -29,11 +29,12 @@ import time
 import traceback
 import sys
 import threading
-from typing import Dict, Optional, Tuple
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple, Set, TYPE_CHECKING
 import aiohttp
 from aiohttp import web
 from base64 import b64decode
-from collections import defaultdict
 
 import jsonrpcclient
 import jsonrpcserver
@@ -43,7 +44,7 @@ from jsonrpcclient.clients.aiohttp_client import AiohttpClient
 from .network import Network
 from .util import (json_decode, to_bytes, to_string, profiler, standardize_path, constant_time_compare)
 from .util import PR_PAID, PR_EXPIRED, get_request_status
-from .util import log_exceptions, ignore_exceptions
+from .util import log_exceptions, ignore_exceptions, ReadWriteLock
 from .wallet import Wallet, Abstract_Wallet
 from .storage import WalletStorage
 from .commands import known_commands, Commands
@@ -51,6 +52,9 @@ from .simple_config import SimpleConfig
 from .exchange_rate import FxThread
 from .logging import get_logger, Logger
 
+if TYPE_CHECKING:
+    from .commands import Command
+
 
 _logger = get_logger(__name__)
 
@@ -172,18 +176,81 @@ class WatchTowerServer(Logger):
         return await self.lnwatcher.sweepstore.add_sweep_tx(*args)
 
 
+class RequestStatusHub(Logger):
+    """Fans out the final status of payment requests to the websockets
+    that watch them. A single ticker keeps all the websockets alive, so
+    the cost of an idle watcher is one entry in a set.
+    """
+
+    KEEPALIVE_INTERVAL = 10
+
+    def __init__(self, keepalive_interval=KEEPALIVE_INTERVAL):
+        Logger.__init__(self)
+        self.keepalive_interval = keepalive_interval
+        # request key -> websockets watching it
+        self.subscribers = {}  # type: Dict[str, Set[web.WebSocketResponse]]
+
+    def subscribe(self, key: str, ws: web.WebSocketResponse):
+        self.subscribers.setdefault(key, set()).add(ws)
+
+    def unsubscribe(self, key: str, ws: web.WebSocketResponse):
+        subs = self.subscribers.get(key)
+        if subs is None:
+            return
+        subs.discard(ws)
+        if not subs:
+            del self.subscribers[key]
+
+    def num_subscribers(self) -> int:
+        return sum(len(subs) for subs in self.subscribers.values())
+
+    async def publish(self, key: str, message: str):
+        """Sends the final status to the watchers of key, and closes
+        their websockets."""
+        subs = self.subscribers.pop(key, set())
+        await asyncio.gather(*[self._send_and_close(ws, message) for ws in subs])
+
+    @staticmethod
+    async def _send_and_close(ws: web.WebSocketResponse, message: str):
+        try:
+            await ws.send_str(message)
+            await ws.close()
+        except Exception:
+            pass  # client went away
+
+    async def send_keepalive(self):
+        items = [(key, ws) for key, subs in self.subscribers.items() for ws in subs]
+        results = await asyncio.gather(*[ws.send_str('waiting') for key, ws in items],
+                                       return_exceptions=True)
+        for (key, ws), result in zip(items, results):
+            if isinstance(result, Exception):
+                self.unsubscribe(key, ws)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            await self.send_keepalive()
+
+
 class PayServer(Logger):
 
     def __init__(self, daemon: 'Daemon'):
         Logger.__init__(self)
         self.daemon = daemon
         self.config = daemon.config
-        self.pending = defaultdict(asyncio.Event)
+        self.hub = RequestStatusHub(self.config.get('payserver_keepalive', RequestStatusHub.KEEPALIVE_INTERVAL))
         self.daemon.network.register_callback(self.on_payment, ['payment_received'])
+        self.daemon.network.register_callback(self.on_request_status, ['request_status'])
 
     async def on_payment(self, evt, wallet, key, status):
         if status == PR_PAID:
-            await self.pending[key].set()
+            await self.hub.publish(key, 'paid')
+
+    async def on_request_status(self, evt, key, status):
+        if status == PR_PAID:
+            await self.hub.publish(key, 'paid')
+        elif status == PR_EXPIRED:
+            await self.hub.publish(key, 'expired')
 
     @ignore_exceptions
     @log_exceptions
@@ -201,6 +268,7 @@ class PayServer(Logger):
         await runner.setup()
         site = web.TCPSite(runner, port=port, host=host, ssl_context=self.config.get_ssl_context())
         await site.start()
+        await self.hub.run()
 
     async def create_request(self, request):
         params = await request.post()
@@ -244,18 +312,88 @@ class PayServer(Logger):
             await ws.send_str(f'expired')
             await ws.close()
             return ws
-        while True:
-            try:
-                await asyncio.wait_for(self.pending[key].wait(), 1)
-                break
-            except asyncio.TimeoutError:
-                # send data on the websocket, to keep it alive
-                await ws.send_str('waiting')
-        await ws.send_str('paid')
-        await ws.close()
+        # the hub sends the final status and closes the websocket
+        self.hub.subscribe(key, ws)
+        try:
+            async for msg in ws:
+                pass  # clients are not expected to send anything
+        finally:
+            self.hub.unsubscribe(key, ws)
         return ws
 
 
+class CommandTimeout(Exception):
+    pass
+
+
+class CommandScheduler(Logger):
+    """Runs the commands of JSON-RPC clients without blocking the event loop.
+
+    Synchronous commands are run in a bounded thread pool. Every command
+    is subject to rpc_timeout. Commands that act on a wallet hold a
+    per-wallet lock while they run: shared for reads, exclusive for
+    commands that modify the wallet. That lock only orders RPC commands
+    against each other: the synchronizer and the GUI do not take it, and
+    rely on the wallet's own locks, which its methods take internally.
+    """
+
+    def __init__(self, config: SimpleConfig):
+        Logger.__init__(self)
+        self.timeout = config.get('rpc_timeout', 120)
+        self.executor = ThreadPoolExecutor(max_workers=config.get('rpc_max_threads', 4),
+                                           thread_name_prefix='RPC')
+        # bounds the number of blocking commands queued or running
+        self.semaphore = asyncio.Semaphore(config.get('rpc_max_pending', 16))
+        self.wallet_locks = weakref.WeakKeyDictionary()  # type: Dict[Abstract_Wallet, ReadWriteLock]
+
+    def get_wallet_lock(self, wallet: Abstract_Wallet) -> ReadWriteLock:
+        lock = self.wallet_locks.get(wallet)
+        if lock is None:
+            lock = self.wallet_locks[wallet] = ReadWriteLock()
+        return lock
+
+    async def run(self, cmd: 'Command', func, args, kwargs, *, wallet: Abstract_Wallet = None):
+        deadline = time.monotonic() + self.timeout
+        lock = self.get_wallet_lock(wallet) if wallet else None
+        exclusive = cmd.modifies_wallet
+        if not cmd.blocking:
+            # runs on the event loop, and is cancelled if it times out
+            if lock:
+                await self._wait(cmd, lock.acquire(exclusive=exclusive), deadline - time.monotonic())
+            try:
+                return await self._wait(cmd, func(*args, **kwargs), deadline - time.monotonic())
+            finally:
+                if lock:
+                    lock.release(exclusive=exclusive)
+        await self._wait(cmd, self.semaphore.acquire(), self.timeout)
+        try:
+            if lock:
+                await self._wait(cmd, lock.acquire(exclusive=exclusive), deadline - time.monotonic())
+        except BaseException:
+            self.semaphore.release()
+            raise
+        def on_done(fut):
+            # the thread cannot be interrupted, so we only release
+            # once it is done, even if the client has timed out.
+            if lock:
+                lock.release(exclusive=exclusive)
+            self.semaphore.release()
+        loop = asyncio.get_event_loop()
+        fut = loop.run_in_executor(self.executor, lambda: func(*args, **kwargs))
+        fut.add_done_callback(on_done)
+        return await self._wait(cmd, asyncio.shield(fut), deadline - time.monotonic())
+
+    async def _wait(self, cmd: 'Command', aw, timeout):
+        try:
+            return await asyncio.wait_for(aw, max(timeout, 0))
+        except asyncio.TimeoutError:
+            self.logger.warning(f"command {cmd.name} timed out")
+            raise CommandTimeout(f"command {cmd.name} timed out after {self.timeout} seconds") from None
+
+    def stop(self):
+        self.executor.shutdown(wait=False)
+
+
 class AuthenticationError(Exception):
     pass
 
@@ -284,6 +422,7 @@ class Daemon(Logger):
         else:
             self.network = Network(config)
         self.fx = FxThread(config, self.network)
+        self.cmd_scheduler = CommandScheduler(config)
         self.gui_object = None
         # path -> wallet;   make sure path is standardized.
         self._wallets = {}  # type: Dict[str, Abstract_Wallet]
@@ -473,6 +612,7 @@ class Daemon(Logger):
         # stop network/wallets
         for k, wallet in self._wallets.items():
             wallet.stop_threads()
+        self.cmd_scheduler.stop()
         if self.network:
             self.logger.info("shutting down network")
             self.network.stop()
@@ -35,8 +35,9 @@ from ecdsa.ellipticcurve import Point
 from ecdsa.util import string_to_number, number_to_string
 
 from .util import bfh, bh2u, assert_bytes, to_bytes, InvalidPassword, profiler
-from .crypto import (sha256d, aes_encrypt_with_iv, aes_decrypt_with_iv, hmac_oneshot)
+from .crypto import (sha256, sha256d, aes_encrypt_with_iv, aes_decrypt_with_iv, hmac_oneshot)
 from .ecc_fast import do_monkey_patching_of_python_ecdsa_internals_with_libsecp256k1
+from . import ecc_fast
 from . import msqr
 from . import constants
 from .logging import get_logger
@@ -93,8 +94,8 @@ def point_to_ser(point, compressed=True) -> Optional[bytes]:
     if x is None or y is None:  # infinity
         return None
     if compressed:
-        return bfh(('%02x' % (2+(y&1))) + ('%064x' % x))
-    return bfh('04'+('%064x' % x)+('%064x' % y))
+        return bytes([2 + (y & 1)]) + int(x).to_bytes(32, byteorder='big')
+    return b'\x04' + int(x).to_bytes(32, byteorder='big') + int(y).to_bytes(32, byteorder='big')
 
 
 def get_y_coord_from_x(x: int, *, odd: bool) -> int:
@@ -178,20 +179,54 @@ class _MySigningKey(ecdsa.SigningKey):
         return r, s
 
 
-class _PubkeyForPointAtInfinity:
-    point = ecdsa.ellipticcurve.INFINITY
-
-
 @functools.total_ordering
 class ECPubkey(object):
+    # If libsecp256k1 is available, arithmetic, signing and verification are
+    # done on its opaque pubkey struct (self._secp_pubkey, created lazily),
+    # otherwise on python-ecdsa points. The coordinates are kept as ints
+    # either way; (None, None) is the point at infinity.
 
     def __init__(self, b: Optional[bytes]):
-        if b is not None:
-            assert_bytes(b)
-            point = _ser_to_python_ecdsa_point(b)
-            self._pubkey = ecdsa.ecdsa.Public_key(generator_secp256k1, point)
+        self._secp_pubkey = None
+        if b is None:
+            self._x, self._y = None, None
+            return
+        assert_bytes(b)
+        if ecc_fast.is_using_fast_ecc():
+            if not b or b[0] not in (0x02, 0x03, 0x04):
+                raise ValueError('Unexpected first byte: {}'.format(b[0] if b else None))
+            secp_pubkey = ecc_fast.pubkey_parse(b)
+            if secp_pubkey is None:
+                raise InvalidECPointException('public key could not be parsed or is invalid')
+            self._set_secp_pubkey(secp_pubkey)
         else:
-            self._pubkey = _PubkeyForPointAtInfinity()
+            point = _ser_to_python_ecdsa_point(b)
+            ecdsa.ecdsa.Public_key(generator_secp256k1, point)  # validates point
+            self._x, self._y = point.x(), point.y()
+
+    def _set_secp_pubkey(self, secp_pubkey) -> None:
+        ser = ecc_fast.pubkey_serialize(secp_pubkey, compressed=False)
+        self._x = string_to_number(ser[1:33])
+        self._y = string_to_number(ser[33:])
+        self._secp_pubkey = secp_pubkey
+
+    @classmethod
+    def _from_secp_pubkey(cls, secp_pubkey) -> 'ECPubkey':
+        if secp_pubkey is None:
+            return point_at_infinity()
+        pubkey = ECPubkey(None)
+        pubkey._set_secp_pubkey(secp_pubkey)
+        return pubkey
+
+    def _get_secp_pubkey(self):
+        if self._secp_pubkey is None and not self.is_at_infinity():
+            self._secp_pubkey = ecc_fast.pubkey_parse(point_to_ser(self.point(), compressed=False))
+        return self._secp_pubkey
+
+    def _get_python_ecdsa_point(self) -> ecdsa.ellipticcurve.Point:
+        if self.is_at_infinity():
+            return ecdsa.ellipticcurve.INFINITY
+        return Point(curve_secp256k1, self._x, self._y, CURVE_ORDER)
 
     @classmethod
     def from_sig_string(cls, sig_string: bytes, recid: int, msg_hash: bytes):
@@ -200,6 +235,11 @@ class ECPubkey(object):
             raise Exception('Wrong encoding')
         if recid < 0 or recid > 3:
             raise ValueError('recid is {}, but should be 0 <= recid <= 3'.format(recid))
+        if ecc_fast.is_using_fast_ecc() and ecc_fast.has_recovery_module() and len(msg_hash) == 32:
+            secp_pubkey = ecc_fast.ecdsa_recover(sig_string, recid, msg_hash)
+            if secp_pubkey is None:
+                raise InvalidECPointException('could not recover public key from signature')
+            return ECPubkey._from_secp_pubkey(secp_pubkey)
         ecdsa_verifying_key = _MyVerifyingKey.from_signature(sig_string, recid, msg_hash, curve=SECP256k1)
         ecdsa_point = ecdsa_verifying_key.pubkey.point
         return ECPubkey.from_point(ecdsa_point)
@@ -232,7 +272,7 @@ class ECPubkey(object):
         return bh2u(self.get_public_key_bytes(compressed))
 
     def point(self) -> Tuple[int, int]:
-        return self._pubkey.point.x(), self._pubkey.point.y()
+        return self._x, self._y
 
     def __repr__(self):
         return f"<ECPubkey {self.get_public_key_hex()}>"
@@ -240,7 +280,13 @@ class ECPubkey(object):
     def __mul__(self, other: int):
         if not isinstance(other, int):
             raise TypeError('multiplication not defined for ECPubkey and {}'.format(type(other)))
-        ecdsa_point = self._pubkey.point * other
+        other %= CURVE_ORDER
+        if self.is_at_infinity() or other == 0:
+            return point_at_infinity()
+        if ecc_fast.is_using_fast_ecc():
+            secp_pubkey = ecc_fast.pubkey_tweak_mul(self._get_secp_pubkey(), number_to_string(other, CURVE_ORDER))
+            return ECPubkey._from_secp_pubkey(secp_pubkey)
+        ecdsa_point = self._get_python_ecdsa_point() * other
         return self.from_point(ecdsa_point)
 
     def __rmul__(self, other: int):
@@ -249,23 +295,39 @@ class ECPubkey(object):
     def __add__(self, other):
         if not isinstance(other, ECPubkey):
             raise TypeError('addition not defined for ECPubkey and {}'.format(type(other)))
-        ecdsa_point = self._pubkey.point + other._pubkey.point
+        if self.is_at_infinity(): return other
+        if other.is_at_infinity(): return self
+        if ecc_fast.is_using_fast_ecc():
+            secp_pubkey = ecc_fast.pubkey_combine([self._get_secp_pubkey(), other._get_secp_pubkey()])
+            return ECPubkey._from_secp_pubkey(secp_pubkey)
+        ecdsa_point = self._get_python_ecdsa_point() + other._get_python_ecdsa_point()
         return self.from_point(ecdsa_point)
 
+    def tweak_add(self, tweak: int) -> 'ECPubkey':
+        """Returns self + tweak*G."""
+        tweak %= CURVE_ORDER
+        if tweak == 0:
+            return self
+        if self.is_at_infinity():
+            return generator() * tweak
+        if ecc_fast.is_using_fast_ecc():
+            secp_pubkey = ecc_fast.pubkey_tweak_add(self._get_secp_pubkey(), number_to_string(tweak, CURVE_ORDER))
+            return ECPubkey._from_secp_pubkey(secp_pubkey)
+        return self + generator() * tweak
+
     def __eq__(self, other):
-        return self._pubkey.point.x() == other._pubkey.point.x() \
-                and self._pubkey.point.y() == other._pubkey.point.y()
+        return self._x == other._x and self._y == other._y
 
     def __ne__(self, other):
         return not (self == other)
 
     def __hash__(self):
-        return hash(self._pubkey.point.x())
+        return hash(self._x)
 
     def __lt__(self, other):
         if not isinstance(other, ECPubkey):
             raise TypeError('comparison not defined for ECPubkey and {}'.format(type(other)))
-        return self._pubkey.point.x() < other._pubkey.point.x()
+        return self._x < other._x
 
     def verify_message_for_address(self, sig65: bytes, message: bytes, algo=lambda x: sha256d(msg_magic(x))) -> None:
         assert_bytes(message)
@@ -281,7 +343,13 @@ class ECPubkey(object):
         assert_bytes(sig_string)
         if len(sig_string) != 64:
             raise Exception('Wrong encoding')
-        ecdsa_point = self._pubkey.point
+        if self.is_at_infinity():
+            raise Exception('point is at infinity')
+        if ecc_fast.is_using_fast_ecc() and len(msg_hash) == 32:
+            if not ecc_fast.ecdsa_verify(sig_string, msg_hash, self._get_secp_pubkey()):
+                raise Exception('Bad signature')
+            return
+        ecdsa_point = self._get_python_ecdsa_point()
         verifying_key = _MyVerifyingKey.from_public_point(ecdsa_point, curve=SECP256k1)
         verifying_key.verify_digest(sig_string, msg_hash, sigdecode=ecdsa.util.sigdecode_string)
 
@@ -307,7 +375,7 @@ class ECPubkey(object):
         return CURVE_ORDER
 
     def is_at_infinity(self):
-        return self == point_at_infinity()
+        return self._x is None
 
     @classmethod
     def is_pubkey_bytes(cls, b: bytes):
@@ -318,6 +386,43 @@ class ECPubkey(object):
             return False
 
 
+def pubkey_tweak_mul(pubkey: bytes, tweak: bytes) -> bytes:
+    """Returns (tweak * pubkey) as a compressed public key.
+    Faster than going through ECPubkey if libsecp256k1 is available.
+    """
+    scalar = string_to_number(tweak) % CURVE_ORDER
+    if scalar == 0:
+        raise InvalidECPointException('tweak is zero modulo the curve order')
+    if ecc_fast.is_using_fast_ecc():
+        secp_pubkey = ecc_fast.pubkey_parse(pubkey)
+        if secp_pubkey is None:
+            raise InvalidECPointException('public key could not be parsed or is invalid')
+        secp_pubkey = ecc_fast.pubkey_tweak_mul(secp_pubkey, number_to_string(scalar, CURVE_ORDER))
+        return ecc_fast.pubkey_serialize(secp_pubkey)
+    return (ECPubkey(pubkey) * scalar).get_public_key_bytes()
+
+
+def privkey_to_pubkey_bytes(privkey: bytes) -> bytes:
+    """Returns the compressed public key for a 32 byte secret."""
+    if ecc_fast.is_using_fast_ecc() and is_secret_within_curve_range(privkey):
+        return ecc_fast.pubkey_serialize(ecc_fast.pubkey_create(privkey))
+    return ECPrivkey(privkey).get_public_key_bytes()
+
+
+def ecdh(privkey: bytes, pubkey: bytes) -> bytes:
+    """Returns sha256 of the compressed encoding of (privkey * pubkey),
+    as used by BOLT-04 and BOLT-08.
+    """
+    if ecc_fast.is_using_fast_ecc() and ecc_fast.has_ecdh_module() and is_secret_within_curve_range(privkey):
+        secp_pubkey = ecc_fast.pubkey_parse(pubkey)
+        if secp_pubkey is None:
+            raise InvalidECPointException('public key could not be parsed or is invalid')
+        secret = ecc_fast.ecdh(secp_pubkey, privkey)
+        if secret is not None:
+            return secret
+    return sha256(pubkey_tweak_mul(pubkey, privkey))
+
+
 def msg_magic(message: bytes) -> bytes:
     from .bitcoin import var_int
     length = bfh(var_int(len(message)))
@@ -371,9 +476,12 @@ class ECPrivkey(ECPubkey):
             raise InvalidECPointException('Invalid secret scalar (not within curve order)')
         self.secret_scalar = secret
 
-        point = generator_secp256k1 * secret
-        super().__init__(point_to_ser(point))
-        self._privkey = ecdsa.ecdsa.Private_key(self._pubkey, secret)
+        if ecc_fast.is_using_fast_ecc():
+            super().__init__(None)
+            self._set_secp_pubkey(ecc_fast.pubkey_create(privkey_bytes))
+        else:
+            point = generator_secp256k1 * secret
+            super().__init__(point_to_ser(point))
 
     @classmethod
     def from_secret_scalar(cls, secret_scalar: int):
@@ -408,16 +516,26 @@ class ECPrivkey(ECPubkey):
     def get_secret_bytes(self) -> bytes:
         return number_to_string(self.secret_scalar, CURVE_ORDER)
 
-    def sign(self, data: bytes, sigencode=None, sigdecode=None) -> bytes:
+    def sign(self, data: bytes, sigencode=None, sigdecode=None, *, verify: bool = True) -> bytes:
+        """Signs the 32 byte hash 'data' (RFC6979 nonce, low s).
+        Unless verify is False, the signature is verified before being returned.
+        """
         if sigencode is None:
             sigencode = sig_string_from_r_and_s
         if sigdecode is None:
             sigdecode = get_r_and_s_from_sig_string
+        if ecc_fast.is_using_fast_ecc() and len(data) == 32:
+            sig_string = ecc_fast.ecdsa_sign(data, self.get_secret_bytes())
+            if verify and not ecc_fast.ecdsa_verify(sig_string, data, self._get_secp_pubkey()):
+                raise Exception('Sanity check verifying our own signature failed.')
+            r, s = get_r_and_s_from_sig_string(sig_string)
+            return sigencode(r, s, CURVE_ORDER)
         private_key = _MySigningKey.from_secret_exponent(self.secret_scalar, curve=SECP256k1)
         sig = private_key.sign_digest_deterministic(data, hashfunc=hashlib.sha256, sigencode=sigencode)
-        public_key = private_key.get_verifying_key()
-        if not public_key.verify_digest(sig, data, sigdecode=sigdecode):
-            raise Exception('Sanity check verifying our own signature failed.')
+        if verify:
+            public_key = private_key.get_verifying_key()
+            if not public_key.verify_digest(sig, data, sigdecode=sigdecode):
+                raise Exception('Sanity check verifying our own signature failed.')
         return sig
 
     def sign_transaction(self, hashed_preimage: bytes) -> bytes:
@@ -439,6 +557,11 @@ class ECPrivkey(ECPubkey):
 
         message = to_bytes(message, 'utf8')
         msg_hash = algo(message)
+        if ecc_fast.is_using_fast_ecc() and ecc_fast.has_recovery_module() and len(msg_hash) == 32:
+            sig_string, recid = ecc_fast.ecdsa_sign_recoverable(msg_hash, self.get_secret_bytes())
+            sig65 = construct_sig65(sig_string, recid, is_compressed)
+            self.verify_message_for_address(sig65, message, algo)
+            return sig65
         sig_string = self.sign(msg_hash,
                                sigencode=sig_string_from_r_and_s,
                                sigdecode=get_r_and_s_from_sig_string)
@@ -456,12 +579,9 @@ class ECPrivkey(ECPubkey):
         if magic_found != magic:
             raise Exception('invalid ciphertext: invalid magic bytes')
         try:
-            ecdsa_point = _ser_to_python_ecdsa_point(ephemeral_pubkey_bytes)
+            ephemeral_pubkey = ECPubkey(ephemeral_pubkey_bytes)
         except InvalidECPointException as e:
             raise Exception('invalid ciphertext: invalid ephemeral pubkey') from e
-        if not ecdsa.ecdsa.point_is_valid(generator_secp256k1, ecdsa_point.x(), ecdsa_point.y()):
-            raise Exception('invalid ciphertext: invalid ephemeral pubkey')
-        ephemeral_pubkey = ECPubkey.from_point(ecdsa_point)
         ecdh_key = (ephemeral_pubkey * self.secret_scalar).get_public_key_bytes(compressed=True)
         key = hashlib.sha512(ecdh_key).digest()
         iv, key_e, key_m = key[0:16], key[16:32], key[32:]
@@ -11,6 +11,8 @@ from ctypes import (
     CFUNCTYPE, POINTER, cast
 )
 
+from typing import Optional, Tuple
+
 import ecdsa
 
 from .logging import get_logger
@@ -88,6 +90,33 @@ def load_library():
         secp256k1.secp256k1_ec_pubkey_combine.argtypes = [c_void_p, c_char_p, c_void_p, c_size_t]
         secp256k1.secp256k1_ec_pubkey_combine.restype = c_int
 
+        secp256k1.secp256k1_ec_pubkey_tweak_add.argtypes = [c_void_p, c_char_p, c_char_p]
+        secp256k1.secp256k1_ec_pubkey_tweak_add.restype = c_int
+
+        # the recovery and ecdh modules are optional when building libsecp256k1
+        try:
+            secp256k1.secp256k1_ecdsa_sign_recoverable.argtypes = [c_void_p, c_char_p, c_char_p, c_char_p, c_void_p, c_void_p]
+            secp256k1.secp256k1_ecdsa_sign_recoverable.restype = c_int
+
+            secp256k1.secp256k1_ecdsa_recoverable_signature_serialize_compact.argtypes = [c_void_p, c_char_p, c_void_p, c_char_p]
+            secp256k1.secp256k1_ecdsa_recoverable_signature_serialize_compact.restype = c_int
+
+            secp256k1.secp256k1_ecdsa_recoverable_signature_parse_compact.argtypes = [c_void_p, c_char_p, c_char_p, c_int]
+            secp256k1.secp256k1_ecdsa_recoverable_signature_parse_compact.restype = c_int
+
+            secp256k1.secp256k1_ecdsa_recover.argtypes = [c_void_p, c_char_p, c_char_p, c_char_p]
+            secp256k1.secp256k1_ecdsa_recover.restype = c_int
+            secp256k1.has_recovery = True
+        except AttributeError:
+            secp256k1.has_recovery = False
+
+        try:
+            secp256k1.secp256k1_ecdh.argtypes = [c_void_p, c_char_p, c_char_p, c_char_p, c_void_p, c_void_p]
+            secp256k1.secp256k1_ecdh.restype = c_int
+            secp256k1.has_ecdh = True
+        except AttributeError:
+            secp256k1.has_ecdh = False
+
         secp256k1.ctx = secp256k1.secp256k1_context_create(SECP256K1_CONTEXT_SIGN | SECP256K1_CONTEXT_VERIFY)
         r = secp256k1.secp256k1_context_randomize(secp256k1.ctx, os.urandom(32))
         if r:
@@ -251,6 +280,133 @@ def is_using_fast_ecc():
     return _patched_functions.monkey_patching_active
 
 
+# The functions below call libsecp256k1 directly, on serialized keys and on
+# opaque secp256k1_pubkey structs (64 byte buffers), without going through
+# python-ecdsa objects. They must only be called if is_using_fast_ecc().
+# Failures are signalled by returning None; callers raise as appropriate.
+
+def has_recovery_module() -> bool:
+    return bool(_libsecp256k1 and _libsecp256k1.has_recovery)
+
+
+def has_ecdh_module() -> bool:
+    return bool(_libsecp256k1 and _libsecp256k1.has_ecdh)
+
+
+def pubkey_parse(pubkey: bytes):
+    pubkey_obj = create_string_buffer(64)
+    r = _libsecp256k1.secp256k1_ec_pubkey_parse(_libsecp256k1.ctx, pubkey_obj, pubkey, len(pubkey))
+    if not r:
+        return None
+    return pubkey_obj
+
+
+def pubkey_serialize(pubkey_obj, compressed=True) -> bytes:
+    size = 33 if compressed else 65
+    pubkey_serialized = create_string_buffer(size)
+    pubkey_size = c_size_t(size)
+    _libsecp256k1.secp256k1_ec_pubkey_serialize(
+        _libsecp256k1.ctx, pubkey_serialized, byref(pubkey_size), pubkey_obj,
+        SECP256K1_EC_COMPRESSED if compressed else SECP256K1_EC_UNCOMPRESSED)
+    return pubkey_serialized.raw
+
+
+def pubkey_create(privkey: bytes):
+    pubkey_obj = create_string_buffer(64)
+    r = _libsecp256k1.secp256k1_ec_pubkey_create(_libsecp256k1.ctx, pubkey_obj, privkey)
+    if not r:
+        return None
+    return pubkey_obj
+
+
+def pubkey_tweak_mul(pubkey_obj, tweak: bytes):
+    """Returns a new pubkey struct for tweak*pubkey. 0 < tweak < curve order."""
+    result = create_string_buffer(pubkey_obj.raw, 64)
+    r = _libsecp256k1.secp256k1_ec_pubkey_tweak_mul(_libsecp256k1.ctx, result, tweak)
+    if not r:
+        return None
+    return result
+
+
+def pubkey_tweak_add(pubkey_obj, tweak: bytes):
+    """Returns a new pubkey struct for pubkey + tweak*G.
+    None if tweak is not below the curve order, or the result is infinity.
+    """
+    result = create_string_buffer(pubkey_obj.raw, 64)
+    r = _libsecp256k1.secp256k1_ec_pubkey_tweak_add(_libsecp256k1.ctx, result, tweak)
+    if not r:
+        return None
+    return result
+
+
+def pubkey_combine(pubkey_objs):
+    """Returns the sum of the given pubkey structs, or None if that is infinity."""
+    result = create_string_buffer(64)
+    array_of_pubkey_ptrs = (c_char_p * len(pubkey_objs))(*[cast(p, c_char_p) for p in pubkey_objs])
+    r = _libsecp256k1.secp256k1_ec_pubkey_combine(
+        _libsecp256k1.ctx, result, array_of_pubkey_ptrs, len(pubkey_objs))
+    if not r:
+        return None
+    return result
+
+
+def ecdh(pubkey_obj, privkey: bytes) -> Optional[bytes]:
+    """Returns sha256 of the compressed encoding of privkey*pubkey."""
+    output = create_string_buffer(32)
+    r = _libsecp256k1.secp256k1_ecdh(_libsecp256k1.ctx, output, pubkey_obj, privkey, None, None)
+    if not r:
+        return None
+    return output.raw
+
+
+def ecdsa_sign(msg_hash: bytes, privkey: bytes) -> bytes:
+    """Returns a 64 byte compact (r, s) signature, with low s, using RFC6979 nonces."""
+    sig = create_string_buffer(64)
+    r = _libsecp256k1.secp256k1_ecdsa_sign(_libsecp256k1.ctx, sig, msg_hash, privkey, None, None)
+    if not r:
+        raise Exception('the nonce generation function failed, or the private key was invalid')
+    compact_signature = create_string_buffer(64)
+    _libsecp256k1.secp256k1_ecdsa_signature_serialize_compact(_libsecp256k1.ctx, compact_signature, sig)
+    return compact_signature.raw
+
+
+def ecdsa_verify(sig_string: bytes, msg_hash: bytes, pubkey_obj) -> bool:
+    """Verifies a 64 byte compact signature. High s values are accepted."""
+    sig = create_string_buffer(64)
+    r = _libsecp256k1.secp256k1_ecdsa_signature_parse_compact(_libsecp256k1.ctx, sig, sig_string)
+    if not r:
+        return False
+    _libsecp256k1.secp256k1_ecdsa_signature_normalize(_libsecp256k1.ctx, sig, sig)
+    return 1 == _libsecp256k1.secp256k1_ecdsa_verify(_libsecp256k1.ctx, sig, msg_hash, pubkey_obj)
+
+
+def ecdsa_sign_recoverable(msg_hash: bytes, privkey: bytes) -> Tuple[bytes, int]:
+    """Returns a 64 byte compact signature and its recovery id."""
+    sig = create_string_buffer(65)
+    r = _libsecp256k1.secp256k1_ecdsa_sign_recoverable(_libsecp256k1.ctx, sig, msg_hash, privkey, None, None)
+    if not r:
+        raise Exception('the nonce generation function failed, or the private key was invalid')
+    compact_signature = create_string_buffer(64)
+    recid = c_int(0)
+    _libsecp256k1.secp256k1_ecdsa_recoverable_signature_serialize_compact(
+        _libsecp256k1.ctx, compact_signature, byref(recid), sig)
+    return compact_signature.raw, recid.value
+
+
+def ecdsa_recover(sig_string: bytes, recid: int, msg_hash: bytes):
+    """Returns the pubkey struct that produced the compact signature, or None."""
+    sig = create_string_buffer(65)
+    r = _libsecp256k1.secp256k1_ecdsa_recoverable_signature_parse_compact(
+        _libsecp256k1.ctx, sig, sig_string, recid)
+    if not r:
+        return None
+    pubkey_obj = create_string_buffer(64)
+    r = _libsecp256k1.secp256k1_ecdsa_recover(_libsecp256k1.ctx, pubkey_obj, sig, msg_hash)
+    if not r:
+        return None
+    return pubkey_obj
+
+
 try:
     _libsecp256k1 = load_library()
 except:
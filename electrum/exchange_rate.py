@@ -1,6 +1,9 @@
 import asyncio
-from datetime import datetime
+from array import array
+from datetime import datetime, date
 import inspect
+import math
+import struct
 import sys
 import os
 import json
@@ -8,14 +11,14 @@ import time
 import csv
 import decimal
 from decimal import Decimal
-from typing import Sequence, Optional
+from typing import Sequence, Optional, List, Dict
 
 from aiorpcx.curio import timeout_after, TaskTimeout, TaskGroup
 
 from .bitcoin import COIN
 from .i18n import _
 from .util import (ThreadJob, make_dir, log_exceptions,
-                   make_aiohttp_session, resource_path)
+                   resource_path)
 from .network import Network
 from .simple_config import SimpleConfig
 from .logging import Logger
@@ -35,11 +38,72 @@ CCY_PRECISIONS = {'BHD': 3, 'BIF': 0, 'BYR': 0, 'CLF': 4, 'CLP': 0,
                   'VUV': 0, 'XAF': 0, 'XAU': 4, 'XOF': 0, 'XPF': 0}
 
 
+class HistoricalRates:
+    """Daily rates of one currency, as an array of floats indexed by
+    day ordinal (see date.toordinal). Days without a rate hold NaN.
+    """
+
+    MAGIC = b'EFXR'
+    HEADER = struct.Struct('<4sII')  # magic, first day, number of days
+
+    def __init__(self, first_day: int, rates: array, timestamp: float):
+        self.first_day = first_day
+        self.rates = rates
+        self.timestamp = timestamp  # when the rates were fetched
+
+    def __len__(self):
+        return len(self.rates)
+
+    @classmethod
+    def from_dict(cls, h: dict, timestamp: float) -> 'HistoricalRates':
+        """Converts {'YYYY-MM-DD': rate} as returned by request_history."""
+        days = {}
+        for date_str, rate in h.items():
+            try:
+                day = date(int(date_str[0:4]), int(date_str[5:7]), int(date_str[8:10])).toordinal()
+                days[day] = float(rate)
+            except (ValueError, TypeError):
+                continue
+        if not days:
+            return cls(0, array('d'), timestamp)
+        first_day = min(days)
+        rates = array('d', [math.nan]) * (max(days) - first_day + 1)
+        for day, rate in days.items():
+            rates[day - first_day] = rate
+        return cls(first_day, rates, timestamp)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, timestamp: float) -> 'HistoricalRates':
+        magic, first_day, num_days = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC:
+            raise ValueError('not a rates file')
+        rates = array('d')
+        rates.frombytes(data[cls.HEADER.size:])
+        if len(rates) != num_days:
+            raise ValueError('truncated rates file')
+        if sys.byteorder != 'little':
+            rates.byteswap()
+        return cls(first_day, rates, timestamp)
+
+    def to_bytes(self) -> bytes:
+        rates = self.rates
+        if sys.byteorder != 'little':
+            rates = array('d', rates)
+            rates.byteswap()
+        return self.HEADER.pack(self.MAGIC, self.first_day, len(rates)) + rates.tobytes()
+
+    def get(self, day: int) -> float:
+        i = day - self.first_day
+        if 0 <= i < len(self.rates):
+            return self.rates[i]
+        return math.nan
+
+
 class ExchangeBase(Logger):
 
     def __init__(self, on_quotes, on_history):
         Logger.__init__(self)
-        self.history = {}
+        self.history = {}  # type: Dict[str, HistoricalRates]
         self.quotes = {}
         self.on_quotes = on_quotes
         self.on_history = on_history
@@ -47,9 +111,7 @@ class ExchangeBase(Logger):
     async def get_raw(self, site, get_string):
         # APIs must have https
         url = ''.join(['https://', site, get_string])
-        network = Network.get_instance()
-        proxy = network.proxy if network else None
-        async with make_aiohttp_session(proxy) as session:
+        async with Network.http_session() as session:
             async with session.get(url) as response:
                 response.raise_for_status()
                 return await response.text()
@@ -57,9 +119,7 @@ class ExchangeBase(Logger):
     async def get_json(self, site, get_string):
         # APIs must have https
         url = ''.join(['https://', site, get_string])
-        network = Network.get_instance()
-        proxy = network.proxy if network else None
-        async with make_aiohttp_session(proxy) as session:
+        async with Network.http_session() as session:
             async with session.get(url) as response:
                 response.raise_for_status()
                 # set content_type to None to disable checking MIME type
@@ -86,23 +146,38 @@ class ExchangeBase(Logger):
             self.quotes = {}
         self.on_quotes()
 
-    def read_historical_rates(self, ccy, cache_dir) -> Optional[dict]:
+    def read_historical_rates(self, ccy, cache_dir) -> Optional[HistoricalRates]:
         filename = os.path.join(cache_dir, self.name() + '_'+ ccy)
-        if not os.path.exists(filename):
-            return None
-        timestamp = os.stat(filename).st_mtime
+        rates_filename = filename + '.rates'
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                h = json.loads(f.read())
+            if os.path.exists(rates_filename):
+                timestamp = os.stat(rates_filename).st_mtime
+                with open(rates_filename, 'rb') as f:
+                    h = HistoricalRates.from_bytes(f.read(), timestamp)
+            elif os.path.exists(filename):
+                # json cache written by older versions
+                timestamp = os.stat(filename).st_mtime
+                with open(filename, 'r', encoding='utf-8') as f:
+                    h = HistoricalRates.from_dict(json.loads(f.read()), timestamp)
+                self.write_historical_rates(h, rates_filename)
+            else:
+                return None
         except:
             return None
         if not h:  # e.g. empty dict
             return None
-        h['timestamp'] = timestamp
         self.history[ccy] = h
         self.on_history()
         return h
 
+    def write_historical_rates(self, h: HistoricalRates, rates_filename):
+        try:
+            with open(rates_filename, 'wb') as f:
+                f.write(h.to_bytes())
+            os.utime(rates_filename, (h.timestamp, h.timestamp))
+        except OSError as e:
+            self.logger.info(f"failed to write fx history cache: {repr(e)}")
+
     @log_exceptions
     async def get_historical_rates_safe(self, ccy, cache_dir):
         try:
@@ -112,10 +187,9 @@ class ExchangeBase(Logger):
         except BaseException as e:
             self.logger.info(f"failed fx history: {repr(e)}")
             return
+        h = HistoricalRates.from_dict(h, time.time())
         filename = os.path.join(cache_dir, self.name() + '_' + ccy)
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.write(json.dumps(h))
-        h['timestamp'] = time.time()
+        self.write_historical_rates(h, filename + '.rates')
         self.history[ccy] = h
         self.on_history()
 
@@ -125,14 +199,16 @@ class ExchangeBase(Logger):
         h = self.history.get(ccy)
         if h is None:
             h = self.read_historical_rates(ccy, cache_dir)
-        if h is None or h['timestamp'] < time.time() - 24*3600:
+        if h is None or h.timestamp < time.time() - 24*3600:
             asyncio.get_event_loop().create_task(self.get_historical_rates_safe(ccy, cache_dir))
 
     def history_ccys(self):
         return []
 
     def historical_rate(self, ccy, d_t):
-        return self.history.get(ccy, {}).get(d_t.strftime('%Y-%m-%d'), 'NaN')
+        h = self.history.get(ccy)
+        rate = h.get(d_t.toordinal()) if h else math.nan
+        return 'NaN' if math.isnan(rate) else rate
 
     async def request_history(self, ccy):
         raise NotImplementedError()  # implemented by subclasses
@@ -608,15 +684,30 @@ class FxThread(ThreadJob):
     def history_rate(self, d_t):
         if d_t is None:
             return Decimal('NaN')
-        rate = self.exchange.historical_rate(self.ccy, d_t)
-        # Frequently there is no rate for today, until tomorrow :)
-        # Use spot quotes in that case
-        if rate in ('NaN', None) and (datetime.today().date() - d_t.date()).days <= 2:
-            rate = self.exchange.quotes.get(self.ccy, 'NaN')
-            self.history_used_spot = True
-        if rate is None:
-            rate = 'NaN'
-        return Decimal(rate)
+        return self.history_rates([d_t.toordinal()])[0]
+
+    def history_rates(self, days: Sequence[Optional[int]]) -> List[Decimal]:
+        """Returns the rates for a list of day ordinals, in one pass over
+        the rate array. Each distinct day is converted to Decimal once.
+        """
+        h = self.exchange.history.get(self.ccy)
+        today = datetime.today().toordinal()
+        decimal_rates = {None: Decimal('NaN')}
+        result = []
+        for day in days:
+            rate = decimal_rates.get(day)
+            if rate is None:
+                rate = h.get(day) if h else math.nan
+                # Frequently there is no rate for today, until tomorrow :)
+                # Use spot quotes in that case
+                if math.isnan(rate) and today - day <= 2:
+                    rate = self.exchange.quotes.get(self.ccy, 'NaN')
+                    self.history_used_spot = True
+                if rate is None:
+                    rate = 'NaN'
+                rate = decimal_rates[day] = Decimal(rate)
+            result.append(rate)
+        return result
 
     def historical_value_str(self, satoshis, d_t):
         return self.format_fiat(self.historical_value(satoshis, d_t))
@@ -629,5 +720,10 @@ class FxThread(ThreadJob):
         date = timestamp_to_datetime(timestamp)
         return self.history_rate(date)
 
+    def timestamp_rates(self, timestamps: Sequence[Optional[float]]) -> List[Decimal]:
+        days = [datetime.fromtimestamp(ts).toordinal() if ts is not None else None
+                for ts in timestamps]
+        return self.history_rates(days)
+
 
 assert globals().get(DEFAULT_EXCHANGE), f"default exchange {DEFAULT_EXCHANGE} does not exist"
@@ -313,8 +313,7 @@ class TxDialog(Factory.Popup):
 
         def on_prompt(b):
             if b:
-                for tx in to_delete:
-                    self.wallet.remove_transaction(tx)
+                self.wallet.remove_transactions(to_delete)
                 self.wallet.storage.write()
                 self.app._trigger_update_wallet()  # FIXME private...
                 self.dismiss()
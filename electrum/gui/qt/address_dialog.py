@@ -48,6 +48,11 @@ class AddressHistoryModel(HistoryModel):
     def should_include_lightning_payments(self) -> bool:
         return False
 
+    def get_snapshot_thread(self):
+        # the history of a single address is cheap to compute, and the
+        # model does not outlive the dialog
+        return None
+
 
 class AddressDialog(WindowModalDialog):
 
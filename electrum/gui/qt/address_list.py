@@ -24,9 +24,10 @@
 # SOFTWARE.
 
 from enum import IntEnum
+from typing import Optional, List, Dict, Tuple
 
 from PyQt5.QtCore import Qt, QPersistentModelIndex, QModelIndex
-from PyQt5.QtGui import QStandardItemModel, QStandardItem, QFont
+from PyQt5.QtGui import QStandardItemModel, QStandardItem, QFont, QColor
 from PyQt5.QtWidgets import QAbstractItemView, QComboBox, QLabel, QMenu
 
 from electrum.i18n import _
@@ -66,6 +67,25 @@ class AddressTypeFilter(IntEnum):
         }[self]
 
 
+class AddressItem(QStandardItem):
+    """Item of an address row. Balances, the number of txs and the
+    backgrounds are only computed when the view asks for them.
+    """
+
+    def __init__(self, address_list: 'AddressList', address: str, column: int):
+        super().__init__()
+        self.address_list = address_list
+        self.address = address
+        self.column = column
+
+    def data(self, role=Qt.UserRole + 1):
+        if role in (Qt.DisplayRole, Qt.EditRole, Qt.BackgroundRole):
+            value = self.address_list.get_lazy_data(self.address, self.column, role)
+            if value is not None:
+                return value
+        return super().data(role)
+
+
 class AddressList(MyTreeView):
 
     class Columns(IntEnum):
@@ -77,6 +97,7 @@ class AddressList(MyTreeView):
         NUM_TXS = 5
 
     filter_columns = [Columns.TYPE, Columns.ADDRESS, Columns.LABEL, Columns.COIN_BALANCE]
+    lazy_columns = {Columns.TYPE, Columns.COIN_BALANCE, Columns.FIAT_BALANCE, Columns.NUM_TXS}
 
     def __init__(self, parent=None):
         super().__init__(parent, self.create_menu, stretch_column=self.Columns.LABEL)
@@ -93,6 +114,9 @@ class AddressList(MyTreeView):
         for addr_usage_state in AddressUsageStateFilter.__members__.values():  # type: AddressUsageStateFilter
             self.used_button.addItem(addr_usage_state.ui_text())
         self.setModel(QStandardItemModel(self))
+        self._changes_pos = None  # type: Optional[int]
+        self._address_items = {}  # type: Dict[str, List[QStandardItem]]
+        self._rows = {}  # type: Dict[str, Tuple[List[str], Dict[int, QColor]]]
         self.update()
 
     def get_toolbar_buttons(self):
@@ -134,64 +158,79 @@ class AddressList(MyTreeView):
         self.show_used = AddressUsageStateFilter(state)
         self.update()
 
-    @profiler
+    def get_addresses_in_domain(self):
+        if self.show_change == AddressTypeFilter.RECEIVING:
+            return self.wallet.get_receiving_addresses()
+        elif self.show_change == AddressTypeFilter.CHANGE:
+            return self.wallet.get_change_addresses()
+        else:
+            return self.wallet.get_addresses()
+
     def update(self):
+        self.parent.snapshot_thread.cancel(self)
         self.wallet = self.parent.wallet
-        current_address = self.current_item_user_role(col=self.Columns.LABEL)
+        self._changes_pos = self.wallet.changes.get_position()
+        self._rows = {}
+        addresses = self.get_addresses_in_domain()
+        if self.show_used != AddressUsageStateFilter.ALL:
+            # the usage filter needs the balance of every address
+            for address in addresses:
+                row = self.get_row(address)
+                if row is not None:
+                    self._rows[address] = row
+            addresses = [address for address in addresses if address in self._rows]
+        self.set_rows(addresses)
+
+    def update_changed_addresses(self):
+        """Updates the rows of the addresses that the wallet reported as
+        changed since the last update. Their data is recomputed when the
+        view asks for it, or in the snapshot thread if the usage filter
+        needs it to decide whether to show them.
+        """
+        self.wallet = self.parent.wallet
+        changes_pos, changed = self.wallet.changes.get_changes_since(self._changes_pos)
+        if changed is None:
+            self.update()
+            return
+        if not changed:
+            return
+        if self.show_used == AddressUsageStateFilter.ALL:
+            self._changes_pos = changes_pos
+            for key in changed:
+                self._rows.pop(key, None)
+            self.update_rows([(key, self.is_in_domain(key)) for key in changed])
+            return
+        def compute():
+            return [(key, self.get_row(key) if self.is_in_domain(key) else None) for key in changed]
+        def on_result(rows):
+            self._changes_pos = changes_pos
+            for address, row in rows:
+                self._rows.pop(address, None)
+                if row is not None:
+                    self._rows[address] = row
+            self.update_rows([(address, row is not None) for address, row in rows])
+        self.parent.snapshot_thread.request(self, compute, on_result)
+
+    def is_in_domain(self, address) -> bool:
+        if not self.wallet.is_mine(address):
+            return False
         if self.show_change == AddressTypeFilter.RECEIVING:
-            addr_list = self.wallet.get_receiving_addresses()
+            return not self.wallet.is_change(address)
         elif self.show_change == AddressTypeFilter.CHANGE:
-            addr_list = self.wallet.get_change_addresses()
-        else:
-            addr_list = self.wallet.get_addresses()
+            return self.wallet.is_change(address)
+        return True
+
+    @profiler
+    def set_rows(self, addresses: List[str]):
+        current_address = self.current_item_user_role(col=self.Columns.LABEL)
         self.model().clear()
+        self._address_items = {}
         self.refresh_headers()
         fx = self.parent.fx
         set_address = None
-        for address in addr_list:
-            num = self.wallet.get_address_history_len(address)
-            label = self.wallet.labels.get(address, '')
-            c, u, x = self.wallet.get_addr_balance(address)
-            balance = c + u + x
-            is_used_and_empty = self.wallet.is_used(address) and balance == 0
-            if self.show_used == AddressUsageStateFilter.UNUSED and (balance or is_used_and_empty):
-                continue
-            if self.show_used == AddressUsageStateFilter.FUNDED and balance == 0:
-                continue
-            if self.show_used == AddressUsageStateFilter.USED_AND_EMPTY and not is_used_and_empty:
-                continue
-            balance_text = self.parent.format_amount(balance, whitespaces=True)
-            # create item
-            if fx and fx.get_fiat_address_config():
-                rate = fx.exchange_rate()
-                fiat_balance = fx.value_str(balance, rate)
-            else:
-                fiat_balance = ''
-            labels = ['', address, label, balance_text, fiat_balance, "%d"%num]
-            address_item = [QStandardItem(e) for e in labels]
-            # align text and set fonts
-            for i, item in enumerate(address_item):
-                item.setTextAlignment(Qt.AlignVCenter)
-                if i not in (self.Columns.TYPE, self.Columns.LABEL):
-                    item.setFont(QFont(MONOSPACE_FONT))
-            self.set_editability(address_item)
-            address_item[self.Columns.FIAT_BALANCE].setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
-            # setup column 0
-            if self.wallet.is_change(address):
-                address_item[self.Columns.TYPE].setText(_('change'))
-                address_item[self.Columns.TYPE].setBackground(ColorScheme.YELLOW.as_color(True))
-            else:
-                address_item[self.Columns.TYPE].setText(_('receiving'))
-                address_item[self.Columns.TYPE].setBackground(ColorScheme.GREEN.as_color(True))
-            address_item[self.Columns.LABEL].setData(address, Qt.UserRole)
-            # setup column 1
-            if self.wallet.is_frozen_address(address):
-                address_item[self.Columns.ADDRESS].setBackground(ColorScheme.BLUE.as_color(True))
-            if self.wallet.is_beyond_limit(address):
-                address_item[self.Columns.ADDRESS].setBackground(ColorScheme.RED.as_color(True))
-            # add item
+        for address in addresses:
             count = self.model().rowCount()
-            self.model().insertRow(count, address_item)
+            self.add_row(count, address)
             address_idx = self.model().index(count, self.Columns.LABEL)
             if address == current_address:
                 set_address = QPersistentModelIndex(address_idx)
@@ -203,6 +242,102 @@ class AddressList(MyTreeView):
             self.hideColumn(self.Columns.FIAT_BALANCE)
         self.filter()
 
+    def update_rows(self, rows: List[Tuple[str, bool]]):
+        """Adds, removes or refreshes the rows of (address, is_shown) pairs."""
+        for address, is_shown in rows:
+            address_item = self._address_items.get(address)
+            if address_item is None:
+                if is_shown:
+                    self.add_row(self.model().rowCount(), address)
+                    self.hide_row(self.model().rowCount() - 1)
+            elif not is_shown:
+                del self._address_items[address]
+                self.model().removeRow(address_item[0].row())
+            else:
+                self.set_row_data(address_item, address)
+                self.hide_row(address_item[0].row())
+
+    def get_row_labels(self, address) -> Optional[List[str]]:
+        """Returns the column texts for address, or None if the address
+        is hidden by the usage filter.
+        """
+        fx = self.parent.fx
+        num = self.wallet.get_address_history_len(address)
+        label = self.wallet.labels.get(address, '')
+        c, u, x = self.wallet.get_addr_balance(address)
+        balance = c + u + x
+        is_used_and_empty = self.wallet.is_used(address) and balance == 0
+        if self.show_used == AddressUsageStateFilter.UNUSED and (balance or is_used_and_empty):
+            return None
+        if self.show_used == AddressUsageStateFilter.FUNDED and balance == 0:
+            return None
+        if self.show_used == AddressUsageStateFilter.USED_AND_EMPTY and not is_used_and_empty:
+            return None
+        balance_text = self.parent.format_amount(balance, whitespaces=True)
+        if fx and fx.get_fiat_address_config():
+            rate = fx.exchange_rate()
+            fiat_balance = fx.value_str(balance, rate)
+        else:
+            fiat_balance = ''
+        return ['', address, label, balance_text, fiat_balance, "%d"%num]
+
+    def get_row(self, address) -> Optional[Tuple[List[str], Dict[int, QColor]]]:
+        """Returns the column texts and backgrounds for address, or None
+        if the address is hidden by the usage filter.
+        """
+        labels = self.get_row_labels(address)
+        if labels is None:
+            return None
+        if self.wallet.is_change(address):
+            labels[self.Columns.TYPE] = _('change')
+            backgrounds = {self.Columns.TYPE: ColorScheme.YELLOW.as_color(True)}
+        else:
+            labels[self.Columns.TYPE] = _('receiving')
+            backgrounds = {self.Columns.TYPE: ColorScheme.GREEN.as_color(True)}
+        if self.wallet.is_beyond_limit(address):
+            backgrounds[self.Columns.ADDRESS] = ColorScheme.RED.as_color(True)
+        elif self.wallet.is_frozen_address(address):
+            backgrounds[self.Columns.ADDRESS] = ColorScheme.BLUE.as_color(True)
+        return labels, backgrounds
+
+    def get_lazy_data(self, address: str, column: int, role: int):
+        """Called from AddressItem.data(). Returns None if the item's own
+        data should be used.
+        """
+        row = self._rows.get(address)
+        if row is None:
+            row = self.get_row(address)
+            if row is None:
+                return None
+            self._rows[address] = row
+        labels, backgrounds = row
+        if role == Qt.BackgroundRole:
+            return backgrounds.get(column)
+        if column in self.lazy_columns:
+            return labels[column]
+        return None
+
+    def add_row(self, row: int, address: str):
+        address_item = [AddressItem(self, address, column) for column in self.Columns]
+        # align text and set fonts
+        for i, item in enumerate(address_item):
+            item.setTextAlignment(Qt.AlignVCenter)
+            if i not in (self.Columns.TYPE, self.Columns.LABEL):
+                item.setFont(QFont(MONOSPACE_FONT))
+        self.set_editability(address_item)
+        address_item[self.Columns.FIAT_BALANCE].setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+        address_item[self.Columns.ADDRESS].setText(address)
+        address_item[self.Columns.LABEL].setData(address, Qt.UserRole)
+        self.set_row_data(address_item, address)
+        self.model().insertRow(row, address_item)
+        self._address_items[address] = address_item
+
+    def set_row_data(self, address_item: List[QStandardItem], address: str):
+        address_item[self.Columns.LABEL].setText(self.wallet.labels.get(address, ''))
+        # the other columns are computed in get_lazy_data
+        for item in address_item:
+            item.emitDataChanged()
+
     def create_menu(self, position):
         from electrum.wallet import Multisig_Wallet
         is_multisig = isinstance(self.wallet, Multisig_Wallet)
@@ -27,7 +27,7 @@ import os
 import sys
 import datetime
 from datetime import date
-from typing import TYPE_CHECKING, Tuple, Dict
+from typing import TYPE_CHECKING, Tuple, Dict, Optional, List, Set, Iterable
 import threading
 from enum import IntEnum
 from decimal import Decimal
@@ -53,6 +53,7 @@ from .util import (read_QIcon, MONOSPACE_FONT, Buttons, CancelButton, OkButton,
 if TYPE_CHECKING:
     from electrum.wallet import Abstract_Wallet
     from .main_window import ElectrumWindow
+    from .util import SnapshotThread
 
 
 _logger = get_logger(__name__)
@@ -78,6 +79,9 @@ TX_ICONS = [
     "confirmed.png",
 ]
 
+# above this many inserted, removed or recomputed rows, HistoryModel resets instead of diffing
+MAX_INCREMENTAL_ROWS = 50
+
 class HistoryColumns(IntEnum):
     STATUS = 0
     DESCRIPTION = 1
@@ -106,6 +110,29 @@ class HistorySortModel(QSortFilterProxyModel):
 def get_item_key(tx_item):
     return tx_item.get('txid') or tx_item['payment_hash']
 
+def get_contiguous_ranges(positions):
+    """Groups sorted row numbers into (first, last) ranges."""
+    ranges = []
+    for pos in positions:
+        if ranges and ranges[-1][1] == pos - 1:
+            ranges[-1] = (ranges[-1][0], pos)
+        else:
+            ranges.append((pos, pos))
+    return ranges
+
+def bisect_rows(num_rows, row_key, key):
+    """Returns where a row with 'key' goes among rows [0, num_rows) sorted
+    by row_key(row), after the rows with an equal key.
+    """
+    lo, hi = 0, num_rows
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if key < row_key(mid):
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
 class HistoryModel(QAbstractItemModel, Logger):
 
     def __init__(self, parent: 'ElectrumWindow'):
@@ -115,6 +142,13 @@ class HistoryModel(QAbstractItemModel, Logger):
         self.view = None  # type: HistoryList
         self.transactions = OrderedDictWithIndex()
         self.tx_status_cache = {}  # type: Dict[str, Tuple[int, str]]
+        self._changes_pos = None  # type: Optional[int]
+        self._local_height = None  # type: Optional[int]
+        # on-chain rows come first, sorted by wallet.get_txpos
+        self._num_onchain_rows = 0
+        self._txpos = {}  # type: Dict[str, Tuple[int, int]]
+        # running balance of the first rows, extended on demand by get_balance
+        self._balances = []  # type: List[Decimal]
 
     def set_view(self, history_list: 'HistoryList'):
         # FIXME HistoryModel and HistoryList mutually depend on each other.
@@ -148,14 +182,17 @@ class HistoryModel(QAbstractItemModel, Logger):
                 status_str = format_time(int(timestamp))
         else:
             tx_hash = tx_item['txid']
-            conf = tx_item['confirmations']
             txpos = tx_item['txpos_in_block'] or 0
             height = tx_item['height']
             try:
                 status, status_str = self.tx_status_cache[tx_hash]
             except KeyError:
-                tx_mined_info = self.tx_mined_info_from_tx_item(tx_item)
+                # the number of confirmations changes with every block
+                tx_mined_info = self.parent.wallet.get_tx_height(tx_hash)
+                tx_item['confirmations'] = tx_mined_info.conf
                 status, status_str = self.parent.wallet.get_tx_status(tx_hash, tx_mined_info)
+                self.tx_status_cache[tx_hash] = status, status_str
+            conf = tx_item['confirmations']
 
         # we sort by timestamp
         if timestamp is None:
@@ -174,7 +211,7 @@ class HistoryModel(QAbstractItemModel, Logger):
                     (tx_item['bc_value'].value if 'bc_value' in tx_item else 0)\
                     + (tx_item['ln_value'].value if 'ln_value' in tx_item else 0),
                 HistoryColumns.BALANCE:
-                    (tx_item['balance'].value if 'balance' in tx_item else 0)\
+                    self.get_balance(index.row())\
                     + (tx_item['balance_msat']//1000 if 'balance_msat'in tx_item else 0),
                 HistoryColumns.FIAT_VALUE:
                     tx_item['fiat_value'].value if 'fiat_value' in tx_item else None,
@@ -220,7 +257,7 @@ class HistoryModel(QAbstractItemModel, Logger):
             v_str = self.parent.format_amount(value, is_diff=True, whitespaces=True)
             return QVariant(v_str)
         elif col == HistoryColumns.BALANCE:
-            balance = tx_item['balance'].value
+            balance = self.get_balance(index.row())
             balance_str = self.parent.format_amount(balance, whitespaces=True)
             return QVariant(balance_str)
         elif col == HistoryColumns.FIAT_VALUE and 'fiat_value' in tx_item:
@@ -259,32 +296,177 @@ class HistoryModel(QAbstractItemModel, Logger):
         """Overridden in address_dialog.py"""
         return True
 
-    @profiler
+    def get_snapshot_thread(self) -> Optional['SnapshotThread']:
+        """Overridden in address_dialog.py"""
+        return self.parent.snapshot_thread
+
     def refresh(self, reason: str):
-        self.logger.info(f"refreshing... reason: {reason}")
         assert self.parent.gui_thread == threading.current_thread(), 'must be called from GUI thread'
         assert self.view, 'view not set'
+        wallet = self.parent.wallet
+        changes_pos, changed_keys = wallet.changes.get_changes_since(self._changes_pos)
+        local_height = wallet.get_local_height()
+        if reason == 'update_tabs' and changed_keys is not None:
+            if local_height != self._local_height:
+                self._local_height = local_height
+                self.update_confirmations()
+            txids = self.get_changed_txids(changed_keys)
+            if txids is not None:
+                if txids:
+                    self.refresh_txids(changes_pos, txids)
+                else:
+                    self._changes_pos = changes_pos
+                return
+        self.logger.info(f"refreshing... reason: {reason}")
+        fx = self.parent.fx
+        if fx: fx.history_used_spot = False
+        self.set_visibility_of_columns()
+        domain = self.get_domain()
+        include_lightning = self.should_include_lightning_payments()
+        def compute():
+            transactions = wallet.get_full_history(fx, onchain_domain=domain, include_lightning=include_lightning)
+            txpos = {}
+            for txid, tx_item in transactions.items():
+                # balances are computed lazily, see get_balance
+                tx_item.pop('balance', None)
+                tx_item.pop('bc_balance', None)
+                if not tx_item.get('lightning'):
+                    txpos[txid] = wallet.get_txpos(txid)
+            return transactions, txpos
+        def on_result(result):
+            transactions, txpos = result
+            self._changes_pos = changes_pos
+            self._local_height = local_height
+            # the positions the rows are sorted by, see update_rows
+            self._txpos = txpos
+            self.set_history(transactions)
+        snapshot_thread = self.get_snapshot_thread()
+        if snapshot_thread:
+            snapshot_thread.request(self, compute, on_result)
+        else:
+            on_result(compute())
+
+    def get_changed_txids(self, changed_keys: Iterable[str]) -> Optional[Set[str]]:
+        """Returns the txids of the on-chain rows to recompute for the
+        keys that changed in the wallet, or None if the whole history
+        has to be reloaded.
+        """
+        wallet = self.parent.wallet
+        has_lightning = self.should_include_lightning_payments() and wallet.lnworker
+        txids = set()
+        for key in changed_keys:
+            tx_item = self.transactions.get(key)
+            if tx_item is not None:
+                if tx_item.get('lightning') or 'ln_value' in tx_item:
+                    return None
+                txids.add(key)
+            elif wallet.db.get_transaction(key):
+                txids.add(key)
+            elif has_lightning and not wallet.is_mine(key):
+                # a lightning payment or channel
+                return None
+        if len(txids) > MAX_INCREMENTAL_ROWS:
+            return None
+        return txids
+
+    def refresh_txids(self, changes_pos: int, txids: Set[str]):
+        wallet = self.parent.wallet
+        fx = self.parent.fx
+        def compute():
+            domain = set(self.get_domain())
+            return [(txid, wallet.get_onchain_history_item(txid, domain=domain, fx=fx), wallet.get_txpos(txid))
+                    for txid in txids]
+        def on_result(tx_items):
+            self._changes_pos = changes_pos
+            self.update_rows(tx_items)
+            if self.view.current_filter or self.view.start_timestamp:
+                self.view.filter()
+        snapshot_thread = self.get_snapshot_thread()
+        if snapshot_thread:
+            # not keyed by self: that would drop a pending full refresh
+            snapshot_thread.request((self, 'txids'), compute, on_result)
+        else:
+            on_result(compute())
+
+    def update_rows(self, tx_items: Iterable[Tuple[str, Optional[dict], Tuple[int, int]]]):
+        """Updates the on-chain rows of (txid, tx_item, txpos) triples,
+        moving rows whose txpos changed. A tx_item of None removes the row.
+        """
+        first_changed = len(self.transactions)
+        # take out every row that moves before inserting any of them, so
+        # that the rows searched by bisect_rows are sorted by their txpos
+        moved = []
+        for txid, tx_item, txpos in tx_items:
+            self.tx_status_cache.pop(txid, None)
+            if txid in self.transactions:
+                row = self.transactions.pos_from_key(txid)
+                first_changed = min(first_changed, row)
+                if tx_item is not None and txpos == self.get_row_txpos(row):
+                    self.transactions[txid] = tx_item
+                    topLeft = self.createIndex(row, 0)
+                    bottomRight = self.createIndex(row, len(HistoryColumns) - 1)
+                    self.dataChanged.emit(topLeft, bottomRight)
+                    continue
+                self.remove_onchain_row(row)
+            if tx_item is not None:
+                moved.append((txid, tx_item, txpos))
+        for txid, tx_item, txpos in moved:
+            row = bisect_rows(self._num_onchain_rows, self.get_row_txpos, txpos)
+            first_changed = min(first_changed, row)
+            self._txpos[txid] = txpos
+            self.beginInsertRows(QModelIndex(), row, row)
+            self.transactions.insert(row, txid, tx_item)
+            self._num_onchain_rows += 1
+            self.endInsertRows()
+        self.invalidate_balances(first_changed)
+
+    def remove_onchain_row(self, row: int):
+        self.beginRemoveRows(QModelIndex(), row, row)
+        txid = self.transactions.value_from_pos(row)['txid']
+        del self.transactions[txid]
+        self._txpos.pop(txid, None)
+        self._num_onchain_rows -= 1
+        self.endRemoveRows()
+
+    def get_row_txpos(self, row: int) -> Tuple[int, int]:
+        txid = self.transactions.value_from_pos(row)['txid']
+        txpos = self._txpos.get(txid)
+        if txpos is None:
+            txpos = self._txpos[txid] = self.parent.wallet.get_txpos(txid)
+        return txpos
+
+    def get_balance(self, row: int) -> Decimal:
+        balances = self._balances
+        if row >= len(balances):
+            balance = balances[-1] if balances else Decimal(0)
+            for pos in range(len(balances), row + 1):
+                balance += self.transactions.value_from_pos(pos)['value'].value
+                balances.append(balance)
+        return balances[row]
+
+    def invalidate_balances(self, row: int):
+        del self._balances[row:]
+        if row < len(self.transactions):
+            topLeft = self.createIndex(row, HistoryColumns.BALANCE)
+            bottomRight = self.createIndex(len(self.transactions) - 1, HistoryColumns.BALANCE)
+            self.dataChanged.emit(topLeft, bottomRight)
+
+    def update_confirmations(self):
+        # statuses are recomputed lazily in data(), for the visible rows
+        self.tx_status_cache.clear()
+        if self.transactions:
+            topLeft = self.createIndex(0, HistoryColumns.STATUS)
+            bottomRight = self.createIndex(len(self.transactions) - 1, HistoryColumns.STATUS)
+            self.dataChanged.emit(topLeft, bottomRight)
+
+    @profiler
+    def set_history(self, transactions: OrderedDictWithIndex):
         selected = self.view.selectionModel().currentIndex()
         selected_row = None
         if selected:
             selected_row = selected.row()
-        fx = self.parent.fx
-        if fx: fx.history_used_spot = False
-        wallet = self.parent.wallet
-        self.set_visibility_of_columns()
-        transactions = wallet.get_full_history(self.parent.fx,
-                                               onchain_domain=self.get_domain(),
-                                               include_lightning=self.should_include_lightning_payments())
-        if transactions == list(self.transactions.values()):
+        if not self.apply_history_diff(transactions):
             return
-        old_length = len(self.transactions)
-        if old_length != 0:
-            self.beginRemoveRows(QModelIndex(), 0, old_length)
-            self.transactions.clear()
-            self.endRemoveRows()
-        self.beginInsertRows(QModelIndex(), 0, len(transactions)-1)
-        self.transactions = transactions
-        self.endInsertRows()
         if selected_row:
             self.view.selectionModel().select(self.createIndex(selected_row, 0), QItemSelectionModel.Rows | QItemSelectionModel.SelectCurrent)
         self.view.filter()
@@ -297,12 +479,53 @@ class HistoryModel(QAbstractItemModel, Logger):
                 end_date = self.transactions.value_from_pos(len(self.transactions) - 1).get('date') or end_date
             self.view.years = [str(i) for i in range(start_date.year, end_date.year + 1)]
             self.view.period_combo.insertItems(1, self.view.years)
-        # update tx_status_cache
-        self.tx_status_cache.clear()
-        for txid, tx_item in self.transactions.items():
-            if not tx_item.get('lightning', False):
-                tx_mined_info = self.tx_mined_info_from_tx_item(tx_item)
-                self.tx_status_cache[txid] = self.parent.wallet.get_tx_status(txid, tx_mined_info)
+
+    def apply_history_diff(self, transactions: OrderedDictWithIndex) -> bool:
+        """Replaces self.transactions with 'transactions', emitting row
+        removals, insertions and data changes only for the rows that
+        differ. Tx statuses and balances of those rows are recomputed
+        lazily in data(). Returns whether anything changed.
+        """
+        old = self.transactions
+        old_keys = list(old.keys())
+        new_keys = list(transactions.keys())
+        removed = [pos for pos, key in enumerate(old_keys) if key not in transactions]
+        inserted = [pos for pos, key in enumerate(new_keys) if key not in old]
+        changed = [pos for pos, key in enumerate(new_keys) if key in old and old[key] != transactions[key]]
+        if not removed and not inserted and not changed:
+            return False
+        self._num_onchain_rows = sum(1 for tx_item in transactions.values() if not tx_item.get('lightning'))
+        for pos in removed:
+            self.tx_status_cache.pop(old_keys[pos], None)
+        for pos in changed:
+            self.tx_status_cache.pop(new_keys[pos], None)
+        common_old = [key for key in old if key in transactions]
+        common_new = [key for key in transactions if key in old]
+        if common_old != common_new or len(removed) + len(inserted) > MAX_INCREMENTAL_ROWS:
+            # rows were reordered, or too many to be worth it
+            self.beginResetModel()
+            self.transactions = transactions
+            self.tx_status_cache.clear()
+            self._balances = []
+            self.endResetModel()
+            return True
+        for first, last in reversed(get_contiguous_ranges(removed)):
+            self.beginRemoveRows(QModelIndex(), first, last)
+            for pos in range(last, first - 1, -1):
+                del old[old_keys[pos]]
+            self.endRemoveRows()
+        for first, last in get_contiguous_ranges(inserted):
+            self.beginInsertRows(QModelIndex(), first, last)
+            for pos in range(first, last + 1):
+                old.insert(pos, new_keys[pos], transactions[new_keys[pos]])
+            self.endInsertRows()
+        self.transactions = transactions
+        for first, last in get_contiguous_ranges(changed):
+            topLeft = self.createIndex(first, 0)
+            bottomRight = self.createIndex(last, len(HistoryColumns) - 1)
+            self.dataChanged.emit(topLeft, bottomRight)
+        self.invalidate_balances(min(removed + inserted + changed))
+        return True
 
     def set_visibility_of_columns(self):
         def set_visible(col: int, b: bool):
@@ -659,8 +882,7 @@ class HistoryList(MyTreeView, AcceptFileDragDrop):
         if not self.parent.question(msg=question,
                                     title=_("Please confirm")):
             return
-        for tx in to_delete:
-            self.wallet.remove_transaction(tx)
+        self.wallet.remove_transactions(to_delete)
         self.wallet.storage.write()
         # need to update at least: history_list, utxo_list, address_list
         self.parent.need_update.set()
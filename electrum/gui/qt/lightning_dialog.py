@@ -62,7 +62,7 @@ class LightningDialog(QDialog):
         self.network.register_callback(self.set_unknown_channels, ['unknown_channels'])
         self.network.channel_db.update_counts() # trigger callback
         self.set_num_peers('', self.network.lngossip.num_peers())
-        self.set_unknown_channels('', len(self.network.lngossip.unknown_ids))
+        self.set_unknown_channels('', self.network.lngossip.sync.num_unknown_ids())
 
     def on_channel_db(self, event, num_nodes, num_channels, num_policies):
         self.num_nodes.setText(_(f'{num_nodes} nodes'))
@@ -72,7 +72,7 @@ from electrum.network import Network, TxBroadcastError, BestEffortRequestFailed
 from electrum.exchange_rate import FxThread
 from electrum.simple_config import SimpleConfig
 from electrum.logging import Logger
-from electrum.util import PR_PAID, PR_FAILED
+from electrum.util import PR_PAID, PR_FAILED, PR_EXPIRED
 from electrum.util import pr_expiration_values
 from electrum.lnutil import ln_dummy_address
 
@@ -84,7 +84,7 @@ from .transaction_dialog import show_transaction
 from .fee_slider import FeeSlider
 from .util import (read_QIcon, ColorScheme, text_dialog, icon_path, WaitingDialog,
                    WindowModalDialog, ChoicesLayout, HelpLabel, Buttons,
-                   OkButton, InfoButton, WWLabel, TaskThread, CancelButton,
+                   OkButton, InfoButton, WWLabel, TaskThread, SnapshotThread, CancelButton,
                    CloseButton, HelpButton, MessageBoxMixin, EnterButton,
                    import_meta_gui, export_meta_gui,
                    filename_field, address_field, char_width_in_lineedit, webopen,
@@ -164,6 +164,8 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, Logger):
 
         self.create_status_bar()
         self.need_update = threading.Event()
+        # computes history/address/utxo/request snapshots off the GUI thread
+        self.snapshot_thread = SnapshotThread(self, self.on_error)
         self.decimal_point = config.get('decimal_point', DECIMAL_POINT_DEFAULT)
         try:
             decimal_point_to_base_unit_name(self.decimal_point)
@@ -245,7 +247,7 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, Logger):
             # window from being GC-ed when closed, callbacks should be
             # methods of this class only, and specifically not be
             # partials, lambdas or methods of subobjects.  Hence...
-            self.network.register_callback(self.on_network, interests)
+            self.network.register_callback(self.on_network, interests, filter=self.is_event_for_this_window)
             # set initial message
             self.console.showMessage(self.network.banner)
 
@@ -359,6 +361,11 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, Logger):
                 pass  # see #4418
             self.show_error(repr(e))
 
+    def is_event_for_this_window(self, event, *args):
+        if event in ('wallet_updated', 'verified', 'new_transaction', 'channels_updated'):
+            return args[0] == self.wallet
+        return True
+
     def on_network(self, event, *args):
         # Handle in GUI thread
         self.network_signal.emit(event, args)
@@ -763,7 +770,7 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, Logger):
         return fileName
 
     def timer_actions(self):
-        self.request_list.refresh_status()
+        self.request_list.refresh_countdowns()
         # Note this runs in the GUI thread
         if self.need_update.is_set():
             self.need_update.clear()
@@ -900,10 +907,12 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, Logger):
             wallet = self.wallet
         if wallet != self.wallet:
             return
+        # the history, address, request and utxo snapshots are computed
+        # in self.snapshot_thread
         self.history_model.refresh('update_tabs')
-        self.request_list.update()
-        self.address_list.update()
-        self.utxo_list.update()
+        self.request_list.update_in_background()
+        self.address_list.update_changed_addresses()
+        self.utxo_list.update_in_background()
         self.contact_list.update()
         self.invoice_list.update()
         self.update_completions()
@@ -1405,6 +1414,8 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, Logger):
         if status == PR_PAID:
             self.notify(_('Payment received') + '\n' + key)
             self.need_update.set()
+        elif status == PR_EXPIRED:
+            self.request_list.refresh_status()
 
     def on_invoice_status(self, key, status):
         if key not in self.wallet.invoices:
@@ -2769,6 +2780,7 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, Logger):
 
     def clean_up(self):
         self.wallet.thread.stop()
+        self.snapshot_thread.stop()
         if self.network:
             self.network.unregister_callback(self.on_network)
         self.config.set_key("is_maximized", self.isMaximized())
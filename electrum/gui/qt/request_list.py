@@ -32,7 +32,7 @@ from PyQt5.QtCore import Qt, QItemSelectionModel
 from electrum.i18n import _
 from electrum.util import format_time, get_request_status
 from electrum.util import PR_TYPE_ONCHAIN, PR_TYPE_LN
-from electrum.util import PR_PAID
+from electrum.util import PR_PAID, PR_UNPAID
 from electrum.plugin import run_hook
 
 from .util import MyTreeView, pr_icons, read_QIcon, webopen
@@ -89,27 +89,59 @@ class RequestList(MyTreeView):
 
     def refresh_status(self):
         m = self.model()
+        keys = [m.index(r, self.Columns.DATE).data(ROLE_KEY) for r in range(m.rowCount())]
+        self._refresh_statuses('status', keys)
+
+    def refresh_countdowns(self):
+        # unpaid requests with an expiry show the time left
+        self._refresh_statuses('countdown', list(self._countdown_keys))
+
+    def _refresh_statuses(self, job, keys):
+        if not keys:
+            return
+        wallet = self.wallet
+        def compute():
+            statuses = {}
+            for key in keys:
+                req = wallet.get_request(key)
+                if req:
+                    statuses[key] = get_request_status(req)
+            return statuses
+        self.parent.snapshot_thread.request((self, job), compute, self.set_statuses)
+
+    def set_statuses(self, statuses):
+        for key, (status, status_str) in statuses.items():
+            if status != PR_UNPAID:
+                self._countdown_keys.discard(key)
+        m = self.model()
         for r in range(m.rowCount()):
             idx = m.index(r, self.Columns.STATUS)
             date_idx = idx.sibling(idx.row(), self.Columns.DATE)
-            date_item = m.itemFromIndex(date_idx)
-            status_item = m.itemFromIndex(idx)
-            key = date_item.data(ROLE_KEY)
-            is_lightning = date_item.data(ROLE_REQUEST_TYPE) == PR_TYPE_LN
-            req = self.wallet.get_request(key)
-            if req:
-                status, status_str = get_request_status(req)
+            key = m.itemFromIndex(date_idx).data(ROLE_KEY)
+            if key in statuses:
+                status, status_str = statuses[key]
+                status_item = m.itemFromIndex(idx)
                 status_item.setText(status_str)
                 status_item.setIcon(read_QIcon(pr_icons.get(status)))
 
     def update(self):
+        self.parent.snapshot_thread.cancel(self)
         self.wallet = self.parent.wallet
-        domain = self.wallet.get_receiving_addresses()
+        self.set_requests(self.get_requests())
+
+    def update_in_background(self):
+        self.wallet = self.parent.wallet
+        self.parent.snapshot_thread.request(self, self.get_requests, self.set_requests)
+
+    def get_requests(self):
+        return [(req, get_request_status(req)) for req in self.wallet.get_sorted_requests()]
+
+    def set_requests(self, requests):
         self.parent.update_receive_address_styling()
         self.model().clear()
         self.update_headers(self.__class__.headers)
-        for req in self.wallet.get_sorted_requests():
-            status, status_str = get_request_status(req)
+        self._countdown_keys = set()
+        for req, (status, status_str) in requests:
             if status == PR_PAID:
                 continue
             request_type = req['type']
@@ -128,6 +160,8 @@ class RequestList(MyTreeView):
                 key = req['address']
                 icon = read_QIcon("bitcoin.png")
                 tooltip = 'onchain request'
+            if status == PR_UNPAID and expiration:
+                self._countdown_keys.add(key)
             items = [QStandardItem(e) for e in labels]
             self.set_editability(items)
             items[self.Columns.DATE].setData(request_type, ROLE_REQUEST_TYPE)
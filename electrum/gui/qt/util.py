@@ -7,7 +7,9 @@ import queue
 import traceback
 import os
 import webbrowser
+import threading
 
+from collections import OrderedDict
 from functools import partial, lru_cache
 from typing import NamedTuple, Callable, Optional, TYPE_CHECKING, Union, List, Dict
 
@@ -745,6 +747,72 @@ class TaskThread(QThread):
         self.tasks.put(None)
 
 
+class SnapshotThread(QThread):
+    '''Thread that computes snapshots of wallet state for the GUI.
+    Requests are keyed by their consumer: a new request replaces any
+    pending one with the same key, and results that were superseded
+    while being computed are dropped.  Callbacks are guaranteed to
+    happen in the context of its parent.'''
+
+    doneSig = pyqtSignal(object, object, object, object)
+
+    def __init__(self, parent, on_error=None):
+        super().__init__(parent)
+        self.on_error = on_error
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()  # key -> (generation, compute, on_result)
+        self._generations = {}  # key -> latest generation
+        self._stopped = False
+        self.doneSig.connect(self.on_done)
+        self.start()
+
+    def request(self, key, compute: Callable, on_result: Callable):
+        with self._cond:
+            generation = self._generations.get(key, 0) + 1
+            self._generations[key] = generation
+            self._pending[key] = (generation, compute, on_result)
+            self._cond.notify()
+
+    def cancel(self, key):
+        """Drops the pending request for key, and the result of a
+        computation for key that is already running."""
+        with self._cond:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self._pending.pop(key, None)
+
+    def is_current(self, key, generation) -> bool:
+        with self._cond:
+            return self._generations.get(key) == generation
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    break
+                key, (generation, compute, on_result) = self._pending.popitem(last=False)
+            try:
+                result = compute()
+                self.doneSig.emit(key, generation, result, on_result)
+            except BaseException:
+                self.doneSig.emit(key, generation, sys.exc_info(), self.on_error)
+
+    def on_done(self, key, generation, result, cb_result):
+        # This runs in the parent's thread.
+        if not self.is_current(key, generation):
+            return
+        if cb_result:
+            cb_result(result)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        # wait for a running computation, so that it does not outlive the wallet
+        self.wait()
+
+
 class ColorSchemeItem:
     def __init__(self, fg_color, bg_color):
         self.colors = (fg_color, bg_color)
@@ -65,8 +65,15 @@ class UTXOList(MyTreeView):
         self.update()
 
     def update(self):
+        self.parent.snapshot_thread.cancel(self)
         self.wallet = self.parent.wallet
-        utxos = self.wallet.get_utxos()
+        self.set_utxos(self.wallet.get_utxos())
+
+    def update_in_background(self):
+        self.wallet = self.parent.wallet
+        self.parent.snapshot_thread.request(self, self.wallet.get_utxos, self.set_utxos)
+
+    def set_utxos(self, utxos: Sequence[PartialTxInput]):
         self._maybe_reset_spend_list(utxos)
         self.utxo_dict = {}  # type: Dict[str, PartialTxInput]
         self.model().clear()
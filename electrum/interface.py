@@ -517,6 +517,7 @@ class Interface(Logger):
             self.network.trigger_callback('network_updated')
             await self.network.switch_unwanted_fork_interface()
             await self.network.switch_lagging_interface()
+            self.network.trigger_session_maintenance()
 
     async def _process_header_at_tip(self):
         height, header = self.tip, self.tip_header
@@ -27,6 +27,7 @@ import ast
 import json
 import copy
 import threading
+import bisect
 from collections import defaultdict
 from typing import Dict, Optional, List, Tuple, Set, Iterable, NamedTuple, Sequence
 
@@ -665,19 +666,43 @@ class JsonDB(Logger):
         prevout_n = str(prevout_n)
         return self.spent_outpoints.get(prevout_hash, {}).get(prevout_n)
 
+    @locked
+    def get_spending_txids(self, prevout_hash) -> Set[str]:
+        """Returns the txids of the children of prevout_hash."""
+        return set(self.spent_outpoints.get(prevout_hash, {}).values())
+
+    @locked
+    def get_spent_prevouts(self, tx_hash) -> List[Tuple[str, str]]:
+        """Returns the (prevout_hash, prevout_n) that tx_hash is recorded as spending."""
+        return list(self._spent_prevouts.get(tx_hash, ()))
+
     @modifier
     def remove_spent_outpoint(self, prevout_hash, prevout_n):
         prevout_n = str(prevout_n)
-        self.spent_outpoints[prevout_hash].pop(prevout_n, None)
+        tx_hash = self.spent_outpoints[prevout_hash].pop(prevout_n, None)
         if not self.spent_outpoints[prevout_hash]:
             self.spent_outpoints.pop(prevout_hash)
+        if tx_hash is not None:
+            self._unindex_spent_prevout(tx_hash, prevout_hash, prevout_n)
 
     @modifier
     def set_spent_outpoint(self, prevout_hash, prevout_n, tx_hash):
         prevout_n = str(prevout_n)
         if prevout_hash not in self.spent_outpoints:
             self.spent_outpoints[prevout_hash] = {}
+        old_tx_hash = self.spent_outpoints[prevout_hash].get(prevout_n)
+        if old_tx_hash is not None:
+            self._unindex_spent_prevout(old_tx_hash, prevout_hash, prevout_n)
         self.spent_outpoints[prevout_hash][prevout_n] = tx_hash
+        self._spent_prevouts[tx_hash].add((prevout_hash, prevout_n))
+
+    def _unindex_spent_prevout(self, tx_hash, prevout_hash, prevout_n):
+        prevouts = self._spent_prevouts.get(tx_hash)
+        if prevouts is None:
+            return
+        prevouts.discard((prevout_hash, prevout_n))
+        if not prevouts:
+            self._spent_prevouts.pop(tx_hash)
 
     @modifier
     def add_prevout_by_scripthash(self, scripthash: str, *, prevout: TxOutpoint, value: int) -> None:
@@ -739,6 +764,12 @@ class JsonDB(Logger):
     def list_verified_tx(self):
         return list(self.verified_tx.keys())
 
+    @locked
+    def list_verified_tx_above(self, height: int) -> List[str]:
+        """Returns the verified txids mined above height, by height."""
+        i = bisect.bisect_left(self._verified_tx_by_height, (height + 1,))
+        return [txid for _, txid in self._verified_tx_by_height[i:]]
+
     @locked
     def get_verified_tx(self, txid):
         if txid not in self.verified_tx:
@@ -752,12 +783,23 @@ class JsonDB(Logger):
 
     @modifier
     def add_verified_tx(self, txid, info):
+        self._unindex_verified_tx(txid)
         self.verified_tx[txid] = (info.height, info.timestamp, info.txpos, info.header_hash)
+        bisect.insort(self._verified_tx_by_height, (info.height, txid))
 
     @modifier
     def remove_verified_tx(self, txid):
+        self._unindex_verified_tx(txid)
         self.verified_tx.pop(txid, None)
 
+    def _unindex_verified_tx(self, txid):
+        if txid not in self.verified_tx:
+            return
+        key = (self.verified_tx[txid][0], txid)
+        i = bisect.bisect_left(self._verified_tx_by_height, key)
+        if i < len(self._verified_tx_by_height) and self._verified_tx_by_height[i] == key:
+            del self._verified_tx_by_height[i]
+
     def is_in_verified_tx(self, txid):
         return txid in self.verified_tx
 
@@ -926,6 +968,15 @@ class JsonDB(Logger):
                 if spending_txid not in self.transactions:
                     self.logger.info("removing unreferenced spent outpoint")
                     d.pop(prevout_n)
+        # spending txid -> set of (prevout_hash, prevout_n); the reverse of
+        # spent_outpoints, so that we can undo the spends of a tx we no longer have
+        self._spent_prevouts = defaultdict(set)  # type: Dict[str, Set[Tuple[str, str]]]
+        for prevout_hash, d in self.spent_outpoints.items():
+            for prevout_n, spending_txid in d.items():
+                self._spent_prevouts[spending_txid].add((prevout_hash, prevout_n))
+        # sorted list of (height, txid) of the verified txs, so that a
+        # reorg only needs to look at the txs above the fork
+        self._verified_tx_by_height = sorted((v[0], txid) for txid, v in self.verified_tx.items())
         # convert tx_fees tuples to NamedTuples
         for tx_hash, tuple_ in self.tx_fees.items():
             self.tx_fees[tx_hash] = TxFeesValue(*tuple_)
@@ -935,7 +986,9 @@ class JsonDB(Logger):
         self.txi.clear()
         self.txo.clear()
         self.spent_outpoints.clear()
+        self._spent_prevouts.clear()
         self.transactions.clear()
         self.history.clear()
         self.verified_tx.clear()
+        self._verified_tx_by_height.clear()
         self.tx_fees.clear()
@@ -26,7 +26,12 @@
 
 from unicodedata import normalize
 import hashlib
+import hmac
+import os
 import re
+import threading
+import time
+from collections import OrderedDict
 from typing import Tuple, TYPE_CHECKING, Union, Sequence, Optional, Dict, List, NamedTuple
 
 from . import bitcoin, ecc, constants, bip32
@@ -166,6 +171,80 @@ class KeyStore(Logger):
         return None, None
 
 
+SIGNING_SESSION_TIMEOUT = 300  # seconds
+
+
+class SigningSession:
+    """Decrypted key material of an unlocked software keystore.
+
+    Kept for a limited time, so that signing many inputs does not decrypt
+    the keystore and derive each key from the account root every time.
+    Private keys are cached in an LRU of bytearrays, which are overwritten
+    when they are evicted and when the session ends or expires. This is
+    best effort: copies handed out to callers are not tracked.
+    """
+
+    MAX_CACHED_KEYS = 1000
+
+    def __init__(self, password: Optional[str], *, timeout: float):
+        self._salt = os.urandom(16)
+        self._password_hash = self._hash_password(password)
+        self.expires_at = time.monotonic() + timeout
+        self.account_node = None  # type: Optional[BIP32Node]
+        self.branch_nodes = {}  # type: Dict[int, BIP32Node]
+        self.stretched_exponent = None  # type: Optional[int]  # old keystores
+        self._privkeys = OrderedDict()  # type: OrderedDict[Union[Tuple[int, ...], str], Tuple[bytearray, bool]]
+        self._closed = False
+        self._lock = threading.Lock()
+        self._timer = threading.Timer(timeout, self.close)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _hash_password(self, password: Optional[str]) -> bytes:
+        return hmac.new(self._salt, (password or '').encode('utf8'), hashlib.sha256).digest()
+
+    def is_unlocked_with(self, password: Optional[str]) -> bool:
+        if self._closed:
+            return False
+        if time.monotonic() >= self.expires_at:
+            self.close()
+            return False
+        return hmac.compare_digest(self._password_hash, self._hash_password(password))
+
+    def get_private_key(self, sequence, derive) -> Tuple[bytes, bool]:
+        """Returns the cached private key for sequence, calling
+        derive(sequence) -> (privkey, compressed) on a miss.
+        """
+        key = tuple(sequence) if isinstance(sequence, (list, tuple)) else sequence
+        with self._lock:
+            if self._closed:
+                raise Exception('signing session has ended')
+            item = self._privkeys.get(key)
+            if item is not None:
+                self._privkeys.move_to_end(key)
+                privkey, compressed = item
+                return bytes(privkey), compressed
+        privkey, compressed = derive(sequence)
+        with self._lock:
+            if not self._closed:
+                self._privkeys[key] = (bytearray(privkey), compressed)
+                while len(self._privkeys) > self.MAX_CACHED_KEYS:
+                    _, (evicted, _) = self._privkeys.popitem(last=False)
+                    evicted[:] = bytes(len(evicted))
+        return privkey, compressed
+
+    def close(self) -> None:
+        self._timer.cancel()
+        with self._lock:
+            self._closed = True
+            for privkey, _ in self._privkeys.values():
+                privkey[:] = bytes(len(privkey))
+            self._privkeys.clear()
+            self.account_node = None
+            self.branch_nodes.clear()
+            self.stretched_exponent = None
+
+
 class Software_KeyStore(KeyStore):
 
     def __init__(self, d):
@@ -173,17 +252,52 @@ class Software_KeyStore(KeyStore):
         self.pw_hash_version = d.get('pw_hash_version', 1)
         if self.pw_hash_version not in SUPPORTED_PW_HASH_VERSIONS:
             raise UnsupportedPasswordHashVersion(self.pw_hash_version)
+        self._signing_session = None  # type: Optional[SigningSession]
 
     def may_have_password(self):
         return not self.is_watching_only()
 
+    def start_signing_session(self, password, *, timeout: float = SIGNING_SESSION_TIMEOUT) -> None:
+        """Keeps the keystore unlocked for 'timeout' seconds. While the session
+        lasts, signing with the same password reuses decrypted and derived keys.
+        """
+        self.check_password(password)
+        self.end_signing_session()
+        session = SigningSession(password, timeout=timeout)
+        self._init_signing_session(session, password)
+        self._signing_session = session
+
+    def end_signing_session(self) -> None:
+        session, self._signing_session = self._signing_session, None
+        if session:
+            session.close()
+
+    def _init_signing_session(self, session: SigningSession, password) -> None:
+        pass
+
+    def _get_signing_session(self, password) -> Optional[SigningSession]:
+        session = self._signing_session
+        if session and session.is_unlocked_with(password):
+            return session
+        return None
+
+    def _derive_private_key_in_session(self, session: SigningSession, sequence, password) -> Tuple[bytes, bool]:
+        return self.get_private_key(sequence, password)
+
+    def _get_private_key_maybe_from_session(self, sequence, password) -> Tuple[bytes, bool]:
+        session = self._get_signing_session(password)
+        if session is None:
+            return self.get_private_key(sequence, password)
+        return session.get_private_key(
+            sequence, lambda seq: self._derive_private_key_in_session(session, seq, password))
+
     def sign_message(self, sequence, message, password) -> bytes:
-        privkey, compressed = self.get_private_key(sequence, password)
+        privkey, compressed = self._get_private_key_maybe_from_session(sequence, password)
         key = ecc.ECPrivkey(privkey)
         return key.sign_message(message, compressed)
 
     def decrypt_message(self, sequence, message, password) -> bytes:
-        privkey, compressed = self.get_private_key(sequence, password)
+        privkey, compressed = self._get_private_key_maybe_from_session(sequence, password)
         ec = ecc.ECPrivkey(privkey)
         decrypted = ec.decrypt_message(message)
         return decrypted
@@ -192,11 +306,12 @@ class Software_KeyStore(KeyStore):
         if self.is_watching_only():
             return
         # Raise if password is not correct.
-        self.check_password(password)
+        if self._get_signing_session(password) is None:
+            self.check_password(password)
         # Add private keys
         keypairs = self.get_tx_derivations(tx)
         for k, v in keypairs.items():
-            keypairs[k] = self.get_private_key(v, password)
+            keypairs[k] = self._get_private_key_maybe_from_session(v, password)
         # Sign
         if keypairs:
             tx.sign(keypairs)
@@ -271,6 +386,7 @@ class Imported_KeyStore(Software_KeyStore):
 
     def update_password(self, old_password, new_password):
         self.check_password(old_password)
+        self.end_signing_session()
         if new_password == '':
             new_password = None
         for k, v in self.keypairs.items():
@@ -452,6 +568,7 @@ class BIP32_KeyStore(Deterministic_KeyStore, Xpub):
 
     def update_password(self, old_password, new_password):
         self.check_password(old_password)
+        self.end_signing_session()
         if new_password == '':
             new_password = None
         if self.has_seed():
@@ -491,6 +608,21 @@ class BIP32_KeyStore(Deterministic_KeyStore, Xpub):
         pk = node.eckey.get_secret_bytes()
         return pk, True
 
+    def _init_signing_session(self, session, password):
+        session.account_node = BIP32Node.from_xkey(self.get_master_private_key(password))
+
+    def _derive_private_key_in_session(self, session, sequence, password):
+        sequence = list(sequence)
+        if not sequence:
+            return session.account_node.eckey.get_secret_bytes(), True
+        # receive/change branch nodes are shared by all keys of the session
+        branch = session.branch_nodes.get(sequence[0])
+        if branch is None:
+            branch = session.account_node.subkey_at_private_derivation(sequence[:1])
+            session.branch_nodes[sequence[0]] = branch
+        node = branch.subkey_at_private_derivation(sequence[1:])
+        return node.eckey.get_secret_bytes(), True
+
     def get_keypair(self, sequence, password):
         k, _ = self.get_private_key(sequence, password)
         cK = ecc.ECPrivkey(k).get_public_key_bytes()
@@ -582,6 +714,15 @@ class Old_KeyStore(Deterministic_KeyStore):
         pk = self.get_private_key_from_stretched_exponent(for_change, n, secexp)
         return pk, False
 
+    def _init_signing_session(self, session, password):
+        seed = self.get_hex_seed(password)
+        session.stretched_exponent = self.stretch_key(seed)
+
+    def _derive_private_key_in_session(self, session, sequence, password):
+        for_change, n = sequence
+        pk = self.get_private_key_from_stretched_exponent(for_change, n, session.stretched_exponent)
+        return pk, False
+
     def check_seed(self, seed, *, secexp=None):
         if secexp is None:
             secexp = self.stretch_key(seed)
@@ -619,6 +760,7 @@ class Old_KeyStore(Deterministic_KeyStore):
 
     def update_password(self, old_password, new_password):
         self.check_password(old_password)
+        self.end_signing_session()
         if new_password == '':
             new_password = None
         if self.has_seed():
@@ -150,7 +150,7 @@ def get_shared_secrets_along_route(payment_path_pubkeys: Sequence[bytes],
     # compute shared key for each hop
     for i in range(0, num_hops):
         hop_shared_secrets[i] = get_ecdh(ephemeral_key, payment_path_pubkeys[i])
-        ephemeral_pubkey = ecc.ECPrivkey(ephemeral_key).get_public_key_bytes()
+        ephemeral_pubkey = ecc.privkey_to_pubkey_bytes(ephemeral_key)
         blinding_factor = sha256(ephemeral_pubkey + hop_shared_secrets[i])
         blinding_factor_int = int.from_bytes(blinding_factor, byteorder="big")
         ephemeral_key_int = int.from_bytes(ephemeral_key, byteorder="big")
@@ -164,16 +164,19 @@ def new_onion_packet(payment_path_pubkeys: Sequence[bytes], session_key: bytes,
     num_hops = len(payment_path_pubkeys)
     hop_shared_secrets = get_shared_secrets_along_route(payment_path_pubkeys, session_key)
 
-    filler = generate_filler(b'rho', num_hops, PER_HOP_FULL_SIZE, hop_shared_secrets)
+    # the filler and the routing info are obfuscated with the same
+    # rho streams, so only generate them once per hop
+    rho_streams = [generate_cipher_stream(get_bolt04_onion_key(b'rho', secret), NUM_STREAM_BYTES)
+                   for secret in hop_shared_secrets]
+    filler = _generate_filler(num_hops, PER_HOP_FULL_SIZE, rho_streams)
     mix_header = bytes(HOPS_DATA_SIZE)
     next_hmac = bytes(PER_HOP_HMAC_SIZE)
 
     # compute routing info and MAC for each hop
     for i in range(num_hops-1, -1, -1):
-        rho_key = get_bolt04_onion_key(b'rho', hop_shared_secrets[i])
         mu_key = get_bolt04_onion_key(b'mu', hop_shared_secrets[i])
         hops_data[i].hmac = next_hmac
-        stream_bytes = generate_cipher_stream(rho_key, NUM_STREAM_BYTES)
+        stream_bytes = rho_streams[i]
         mix_header = mix_header[:-PER_HOP_FULL_SIZE]
         mix_header = hops_data[i].to_bytes() + mix_header
         mix_header = xor_bytes(mix_header, stream_bytes)
@@ -183,7 +186,7 @@ def new_onion_packet(payment_path_pubkeys: Sequence[bytes], session_key: bytes,
         next_hmac = hmac_oneshot(mu_key, msg=packet, digest=hashlib.sha256)
 
     return OnionPacket(
-        public_key=ecc.ECPrivkey(session_key).get_public_key_bytes(),
+        public_key=ecc.privkey_to_pubkey_bytes(session_key),
         hops_data=mix_header,
         hmac=next_hmac)
 
@@ -214,14 +217,19 @@ def calc_hops_data_for_payment(route: List['RouteEdge'], amount_msat: int, final
 def generate_filler(key_type: bytes, num_hops: int, hop_size: int,
                     shared_secrets: Sequence[bytes]) -> bytes:
     filler_size = (NUM_MAX_HOPS_IN_PAYMENT_PATH + 1) * hop_size
-    filler = bytearray(filler_size)
+    streams = [generate_cipher_stream(get_bolt04_onion_key(key_type, shared_secrets[i]), filler_size)
+               for i in range(0, num_hops-1)]
+    return _generate_filler(num_hops, hop_size, streams)
+
+
+def _generate_filler(num_hops: int, hop_size: int, streams: Sequence[bytes]) -> bytes:
+    """streams[i] must be at least (NUM_MAX_HOPS_IN_PAYMENT_PATH + 1) * hop_size long."""
+    filler_size = (NUM_MAX_HOPS_IN_PAYMENT_PATH + 1) * hop_size
+    filler = bytes(filler_size)
 
     for i in range(0, num_hops-1):  # -1, as last hop does not obfuscate
-        filler = filler[hop_size:]
-        filler += bytearray(hop_size)
-        stream_key = get_bolt04_onion_key(key_type, shared_secrets[i])
-        stream_bytes = generate_cipher_stream(stream_key, filler_size)
-        filler = xor_bytes(filler, stream_bytes)
+        filler = filler[hop_size:] + bytes(hop_size)
+        filler = xor_bytes(filler, streams[i][:filler_size])
 
     return filler[(NUM_MAX_HOPS_IN_PAYMENT_PATH-num_hops+2)*hop_size:]
 
@@ -256,9 +264,7 @@ def process_onion_packet(onion_packet: OnionPacket, associated_data: bytes,
 
     # calc next ephemeral key
     blinding_factor = sha256(onion_packet.public_key + shared_secret)
-    blinding_factor_int = int.from_bytes(blinding_factor, byteorder="big")
-    next_public_key_int = ecc.ECPubkey(onion_packet.public_key) * blinding_factor_int
-    next_public_key = next_public_key_int.get_public_key_bytes()
+    next_public_key = ecc.pubkey_tweak_mul(onion_packet.public_key, blinding_factor)
 
     hop_data = OnionHopsDataSingle.from_bytes(next_hops_data[:PER_HOP_FULL_SIZE])
     next_onion_packet = OnionPacket(
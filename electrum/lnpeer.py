@@ -55,6 +55,7 @@ if TYPE_CHECKING:
 
 
 LN_P2P_NETWORK_TIMEOUT = 20
+GOSSIP_QUERY_TIMEOUT = 60
 
 
 def channel_id_from_funding_tx(funding_txid: str, funding_index: int) -> Tuple[bytes, bytes]:
@@ -333,11 +334,9 @@ class Peer(Logger):
             self.logger.info('Received {} channel ids. (complete: {})'.format(len(ids), complete))
             await self.lnworker.add_new_ids(ids)
             while True:
-                todo = self.lnworker.get_ids_to_query()
-                if not todo:
-                    await asyncio.sleep(1)
-                    continue
+                todo = await self.lnworker.get_ids_to_query(self)
                 await self.get_short_channel_ids(todo)
+                self.lnworker.ids_queried(self)
 
     async def get_channel_range(self):
         first_block = constants.net.BLOCK_HEIGHT_FIRST_LIGHTNING_CHANNELS
@@ -424,7 +423,11 @@ class Peer(Logger):
         self.logger.info(f'Querying {len(ids)} short_channel_ids')
         assert not self.querying.is_set()
         self.query_short_channel_ids(ids)
-        await self.querying.wait()
+        try:
+            # if the peer stalls, drop it: its ids get queried from other peers
+            await asyncio.wait_for(self.querying.wait(), GOSSIP_QUERY_TIMEOUT)
+        except asyncio.TimeoutError as e:
+            raise GracefulDisconnect("query_short_channel_ids timed out") from e
         self.querying.clear()
 
     def query_short_channel_ids(self, ids, compressed=True):
@@ -14,7 +14,7 @@ from .util import bfh, bh2u, inv_dict, UserFacingException
 from .crypto import sha256
 from .transaction import (Transaction, PartialTransaction, PartialTxInput, TxOutpoint,
                           PartialTxOutput, opcodes, TxOutput)
-from .ecc import CURVE_ORDER, sig_string_from_der_sig, ECPubkey, string_to_number
+from .ecc import CURVE_ORDER, sig_string_from_der_sig
 from . import ecc, bitcoin, crypto, transaction
 from .bitcoin import push_script, redeem_script_to_address, address_to_script
 from . import segwit_addr
@@ -258,7 +258,7 @@ def privkey_to_pubkey(priv: bytes) -> bytes:
     return ecc.ECPrivkey(priv[:32]).get_public_key_bytes()
 
 def derive_pubkey(basepoint: bytes, per_commitment_point: bytes) -> bytes:
-    p = ecc.ECPubkey(basepoint) + ecc.generator() * ecc.string_to_number(sha256(per_commitment_point + basepoint))
+    p = ecc.ECPubkey(basepoint).tweak_add(ecc.string_to_number(sha256(per_commitment_point + basepoint)))
     return p.get_public_key_bytes()
 
 def derive_privkey(secret: int, per_commitment_point: bytes) -> int:
@@ -622,8 +622,7 @@ def extract_ctn_from_tx_and_chan(tx: Transaction, chan: 'Channel') -> int:
                                fundee_payment_basepoint=fundee_conf.payment_basepoint.pubkey)
 
 def get_ecdh(priv: bytes, pub: bytes) -> bytes:
-    pt = ECPubkey(pub) * string_to_number(priv)
-    return sha256(pt.get_public_key_bytes())
+    return ecc.ecdh(priv, pub)
 
 
 class LnLocalFeatures(IntFlag):
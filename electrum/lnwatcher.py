@@ -2,7 +2,7 @@
 # Distributed under the MIT software license, see the accompanying
 # file LICENCE or http://www.opensource.org/licenses/mit-license.php
 
-from typing import NamedTuple, Iterable, TYPE_CHECKING
+from typing import NamedTuple, Iterable, TYPE_CHECKING, Dict, Optional, Set, Tuple
 import os
 import queue
 import threading
@@ -10,11 +10,10 @@ import concurrent
 from collections import defaultdict
 import asyncio
 from enum import IntEnum, auto
-from typing import NamedTuple, Dict
 
 from .sql_db import SqlDB, sql
 from .json_db import JsonDB
-from .util import bh2u, bfh, log_exceptions, ignore_exceptions
+from .util import bh2u, bfh, log_exceptions, ignore_exceptions, chunks
 from . import wallet
 from .storage import WalletStorage
 from .address_synchronizer import AddressSynchronizer, TX_HEIGHT_LOCAL, TX_HEIGHT_UNCONF_PARENT, TX_HEIGHT_UNCONFIRMED
@@ -29,6 +28,20 @@ class ListenerItem(NamedTuple):
     # txs we broadcast are put on this queue so that the test can wait for them to get mined
     tx_queue : asyncio.Queue
 
+class SpendTree:
+    """What LNWatcher knows about the transactions spending a channel:
+    'spenders' maps each inspected outpoint to the txid spending it, or
+    None, and 'keys' are the txids and addresses whose changes can alter
+    the tree.
+    """
+
+    def __init__(self):
+        self.spenders = {}  # type: Dict[str, Optional[str]]
+        self.keys = set()  # type: Set[str]
+        self.added_addresses = False  # new outputs to watch were found
+        self.done = False  # reported as closed and deep; no need to look again unless it changes
+
+
 class TxMinedDepth(IntEnum):
     """ IntEnum because we call min() in get_deepest_tx_mined_depth_for_txids """
     DEEP = auto()
@@ -45,6 +58,9 @@ prevout VARCHAR(34),
 tx VARCHAR
 )"""
 
+create_sweep_txs_index="""
+CREATE INDEX IF NOT EXISTS sweep_txs_by_prevout ON sweep_txs (funding_outpoint, prevout)"""
+
 create_channel_info="""
 CREATE TABLE IF NOT EXISTS channel_info (
 outpoint VARCHAR(34) NOT NULL,
@@ -54,72 +70,163 @@ PRIMARY KEY(outpoint)
 
 
 class SweepStore(SqlDB):
+    """Sweep transactions of the channels we watch for others.
+
+    The store keeps an in-memory index of the prevouts that have sweep
+    transactions, with their counts and the highest ctn per channel, so
+    that breach detection and the ctn and count queries do not need to
+    go to the sql thread. The index is loaded when the database is
+    opened, and the methods reading it wait until then. It is updated
+    by the sql methods, after their commit.
+    """
+
+    # max number of prevouts per query, below sqlite's limit on variables
+    MAX_PREVOUTS_PER_QUERY = 500
 
     def __init__(self, path, network):
+        self.index_lock = threading.Lock()
+        self.index_loaded = threading.Event()
+        self.channels = {}  # type: Dict[str, str]  # funding outpoint -> address
+        self.sweeps = defaultdict(dict)  # type: Dict[str, Dict[str, int]]  # funding outpoint -> prevout -> number of txs
+        self.ctns = {}  # type: Dict[str, int]  # funding outpoint -> highest ctn we have sweep txs for
         super().__init__(network, path)
 
     def create_database(self):
+        try:
+            c = self.conn.cursor()
+            c.execute(create_channel_info)
+            c.execute(create_sweep_txs)
+            c.execute(create_sweep_txs_index)
+            self.conn.commit()
+            self._load_index()
+        finally:
+            # do not leave the readers of the index waiting if this failed
+            self.index_loaded.set()
+
+    def _load_index(self):
         c = self.conn.cursor()
-        c.execute(create_channel_info)
-        c.execute(create_sweep_txs)
-        self.conn.commit()
+        c.execute("SELECT outpoint, address FROM channel_info")
+        channels = dict(c.fetchall())
+        c.execute("SELECT funding_outpoint, prevout, count(*), max(ctn) FROM sweep_txs GROUP BY funding_outpoint, prevout")
+        with self.index_lock:
+            self.channels = channels
+            for funding_outpoint, prevout, num_tx, ctn in c.fetchall():
+                self.sweeps[funding_outpoint][prevout] = num_tx
+                self.ctns[funding_outpoint] = max(ctn, self.ctns.get(funding_outpoint, 0))
+
+    def has_sweep_tx(self, funding_outpoint: str, prevout: str) -> bool:
+        self.index_loaded.wait()
+        with self.index_lock:
+            return prevout in self.sweeps.get(funding_outpoint, {})
+
+    def list_sweep_tx(self) -> Set[str]:
+        self.index_loaded.wait()
+        with self.index_lock:
+            return set(self.sweeps)
+
+    def get_num_tx(self, funding_outpoint: str) -> int:
+        self.index_loaded.wait()
+        with self.index_lock:
+            return sum(self.sweeps.get(funding_outpoint, {}).values())
+
+    def has_channel(self, outpoint: str) -> bool:
+        self.index_loaded.wait()
+        with self.index_lock:
+            return outpoint in self.channels
+
+    def get_known_ctn(self, outpoint: str) -> Optional[int]:
+        """Like get_ctn, without the round trip, for channels we already watch."""
+        self.index_loaded.wait()
+        with self.index_lock:
+            if outpoint not in self.channels:
+                return None
+            return self.ctns.get(outpoint, 0)
 
     @sql
     def get_sweep_tx(self, funding_outpoint, prevout):
-        c = self.conn.cursor()
-        c.execute("SELECT tx FROM sweep_txs WHERE funding_outpoint=? AND prevout=?", (funding_outpoint, prevout))
-        return [Transaction(bh2u(r[0])) for r in c.fetchall()]
+        return self._get_sweep_txs(funding_outpoint, [prevout]).get(prevout, [])
 
     @sql
-    def list_sweep_tx(self):
+    def get_sweep_txs(self, funding_outpoint: str, prevouts: Iterable[str]) -> Dict[str, list]:
+        """Returns the sweep transactions of several prevouts of a channel,
+        in a single query."""
+        return self._get_sweep_txs(funding_outpoint, prevouts)
+
+    def _get_sweep_txs(self, funding_outpoint, prevouts):
+        result = defaultdict(list)
         c = self.conn.cursor()
-        c.execute("SELECT funding_outpoint FROM sweep_txs")
-        return set([r[0] for r in c.fetchall()])
+        # filter on both columns, so that sqlite uses sweep_txs_by_prevout
+        for batch in chunks(sorted(set(prevouts)), self.MAX_PREVOUTS_PER_QUERY):
+            c.execute("SELECT prevout, tx FROM sweep_txs WHERE funding_outpoint=? AND prevout IN ({})"
+                      .format(','.join('?' * len(batch))), (funding_outpoint, *batch))
+            for prevout, raw_tx in c.fetchall():
+                result[prevout].append(Transaction(bh2u(raw_tx)))
+        return dict(result)
 
     @sql
-    def add_sweep_tx(self, funding_outpoint, ctn, prevout, tx: Transaction):
-        c = self.conn.cursor()
-        assert tx.is_complete()
-        raw_tx = bfh(tx.serialize())
-        c.execute("""INSERT INTO sweep_txs (funding_outpoint, ctn, prevout, tx) VALUES (?,?,?,?)""", (funding_outpoint, ctn, prevout, raw_tx))
-        self.conn.commit()
+    def add_sweep_tx(self, funding_outpoint, ctn, prevout, tx):
+        self._add_sweep_txs([(funding_outpoint, ctn, prevout, tx)])
 
     @sql
-    def get_num_tx(self, funding_outpoint):
+    def add_sweep_txs(self, rows: Iterable[Tuple[str, int, str, object]]) -> None:
+        """Adds (funding_outpoint, ctn, prevout, tx) rows, in one transaction.
+        tx is a Transaction or its serialization."""
+        self._add_sweep_txs(rows)
+
+    def _add_sweep_txs(self, rows):
+        values = []
+        for funding_outpoint, ctn, prevout, tx in rows:
+            if isinstance(tx, Transaction):
+                assert tx.is_complete()
+                tx = tx.serialize()
+            values.append((funding_outpoint, ctn, prevout, bfh(tx)))
         c = self.conn.cursor()
-        c.execute("SELECT count(*) FROM sweep_txs WHERE funding_outpoint=?", (funding_outpoint,))
-        return int(c.fetchone()[0])
+        c.executemany("INSERT INTO sweep_txs (funding_outpoint, ctn, prevout, tx) VALUES (?,?,?,?)", values)
+        self.conn.commit()
+        with self.index_lock:
+            for funding_outpoint, ctn, prevout, _ in values:
+                prevouts = self.sweeps[funding_outpoint]
+                prevouts[prevout] = prevouts.get(prevout, 0) + 1
+                self.ctns[funding_outpoint] = max(ctn, self.ctns.get(funding_outpoint, 0))
 
     @sql
     def get_ctn(self, outpoint, addr):
-        if not self._has_channel(outpoint):
-            self._add_channel(outpoint, addr)
-        c = self.conn.cursor()
-        c.execute("SELECT max(ctn) FROM sweep_txs WHERE funding_outpoint=?", (outpoint,))
-        return int(c.fetchone()[0] or 0)
+        return self._get_ctns([(outpoint, addr)])[outpoint]
+
+    @sql
+    def get_ctns(self, channels: Iterable[Tuple[str, str]]) -> Dict[str, int]:
+        """Returns the highest ctn we have sweep txs for, for each
+        (outpoint, address), and starts watching the channels we did not
+        know about."""
+        return self._get_ctns(channels)
+
+    def _get_ctns(self, channels):
+        new_channels = [(address, outpoint) for outpoint, address in channels if not self.has_channel(outpoint)]
+        if new_channels:
+            c = self.conn.cursor()
+            c.executemany("INSERT OR IGNORE INTO channel_info (address, outpoint) VALUES (?,?)", new_channels)
+            self.conn.commit()
+        with self.index_lock:
+            for address, outpoint in new_channels:
+                self.channels[outpoint] = address
+            return {outpoint: self.ctns.get(outpoint, 0) for outpoint, address in channels}
 
     @sql
     def remove_sweep_tx(self, funding_outpoint):
         c = self.conn.cursor()
         c.execute("DELETE FROM sweep_txs WHERE funding_outpoint=?", (funding_outpoint,))
         self.conn.commit()
-
-    def _add_channel(self, outpoint, address):
-        c = self.conn.cursor()
-        c.execute("INSERT INTO channel_info (address, outpoint) VALUES (?,?)", (address, outpoint))
-        self.conn.commit()
+        with self.index_lock:
+            self.sweeps.pop(funding_outpoint, None)
+            self.ctns.pop(funding_outpoint, None)
 
     @sql
     def remove_channel(self, outpoint):
         c = self.conn.cursor()
         c.execute("DELETE FROM channel_info WHERE outpoint=?", (outpoint,))
         self.conn.commit()
-
-    def _has_channel(self, outpoint):
-        c = self.conn.cursor()
-        c.execute("SELECT * FROM channel_info WHERE outpoint=?", (outpoint,))
-        r = c.fetchone()
-        return r is not None
+        with self.index_lock:
+            self.channels.pop(outpoint, None)
 
     @sql
     def get_address(self, outpoint):
@@ -135,7 +242,6 @@ class SweepStore(SqlDB):
         return [(r[0], r[1]) for r in c.fetchall()]
 
 
-
 class LNWatcher(AddressSynchronizer):
     LOGGING_SHORTCUT = 'W'
 
@@ -145,10 +251,16 @@ class LNWatcher(AddressSynchronizer):
         self.channels = {}
         self.network = network
         self.network.register_callback(self.on_network_update,
-                                       ['network_updated', 'blockchain_updated', 'verified', 'wallet_updated', 'fee'])
+                                       ['network_updated', 'blockchain_updated', 'verified', 'wallet_updated', 'fee'],
+                                       filter=self.is_own_event, priority=True)
 
         # status gets populated when we run
         self.channel_status = {}
+        # cached spend trees, and the channels to look at again when a txid or address changes
+        self.spend_trees = {}  # type: Dict[str, SpendTree]
+        self._channels_by_key = defaultdict(set)  # type: Dict[str, Set[str]]
+        self._changes_pos = None  # type: Optional[int]
+        self._last_height = None  # type: Optional[int]
 
     def get_channel_status(self, outpoint):
         return self.channel_status.get(outpoint, 'unknown')
@@ -162,21 +274,104 @@ class LNWatcher(AddressSynchronizer):
     async def unwatch_channel(self, address, funding_outpoint):
         pass
 
+    def is_own_event(self, event, *args):
+        # 'verified' and 'wallet_updated' are also triggered for every wallet
+        return event not in ('verified', 'wallet_updated') or args[0] == self
+
     @log_exceptions
     async def on_network_update(self, event, *args):
-        if event in ('verified', 'wallet_updated'):
-            if args[0] != self:
-                return
         if not self.synchronizer:
             self.logger.info("synchronizer not set yet")
             return
         if not self.up_to_date:
             return
-        for address, outpoint in self.channels.items():
+        dirty = self.get_dirty_channels()
+        # confirmation depths only change with the height, but lnworker
+        # also needs to hear about open channels on every fee update
+        height = self.get_local_height()
+        notify_all = dirty is None or event == 'fee' or height != self._last_height
+        self._last_height = height
+        for address, outpoint in list(self.channels.items()):
+            tree = self.spend_trees.get(outpoint)
+            if dirty is None or outpoint in dirty:
+                self.forget_spend_tree(outpoint)
+            elif tree is not None and (tree.done or not notify_all):
+                continue
             await self.check_onchain_situation(address, outpoint)
 
+    def get_dirty_channels(self) -> Optional[Set[str]]:
+        """Funding outpoints of the channels whose spend tree might have
+        changed since the last call, or None if they all might have.
+        """
+        self._changes_pos, changed = self.changes.get_changes_since(self._changes_pos)
+        if changed is None:
+            return None
+        dirty = set()
+        for key in changed:
+            dirty |= self._channels_by_key.get(key, set())
+        return dirty
+
+    def forget_spend_tree(self, funding_outpoint: str) -> None:
+        tree = self.spend_trees.pop(funding_outpoint, None)
+        if tree is None:
+            return
+        for key in tree.keys:
+            outpoints = self._channels_by_key.get(key)
+            if outpoints is not None:
+                outpoints.discard(funding_outpoint)
+                if not outpoints:
+                    del self._channels_by_key[key]
+
+    def get_spend_tree(self, funding_outpoint: str) -> SpendTree:
+        tree = self.spend_trees.get(funding_outpoint)
+        if tree is None:
+            tree = self.spend_trees[funding_outpoint] = SpendTree()
+            for address, outpoint in self.channels.items():
+                if outpoint == funding_outpoint:
+                    tree.keys.add(address)
+            self._build_spend_tree(tree, funding_outpoint, 0)
+            for key in tree.keys:
+                self._channels_by_key[key].add(funding_outpoint)
+        return tree
+
+    def _build_spend_tree(self, tree: SpendTree, outpoint: str, n: int) -> None:
+        # FIXME: instead of stopping recursion at n == 2,
+        # we should detect which outputs are HTLCs
+        prev_txid, index = outpoint.split(':')
+        txid = self.db.get_spent_outpoint(prev_txid, int(index))
+        tree.spenders[outpoint] = txid
+        tree.keys.add(prev_txid)
+        if txid is None:
+            return
+        tree.keys.add(txid)
+        tx = self.db.get_transaction(txid)
+        for i, o in enumerate(tx.outputs()):
+            tree.keys.add(o.address)
+            if o.address not in self.get_addresses():
+                self.add_address(o.address)
+                tree.added_addresses = True
+            elif n < 2:
+                self._build_spend_tree(tree, txid+':%d'%i, n+1)
+
+    def evaluate_spend_tree(self, tree: SpendTree) -> bool:
+        """Updates channel_status for the outpoints of the tree, and
+        returns whether we should keep watching them."""
+        keep_watching = tree.added_addresses
+        for outpoint, txid in tree.spenders.items():
+            if txid is None:
+                self.channel_status[outpoint] = 'open'
+                keep_watching = True
+            elif self.get_tx_mined_depth(txid) != TxMinedDepth.DEEP:
+                self.channel_status[outpoint] = 'closed (%d)' % self.get_tx_height(txid).conf
+                keep_watching = True
+            else:
+                self.channel_status[outpoint] = 'closed (deep)'
+        return keep_watching
+
     async def check_onchain_situation(self, address, funding_outpoint):
-        keep_watching, spenders = self.inspect_tx_candidate(funding_outpoint, 0)
+        tree = self.get_spend_tree(funding_outpoint)
+        keep_watching = self.evaluate_spend_tree(tree)
+        spenders = tree.spenders
         funding_txid = funding_outpoint.split(':')[0]
         funding_height = self.get_tx_height(funding_txid)
         closing_txid = spenders.get(funding_outpoint)
@@ -195,38 +390,18 @@ class LNWatcher(AddressSynchronizer):
             await self.do_breach_remedy(funding_outpoint, spenders)
         if not keep_watching:
             await self.unwatch_channel(address, funding_outpoint)
+            tree.done = True
 
     async def do_breach_remedy(self, funding_outpoints, spenders):
         # overloaded in WatchTower
         pass
 
-    def inspect_tx_candidate(self, outpoint, n):
-        # FIXME: instead of stopping recursion at n == 2,
-        # we should detect which outputs are HTLCs
-        prev_txid, index = outpoint.split(':')
-        txid = self.db.get_spent_outpoint(prev_txid, int(index))
-        result = {outpoint:txid}
-        if txid is None:
-            self.channel_status[outpoint] = 'open'
-            #self.logger.info('keep watching because outpoint is unspent')
-            return True, result
-        keep_watching = (self.get_tx_mined_depth(txid) != TxMinedDepth.DEEP)
-        if keep_watching:
-            self.channel_status[outpoint] = 'closed (%d)' % self.get_tx_height(txid).conf
-            #self.logger.info('keep watching because spending tx is not deep')
-        else:
-            self.channel_status[outpoint] = 'closed (deep)'
-
-        tx = self.db.get_transaction(txid)
-        for i, o in enumerate(tx.outputs()):
-            if o.address not in self.get_addresses():
-                self.add_address(o.address)
-                keep_watching = True
-            elif n < 2:
-                k, r = self.inspect_tx_candidate(txid+':%d'%i, n+1)
-                keep_watching |= k
-                result.update(r)
-        return keep_watching, result
+    def inspect_tx_candidate(self, outpoint, n) -> Tuple[bool, Dict[str, Optional[str]]]:
+        """Returns whether to keep watching outpoint, and the txids spending
+        it and its descendants, without using the cached spend trees."""
+        tree = SpendTree()
+        self._build_spend_tree(tree, outpoint, n)
+        return self.evaluate_spend_tree(tree), tree.spenders
 
     def get_tx_mined_depth(self, txid: str):
         if not txid:
@@ -267,11 +442,15 @@ class WatchTower(LNWatcher):
             self.add_channel(outpoint, address)
 
     async def do_breach_remedy(self, funding_outpoint, spenders):
-        for prevout, spender in spenders.items():
-            if spender is not None:
-                continue
-            sweep_txns = await self.sweepstore.get_sweep_tx(funding_outpoint, prevout)
-            for tx in sweep_txns:
+        # most of the time nothing was breached, and the index tells us
+        # without a query that we have nothing to broadcast
+        prevouts = [prevout for prevout, spender in spenders.items()
+                    if spender is None and self.sweepstore.has_sweep_tx(funding_outpoint, prevout)]
+        if not prevouts:
+            return
+        sweep_txns = await self.sweepstore.get_sweep_txs(funding_outpoint, prevouts)
+        for prevout in prevouts:
+            for tx in sweep_txns.get(prevout, []):
                 await self.broadcast_or_log(funding_outpoint, tx)
 
     async def broadcast_or_log(self, funding_outpoint: str, tx: Transaction):
@@ -289,14 +468,15 @@ class WatchTower(LNWatcher):
             return txid
 
     def get_ctn(self, outpoint, addr):
+        ctn = self.sweepstore.get_known_ctn(outpoint)
+        if ctn is not None:
+            return ctn
         async def f():
             return await self.sweepstore.get_ctn(outpoint, addr)
         return self.network.run_from_another_thread(f())
 
     def get_num_tx(self, outpoint):
-        async def f():
-            return await self.sweepstore.get_num_tx(outpoint)
-        return self.network.run_from_another_thread(f())
+        return self.sweepstore.get_num_tx(outpoint)
 
     def add_sweep_tx(self, funding_outpoint: str, ctn:int, prevout: str, tx: str):
         async def f():
@@ -304,9 +484,7 @@ class WatchTower(LNWatcher):
         return self.network.run_from_another_thread(f())
 
     def list_sweep_tx(self):
-        async def f():
-            return await self.sweepstore.list_sweep_tx()
-        return self.network.run_from_another_thread(f())
+        return self.sweepstore.list_sweep_tx()
 
     def list_channels(self):
         async def f():
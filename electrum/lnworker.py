@@ -7,7 +7,7 @@ import os
 from decimal import Decimal
 import random
 import time
-from typing import Optional, Sequence, Tuple, List, Dict, TYPE_CHECKING
+from typing import Optional, Sequence, Tuple, List, Dict, TYPE_CHECKING, Set, Iterable
 import threading
 import socket
 import json
@@ -31,7 +31,7 @@ from .transaction import Transaction
 from .crypto import sha256
 from .bip32 import BIP32Node
 from .util import bh2u, bfh, InvoiceError, resolve_dns_srv, is_ip_address, log_exceptions
-from .util import ignore_exceptions, make_aiohttp_session
+from .util import ignore_exceptions
 from .util import timestamp_to_datetime
 from .logging import Logger
 from .lntransport import LNTransport, LNResponderTransport
@@ -288,6 +288,79 @@ class LNWorker(Logger):
         return choice
 
 
+class GossipSyncScheduler(Logger):
+    """Distributes unknown short_channel_ids among our gossip peers.
+
+    BOLT-07 allows a single query_short_channel_ids in flight per peer, so
+    initial sync is parallelized across peers. Each peer gets a batch sized
+    after its measured throughput. When a peer goes away, its batch is put
+    back into the pool so that other peers pick it up.
+
+    Batches are tracked per Peer object rather than per node_id: after a
+    reconnect, the old connection and the new one each have their own.
+    """
+
+    MIN_BATCH = 100
+    MAX_BATCH = 8000  # uncompressed ids must fit into a single message
+    INITIAL_BATCH = 500
+    TARGET_BATCH_SECONDS = 5
+
+    def __init__(self):
+        Logger.__init__(self)
+        self.unknown_ids = set()  # type: Set[bytes]  # not assigned to any peer
+        self.in_flight = {}  # type: Dict[Peer, Tuple[List[bytes], float]]  # peer -> (ids, time sent)
+        self.throughput = {}  # type: Dict[Peer, float]  # peer -> ids/second
+        self.ids_available = asyncio.Event()
+
+    def num_unknown_ids(self) -> int:
+        return len(self.unknown_ids) + sum(len(ids) for ids, t in self.in_flight.values())
+
+    def add_ids(self, ids: Iterable[bytes]):
+        self.unknown_ids.update(ids)
+        if self.unknown_ids:
+            self.ids_available.set()
+
+    def batch_size(self, peer: Peer) -> int:
+        rate = self.throughput.get(peer)
+        if rate is None:
+            return self.INITIAL_BATCH
+        return max(self.MIN_BATCH, min(self.MAX_BATCH, int(rate * self.TARGET_BATCH_SECONDS)))
+
+    async def get_batch(self, peer: Peer) -> List[bytes]:
+        # a batch the peer did not finish goes back into the pool
+        self.requeue_batch(peer)
+        while not self.unknown_ids:
+            self.ids_available.clear()
+            await self.ids_available.wait()
+        n = self.batch_size(peer)
+        ids = []
+        while self.unknown_ids and len(ids) < n:
+            ids.append(self.unknown_ids.pop())
+        self.in_flight[peer] = (ids, time.monotonic())
+        return ids
+
+    def batch_done(self, peer: Peer):
+        item = self.in_flight.pop(peer, None)
+        if item is None:
+            # already reassigned by peer_lost
+            return
+        ids, t0 = item
+        rate = len(ids) / max(time.monotonic() - t0, 0.001)
+        old_rate = self.throughput.get(peer)
+        self.throughput[peer] = rate if old_rate is None else 0.5 * old_rate + 0.5 * rate
+
+    def peer_lost(self, peer: Peer):
+        self.throughput.pop(peer, None)
+        self.requeue_batch(peer)
+
+    def requeue_batch(self, peer: Peer):
+        item = self.in_flight.pop(peer, None)
+        if item:
+            ids, t0 = item
+            self.logger.info(f'reassigning {len(ids)} ids of {bh2u(peer.pubkey)}')
+            self.add_ids(ids)
+
+
 class LNGossip(LNWorker):
     max_age = 14*24*3600
 
@@ -298,7 +371,7 @@ class LNGossip(LNWorker):
         super().__init__(xprv)
         self.localfeatures |= LnLocalFeatures.GOSSIP_QUERIES_OPT
         self.localfeatures |= LnLocalFeatures.GOSSIP_QUERIES_REQ
-        self.unknown_ids = set()
+        self.sync = GossipSyncScheduler()
         assert is_using_fast_ecc(), "verifying LN gossip msgs without libsecp256k1 is hopeless"
 
     def start_network(self, network: 'Network'):
@@ -308,27 +381,33 @@ class LNGossip(LNWorker):
     async def maintain_db(self):
         await self.channel_db.load_data()
         while True:
-            if len(self.unknown_ids) == 0:
+            if self.sync.num_unknown_ids() == 0:
                 self.channel_db.prune_old_policies(self.max_age)
                 self.channel_db.prune_orphaned_channels()
+                self.channel_db.save_snapshot()
             await asyncio.sleep(120)
 
     async def add_new_ids(self, ids):
         known = self.channel_db.get_channel_ids()
         new = set(ids) - set(known)
-        self.unknown_ids.update(new)
-        self.network.trigger_callback('unknown_channels', len(self.unknown_ids))
+        self.sync.add_ids(new)
+        self.network.trigger_callback('unknown_channels', self.sync.num_unknown_ids())
         self.network.trigger_callback('gossip_peers', self.num_peers())
 
-    def get_ids_to_query(self):
-        N = 500
-        l = list(self.unknown_ids)
-        self.unknown_ids = set(l[N:])
-        self.network.trigger_callback('unknown_channels', len(self.unknown_ids))
-        return l[0:N]
+    async def get_ids_to_query(self, peer: Peer) -> List[bytes]:
+        ids = await self.sync.get_batch(peer)
+        self.network.trigger_callback('unknown_channels', self.sync.num_unknown_ids())
+        return ids
+
+    def ids_queried(self, peer: Peer):
+        self.sync.batch_done(peer)
+        self.network.trigger_callback('unknown_channels', self.sync.num_unknown_ids())
 
     def peer_closed(self, peer):
-        self.peers.pop(peer.pubkey)
+        self.sync.peer_lost(peer)
+        # the node may have reconnected already
+        if self.peers.get(peer.pubkey) is peer:
+            self.peers.pop(peer.pubkey)
 
 
 class LNWallet(LNWorker):
@@ -364,8 +443,15 @@ class LNWallet(LNWorker):
             while True:
                 with self.lock:
                     channels = list(self.channels.values())
+                # one round trip to the sql thread for the ctns, and one for the new sweep txs
+                sweepstore = watchtower.sweepstore
+                ctns = await sweepstore.get_ctns([(chan.funding_outpoint.to_str(), chan.get_funding_address())
+                                                  for chan in channels])
+                rows = []
                 for chan in channels:
-                    await self.sync_channel_with_watchtower(chan, watchtower.sweepstore)
+                    rows.extend(self.get_sweep_rows(chan, ctns[chan.funding_outpoint.to_str()]))
+                if rows:
+                    await sweepstore.add_sweep_txs(rows)
                 await asyncio.sleep(5)
 
     @ignore_exceptions
@@ -385,7 +471,7 @@ class LNWallet(LNWorker):
             with self.lock:
                 channels = list(self.channels.values())
             try:
-                async with make_aiohttp_session(proxy=self.network.proxy) as session:
+                async with self.network.http_session() as session:
                     watchtower = myAiohttpClient(session, watchtower_url)
                     for chan in channels:
                         await self.sync_channel_with_watchtower(chan, watchtower)
@@ -395,19 +481,28 @@ class LNWallet(LNWorker):
     async def sync_channel_with_watchtower(self, chan: Channel, watchtower):
         outpoint = chan.funding_outpoint.to_str()
         addr = chan.get_funding_address()
-        current_ctn = chan.get_oldest_unrevoked_ctn(REMOTE)
         watchtower_ctn = await watchtower.get_ctn(outpoint, addr)
+        for row in self.get_sweep_rows(chan, watchtower_ctn):
+            await watchtower.add_sweep_tx(*row)
+
+    def get_sweep_rows(self, chan: Channel, watchtower_ctn: int):
+        """(funding_outpoint, ctn, prevout, raw_tx) of the sweep txs the
+        watchtower does not have yet."""
+        outpoint = chan.funding_outpoint.to_str()
+        current_ctn = chan.get_oldest_unrevoked_ctn(REMOTE)
+        rows = []
         for ctn in range(watchtower_ctn + 1, current_ctn):
             sweeptxs = chan.create_sweeptxs(ctn)
             for tx in sweeptxs:
-                await watchtower.add_sweep_tx(outpoint, ctn, tx.inputs()[0].prevout.to_str(), tx.serialize())
+                rows.append((outpoint, ctn, tx.inputs()[0].prevout.to_str(), tx.serialize()))
+        return rows
 
     def start_network(self, network: 'Network'):
         self.lnwatcher = LNWatcher(network)
         self.lnwatcher.start_network(network)
         self.network = network
-        self.network.register_callback(self.on_update_open_channel, ['update_open_channel'])
-        self.network.register_callback(self.on_update_closed_channel, ['update_closed_channel'])
+        self.network.register_callback(self.on_update_open_channel, ['update_open_channel'], priority=True)
+        self.network.register_callback(self.on_update_closed_channel, ['update_closed_channel'], priority=True)
         for chan_id, chan in self.channels.items():
             self.lnwatcher.add_channel(chan.funding_outpoint.to_str(), chan.get_funding_address())
 
@@ -605,6 +700,7 @@ class LNWallet(LNWorker):
         with self.lock:
             self.channels[chan.channel_id] = chan
             self.save_channels()
+        self.wallet.changes.add(chan.channel_id.hex())
         self.network.trigger_callback('channel', chan)
 
     def save_channels(self):
@@ -1135,6 +1231,7 @@ class LNWallet(LNWorker):
             self.payments[key] = info.amount, info.direction, info.status
         self.storage.put('lightning_payments', self.payments)
         self.storage.write()
+        self.wallet.changes.add(key)
 
     def get_payment_status(self, payment_hash):
         try:
@@ -1221,6 +1318,7 @@ class LNWallet(LNWorker):
             return
         self.storage.put('lightning_payments', self.payments)
         self.storage.write()
+        self.wallet.changes.add(payment_hash_hex)
 
     def get_balance(self):
         with self.lock:
@@ -26,20 +26,21 @@ import queue
 import os
 import random
 import re
-from collections import defaultdict
+from collections import defaultdict, deque
 import threading
 import socket
 import json
 import sys
 import ipaddress
 import asyncio
-from typing import NamedTuple, Optional, Sequence, List, Dict, Tuple, TYPE_CHECKING
+from typing import NamedTuple, Optional, Sequence, List, Dict, Tuple, TYPE_CHECKING, Callable, Any
 import traceback
 
 import dns
 import dns.resolver
 import aiorpcx
 from aiorpcx import TaskGroup
+import aiohttp
 from aiohttp import ClientResponse
 
 from . import util
@@ -52,11 +53,12 @@ from . import constants
 from . import blockchain
 from . import bitcoin
 from .blockchain import Blockchain, HEADER_SIZE
+from .transaction import Transaction
 from .interface import (Interface, serialize_server, deserialize_server,
                         RequestTimedOut, NetworkTimeout, BUCKET_NAME_OF_ONION_SERVERS,
                         NetworkException)
 from .version import PROTOCOL_VERSION
-from .simple_config import SimpleConfig
+from .simple_config import SimpleConfig, FEE_ESTIMATES_UPDATE_INTERVAL
 from .i18n import _
 from .logging import get_logger, Logger
 
@@ -64,7 +66,6 @@ if TYPE_CHECKING:
     from .channel_db import ChannelDB
     from .lnworker import LNGossip
     from .lnwatcher import WatchTower
-    from .transaction import Transaction
 
 
 _logger = get_logger(__name__)
@@ -225,6 +226,55 @@ class UntrustedServerReturnedError(NetworkException):
         return f"<UntrustedServerReturnedError original_exception: {repr(self.original_exception)}>"
 
 
+class ServerStats:
+    """Round-trip times and errors of the requests sent to a server."""
+
+    NUM_SAMPLES = 50
+    MIN_SAMPLES_FOR_PERCENTILE = 5
+    ERROR_DECAY = 0.8
+    # unhealthy servers get no new samples, so errors are also forgotten with time
+    ERROR_HALF_LIFE = 60  # seconds
+    MAX_ERRORS = 2  # above this decayed error count, the server is not used for reads
+
+    def __init__(self):
+        self.rtts = deque(maxlen=self.NUM_SAMPLES)
+        self._errors = 0.0
+        self._errors_time = time.monotonic()
+
+    @property
+    def errors(self) -> float:
+        age = time.monotonic() - self._errors_time
+        return self._errors * 0.5 ** (age / self.ERROR_HALF_LIFE)
+
+    def _set_errors(self, errors: float) -> None:
+        self._errors = errors
+        self._errors_time = time.monotonic()
+
+    def add_rtt(self, rtt: float) -> None:
+        self.rtts.append(rtt)
+        self._set_errors(self.errors * self.ERROR_DECAY)
+
+    def add_error(self) -> None:
+        self._set_errors(self.errors * self.ERROR_DECAY + 1)
+
+    def percentile(self, p: int) -> Optional[float]:
+        if len(self.rtts) < self.MIN_SAMPLES_FOR_PERCENTILE:
+            return None
+        rtts = sorted(self.rtts)
+        return rtts[min(len(rtts) - 1, len(rtts) * p // 100)]
+
+    def score(self) -> float:
+        """Lower is better. Servers without samples come first, so that
+        they get some."""
+        if not self.rtts:
+            return 0
+        rtts = sorted(self.rtts)
+        return rtts[len(rtts) // 2] * (1 + self.errors)
+
+    def is_healthy(self) -> bool:
+        return self.errors <= self.MAX_ERRORS
+
+
 _INSTANCE = None
 
 
@@ -269,18 +319,20 @@ class Network(Logger):
         # locks
         self.restart_lock = asyncio.Lock()
         self.bhi_lock = asyncio.Lock()
-        self.callback_lock = threading.Lock()
         self.recent_servers_lock = threading.RLock()       # <- re-entrant
         self.interfaces_lock = threading.Lock()            # for mutating/iterating self.interfaces
 
         self.server_peers = {}  # returned by interface (servers that the main interface knows about)
+        self.server_stats = {}  # type: Dict[str, ServerStats]  # of idempotent read requests
         self.recent_servers = self._read_recent_servers()  # note: needs self.recent_servers_lock
 
         self.banner = ''
         self.donation_address = ''
         self.relay_fee = None  # type: Optional[int]
         # callbacks set by the GUI
-        self.callbacks = defaultdict(list)      # note: needs self.callback_lock
+        self.event_bus = util.EventBus(self.asyncio_loop)
+        # outbound http requests (exchange rates, labels, BIP70, plugins)
+        self.http_pool = util.HttpSessionPool(limit_per_host=self.config.get('http_limit_per_host', 8))
 
         dir_path = os.path.join(self.config.path, 'certs')
         util.make_dir(dir_path)
@@ -296,6 +348,8 @@ class Network(Logger):
         self.connecting = set()
         self.server_queue = None
         self.proxy = None
+        # set when _maintain_sessions has something to do
+        self._session_maintenance_trigger = None  # type: Optional[asyncio.Event]
 
         # Dump network messages (all interfaces).  Set at runtime from the console.
         self.debug = False
@@ -337,26 +391,14 @@ class Network(Logger):
                 return func(self, *args, **kwargs)
         return func_wrapper
 
-    def register_callback(self, callback, events):
-        with self.callback_lock:
-            for event in events:
-                self.callbacks[event].append(callback)
+    def register_callback(self, callback, events, *, filter=None, priority=False):
+        self.event_bus.register(callback, events, filter=filter, priority=priority)
 
     def unregister_callback(self, callback):
-        with self.callback_lock:
-            for callbacks in self.callbacks.values():
-                if callback in callbacks:
-                    callbacks.remove(callback)
+        self.event_bus.unregister(callback)
 
     def trigger_callback(self, event, *args):
-        with self.callback_lock:
-            callbacks = self.callbacks[event][:]
-        for callback in callbacks:
-            # FIXME: if callback throws, we will lose the traceback
-            if asyncio.iscoroutinefunction(callback):
-                asyncio.run_coroutine_threadsafe(callback(event, *args), self.asyncio_loop)
-            else:
-                self.asyncio_loop.call_soon_threadsafe(callback, event, *args)
+        self.event_bus.trigger(event, *args)
 
     def _read_recent_servers(self):
         if not self.config.path:
@@ -428,6 +470,7 @@ class Network(Logger):
             server_peers = server_peers[:max_accepted_peers]
             self.server_peers = parse_servers(server_peers)
             self.notify('servers')
+            self.trigger_session_maintenance()
         async def get_relay_fee():
             relayfee = await session.send_request('blockchain.relayfee')
             if relayfee is None:
@@ -537,6 +580,7 @@ class Network(Logger):
                 self._set_status('connecting')
             self.connecting.add(server)
             self.server_queue.put(server)
+            self.trigger_session_maintenance()
 
     def _start_random_interface(self):
         with self.interfaces_lock:
@@ -564,6 +608,7 @@ class Network(Logger):
             else:
                 socket.getaddrinfo = socket._getaddrinfo
         self.trigger_callback('proxy_set', self.proxy)
+        self.trigger_session_maintenance()
 
     @staticmethod
     def _fast_getaddrinfo(host, *args, **kwargs):
@@ -649,6 +694,7 @@ class Network(Logger):
     def _set_oneserver(self, oneserver: bool):
         self.num_server = NUM_TARGET_CONNECTED_SERVERS if not oneserver else 0
         self.oneserver = bool(oneserver)
+        self.trigger_session_maintenance()
 
     async def _switch_to_random_interface(self):
         '''Switch to a random connected server other than the current one'''
@@ -737,6 +783,7 @@ class Network(Logger):
             self._set_status('connected')
             self.trigger_callback('network_updated')
             if blockchain_updated: self.trigger_callback('blockchain_updated')
+            self.trigger_session_maintenance()
 
     async def _close_interface(self, interface):
         if interface:
@@ -746,6 +793,7 @@ class Network(Logger):
             if interface.server == self.default_server:
                 self.interface = None
             await interface.close()
+            self.trigger_session_maintenance()
 
     @with_recent_servers_lock
     def _add_recent_server(self, server):
@@ -766,6 +814,7 @@ class Network(Logger):
             self._set_status('disconnected')
         await self._close_interface(interface)
         self.trigger_callback('network_updated')
+        self.trigger_session_maintenance()
 
     def get_network_timeout_seconds(self, request_type=NetworkTimeout.Generic) -> int:
         if self.oneserver and not self.auto_connect:
@@ -793,6 +842,7 @@ class Network(Logger):
         finally:
             try: self.connecting.remove(server)
             except KeyError: pass
+            self.trigger_session_maintenance()
 
         if server == self.default_server:
             await self.switch_to_interface(server)
@@ -870,6 +920,99 @@ class Network(Logger):
             raise BestEffortRequestFailed('no interface to do request on... gave up.')
         return make_reliable_wrapper
 
+    def get_server_stats(self, server: str) -> ServerStats:
+        stats = self.server_stats.get(server)
+        if stats is None:
+            stats = self.server_stats[server] = ServerStats()
+        return stats
+
+    def _get_read_interfaces(self) -> List[Interface]:
+        """Interfaces that can answer idempotent read requests, fastest
+        first: they must be on the chain of the main interface, and not
+        behind it.
+        """
+        main = self.interface
+        if not main or main.blockchain is None:
+            return []
+        with self.interfaces_lock:
+            interfaces = list(self.interfaces.values())
+        interfaces = [iface for iface in interfaces
+                      if iface.ready.done() and not iface.ready.cancelled()
+                      and not iface.got_disconnected.done()
+                      and iface.blockchain == main.blockchain
+                      and iface.tip >= main.tip
+                      and (iface is main or self.get_server_stats(iface.server).is_healthy())]
+        interfaces.sort(key=lambda iface: (self.get_server_stats(iface.server).score(), iface is not main))
+        return interfaces
+
+    async def _send_timed_request(self, iface: Interface, method: str, params: Sequence, *,
+                                  timeout=None, validate: Callable[[Any], None] = None):
+        stats = self.get_server_stats(iface.server)
+        t0 = time.monotonic()
+        try:
+            result = await iface.session.send_request(method, params, timeout=timeout)
+            if validate is not None:
+                validate(result)
+        except aiorpcx.jsonrpc.CodeMessageError:
+            stats.add_rtt(time.monotonic() - t0)  # the server answered
+            raise
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.info(f"read request {method} to {iface.server} failed: {repr(e)}")
+            stats.add_error()
+            raise
+        stats.add_rtt(time.monotonic() - t0)
+        return result
+
+    async def _send_read_request(self, method: str, params: Sequence, *, timeout=None,
+                                 validate: Callable[[Any], None] = None):
+        """Sends an idempotent request to the fastest interface. If it has
+        not answered within its p95 latency, or if it failed, the request
+        is also sent to the second fastest one, and the first answer wins.
+        If they both failed, the request is sent to the main interface.
+
+        Answers of interfaces other than the main one are checked with
+        'validate', which should raise if they are wrong: such an answer
+        counts as an error of the interface that sent it. Answers of the
+        main interface are left for the caller to check, as before.
+        """
+        main = self.interface
+        interfaces = self._get_read_interfaces()[:2]
+        if not interfaces or interfaces == [main]:
+            return await self._send_timed_request(main, method, params, timeout=timeout)
+        pending = {}  # type: Dict[asyncio.Future, Interface]
+        errors = {}  # type: Dict[Interface, BaseException]
+        def send(iface):
+            fut = asyncio.ensure_future(self._send_timed_request(iface, method, params, timeout=timeout,
+                                                                 validate=validate if iface is not main else None))
+            pending[fut] = iface
+        send(interfaces.pop(0))
+        hedge_after = self.get_server_stats(next(iter(pending.values())).server).percentile(95)
+        try:
+            while pending:
+                done, _ = await asyncio.wait(list(pending), timeout=hedge_after if interfaces else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for fut in done:
+                    iface = pending.pop(fut)
+                    if fut.cancelled():
+                        errors[iface] = asyncio.CancelledError()
+                    elif fut.exception() is None:
+                        return fut.result()
+                    else:
+                        errors[iface] = fut.exception()
+                if interfaces:
+                    send(interfaces.pop(0))
+        finally:
+            for fut in pending:
+                fut.cancel()
+        if main in errors:
+            raise errors[main]
+        main = self.interface
+        if not main:
+            raise next(iter(errors.values()))
+        return await self._send_timed_request(main, method, params, timeout=timeout)
+
     def catch_server_exceptions(func):
         async def wrapper(self, *args, **kwargs):
             try:
@@ -885,7 +1028,15 @@ class Network(Logger):
             raise Exception(f"{repr(tx_hash)} is not a txid")
         if not is_non_negative_integer(tx_height):
             raise Exception(f"{repr(tx_height)} is not a block height")
-        return await self.interface.session.send_request('blockchain.transaction.get_merkle', [tx_hash, tx_height])
+        def validate(merkle):
+            if self.config.get('skipmerklecheck'):
+                return
+            from .verifier import verify_tx_is_in_block
+            block_height = merkle.get('block_height')
+            header = self.blockchain().read_header(block_height)
+            verify_tx_is_in_block(tx_hash, merkle.get('merkle'), merkle.get('pos'), header, block_height)
+        return await self._send_read_request('blockchain.transaction.get_merkle', [tx_hash, tx_height],
+                                             validate=validate)
 
     @best_effort_reliable
     async def broadcast_transaction(self, tx: 'Transaction', *, timeout=None) -> None:
@@ -1058,15 +1209,22 @@ class Network(Logger):
     async def get_transaction(self, tx_hash: str, *, timeout=None) -> str:
         if not is_hash256_str(tx_hash):
             raise Exception(f"{repr(tx_hash)} is not a txid")
-        return await self.interface.session.send_request('blockchain.transaction.get', [tx_hash],
-                                                         timeout=timeout)
+        def validate(raw_tx):
+            tx = Transaction(raw_tx)
+            tx.deserialize()
+            if tx.txid() != tx_hash:
+                raise Exception(f"received tx does not match expected txid ({tx_hash} != {tx.txid()})")
+        return await self._send_read_request('blockchain.transaction.get', [tx_hash], timeout=timeout,
+                                             validate=validate)
 
     @best_effort_reliable
     @catch_server_exceptions
-    async def get_history_for_scripthash(self, sh: str) -> List[dict]:
+    async def get_history_for_scripthash(self, sh: str, *, use_main_interface=False) -> List[dict]:
         if not is_hash256_str(sh):
             raise Exception(f"{repr(sh)} is not a scripthash")
-        return await self.interface.session.send_request('blockchain.scripthash.get_history', [sh])
+        if use_main_interface:
+            return await self.interface.session.send_request('blockchain.scripthash.get_history', [sh])
+        return await self._send_read_request('blockchain.scripthash.get_history', [sh])
 
     @best_effort_reliable
     @catch_server_exceptions
@@ -1160,6 +1318,7 @@ class Network(Logger):
         self.disconnected_servers = set([])
         self.protocol = deserialize_server(self.default_server)[2]
         self.server_queue = queue.Queue()
+        self._session_maintenance_trigger = asyncio.Event()
         self._set_proxy(deserialize_proxy(self.config.get('proxy')))
         self._set_oneserver(self.config.get('oneserver', False))
         self._start_interface(self.default_server)
@@ -1195,7 +1354,10 @@ class Network(Logger):
         self.interfaces = {}  # type: Dict[str, Interface]
         self.connecting.clear()
         self.server_queue = None
-        if not full_shutdown:
+        self._session_maintenance_trigger = None
+        if full_shutdown:
+            await self.http_pool.close()
+        else:
             self.trigger_callback('network_updated')
 
     def stop(self):
@@ -1218,7 +1380,7 @@ class Network(Logger):
                 if now - self.server_retry_time > SERVER_RETRY_INTERVAL:
                     self.disconnected_servers.remove(self.default_server)
                     self.server_retry_time = now
-            else:
+            if self.default_server not in self.disconnected_servers:
                 await self.switch_to_interface(self.default_server)
 
     async def _maintain_sessions(self):
@@ -1228,13 +1390,13 @@ class Network(Logger):
                 await self.main_taskgroup.spawn(self._run_new_interface(server))
         async def maybe_queue_new_interfaces_to_be_launched_later():
             now = time.time()
-            for i in range(self.num_server - len(self.interfaces) - len(self.connecting)):
-                # FIXME this should try to honour "healthy spread of connected servers"
-                self._start_random_interface()
             if now - self.nodes_retry_time > NODES_RETRY_INTERVAL:
                 self.logger.info('network: retrying connections')
                 self.disconnected_servers = set([])
                 self.nodes_retry_time = now
+            for i in range(self.num_server - len(self.interfaces) - len(self.connecting)):
+                # FIXME this should try to honour "healthy spread of connected servers"
+                self._start_random_interface()
         async def maintain_healthy_spread_of_connected_servers():
             with self.interfaces_lock: interfaces = list(self.interfaces.values())
             random.shuffle(interfaces)
@@ -1247,9 +1409,13 @@ class Network(Logger):
             await self._ensure_there_is_a_main_interface()
             if self.is_connected():
                 if self.config.is_fee_estimates_update_required():
+                    self.config.requested_fee_estimates()  # before our next timer is computed
                     await self.interface.group.spawn(self._request_fee_estimates, self.interface)
 
         while True:
+            trigger = self._session_maintenance_trigger
+            if trigger:
+                trigger.clear()
             try:
                 await launch_already_queued_up_new_interfaces()
                 await maybe_queue_new_interfaces_to_be_launched_later()
@@ -1260,7 +1426,52 @@ class Network(Logger):
                 group = self.main_taskgroup
                 if not group or group._closed:
                     raise
+            await self._wait_for_session_maintenance(self._get_time_until_session_maintenance())
+
+    def trigger_session_maintenance(self):
+        """Wakes up _maintain_sessions. Can be called from any thread."""
+        trigger = self._session_maintenance_trigger
+        if trigger:
+            self.asyncio_loop.call_soon_threadsafe(trigger.set)
+
+    def _get_time_until_session_maintenance(self) -> Optional[float]:
+        """Time until one of the retry timers of _maintain_sessions expires,
+        or None if it only needs to run when triggered.
+        """
+        deadlines = []
+        if self.is_connected():
+            deadlines.append(self.config.last_time_fee_estimates_requested + FEE_ESTIMATES_UPDATE_INTERVAL)
+        if self.disconnected_servers:
+            deadlines.append(self.nodes_retry_time + NODES_RETRY_INTERVAL)
+            if (not self.is_connected() and not self.is_connecting()
+                    and self.default_server in self.disconnected_servers):
+                deadlines.append(self.server_retry_time + SERVER_RETRY_INTERVAL)
+        if not deadlines:
+            return None
+        # the timers compare with '>', so wake up a bit after the deadline
+        return max(0, min(deadlines) - time.time()) + 0.1
+
+    async def _wait_for_session_maintenance(self, timeout: Optional[float]):
+        trigger = self._session_maintenance_trigger
+        if trigger is None:
             await asyncio.sleep(0.1)
+            return
+        try:
+            await asyncio.wait_for(trigger.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    @classmethod
+    def http_session(cls):
+        """Returns an async context manager that yields an aiohttp session
+        going through the proxy. On the network's event loop, the session
+        is shared, and must not be closed; elsewhere, a new one is made.
+        """
+        network = cls.get_instance()
+        if network and asyncio.get_event_loop() is network.asyncio_loop:
+            return network.http_pool.session(network.proxy)
+        proxy = network.proxy if network else None
+        return make_aiohttp_session(proxy)
 
     @classmethod
     async def _send_http_on_proxy(cls, method: str, url: str, params: str = None,
@@ -1273,19 +1484,22 @@ class Network(Logger):
             headers = {}
         if on_finish is None:
             on_finish = default_on_finish
-        network = cls.get_instance()
-        proxy = network.proxy if network else None
-        async with make_aiohttp_session(proxy, timeout=timeout) as session:
+        if isinstance(timeout, (int, float)):
+            timeout = aiohttp.ClientTimeout(total=timeout)
+        kwargs = {'headers': headers}
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        async with cls.http_session() as session:
             if method == 'get':
-                async with session.get(url, params=params, headers=headers) as resp:
+                async with session.get(url, params=params, **kwargs) as resp:
                     return await on_finish(resp)
             elif method == 'post':
                 assert body is not None or json is not None, 'body or json must be supplied if method is post'
                 if body is not None:
-                    async with session.post(url, data=body, headers=headers) as resp:
+                    async with session.post(url, data=body, **kwargs) as resp:
                         return await on_finish(resp)
                 elif json is not None:
-                    async with session.post(url, json=json, headers=headers) as resp:
+                    async with session.post(url, json=json, **kwargs) as resp:
                         return await on_finish(resp)
             else:
                 assert False
@@ -1312,17 +1526,26 @@ class Network(Logger):
     async def send_multiple_requests(self, servers: List[str], method: str, params: Sequence):
         responses = dict()
         async def get_response(server):
-            interface = Interface(self, server, self.proxy)
+            # reuse the interface if we are connected to that server
+            with self.interfaces_lock:
+                interface = self.interfaces.get(server)
+            is_temporary = interface is None
+            if is_temporary:
+                interface = Interface(self, server, self.proxy)
             timeout = self.get_network_timeout_seconds(NetworkTimeout.Urgent)
             try:
-                await asyncio.wait_for(interface.ready, timeout)
+                await asyncio.wait_for(asyncio.shield(interface.ready), timeout)
             except BaseException as e:
-                await interface.close()
+                if is_temporary:
+                    await interface.close()
                 return
             try:
                 res = await interface.session.send_request(method, params, timeout=10)
             except Exception as e:
                 res = e
+            finally:
+                if is_temporary:
+                    await interface.close()
             responses[interface.server] = res
         async with TaskGroup() as group:
             for server in servers:
@@ -23,9 +23,12 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import hashlib
+import os
 import sys
+import threading
 import time
-from typing import Optional, List
+from collections import OrderedDict
+from typing import Optional, List, Tuple
 import asyncio
 import urllib.parse
 
@@ -39,7 +42,7 @@ except ImportError:
     sys.exit("Error: could not find paymentrequest_pb2.py. Create it with 'protoc --proto_path=electrum/ --python_out=electrum/ electrum/paymentrequest.proto'")
 
 from . import bitcoin, ecc, util, transaction, x509, rsakey
-from .util import bh2u, bfh, export_meta, import_meta, make_aiohttp_session
+from .util import bh2u, bfh, export_meta, import_meta
 from .util import PR_UNPAID, PR_EXPIRED, PR_PAID, PR_UNKNOWN, PR_INFLIGHT
 from .crypto import sha256
 from .bitcoin import address_to_script
@@ -55,13 +58,32 @@ REQUEST_HEADERS = {'Accept': 'application/bitcoin-paymentrequest', 'User-Agent':
 ACK_HEADERS = {'Content-Type':'application/bitcoin-payment','Accept':'application/bitcoin-paymentack','User-Agent':'Electrum'}
 
 ca_path = certifi.where()
-ca_list = None
-ca_keyID = None
+ca_list = None  # type: Optional[x509.CertificateStore]
+ca_lock = threading.Lock()
+
+# results of verify_cert_chain, for merchants we have seen before
+verified_chains = OrderedDict()  # type: OrderedDict[bytes, Tuple[List[x509.X509], x509.X509]]
+MAX_VERIFIED_CHAINS = 100
+
+
+def get_ca_cache_path() -> Optional[str]:
+    path = util.user_dir()
+    if path and os.path.isdir(path):
+        return os.path.join(path, 'ca_index.json')
+
 
 def load_ca_list():
-    global ca_list, ca_keyID
-    if ca_list is None:
-        ca_list, ca_keyID = x509.load_certificates(ca_path)
+    global ca_list
+    with ca_lock:
+        if ca_list is not None:
+            try:
+                st = os.stat(ca_path)
+            except OSError:
+                return
+            if [st.st_mtime, st.st_size] == ca_list._bundle_id:
+                return
+        ca_list = x509.CertificateStore(ca_path, get_ca_cache_path())
+        verified_chains.clear()
 
 
 
@@ -72,9 +94,8 @@ async def get_payment_request(url: str) -> 'PaymentRequest':
     if u.scheme in ('http', 'https'):
         resp_content = None
         try:
-            proxy = Network.get_instance().proxy
-            async with make_aiohttp_session(proxy, headers=REQUEST_HEADERS) as session:
-                async with session.get(url) as response:
+            async with Network.http_session() as session:
+                async with session.get(url, headers=REQUEST_HEADERS) as response:
                     resp_content = await response.read()
                     response.raise_for_status()
                     # Guard against `bitcoin:`-URIs with invalid payment request URLs
@@ -285,9 +306,8 @@ class PaymentRequest:
         payurl = urllib.parse.urlparse(pay_det.payment_url)
         resp_content = None
         try:
-            proxy = Network.get_instance().proxy
-            async with make_aiohttp_session(proxy, headers=ACK_HEADERS) as session:
-                async with session.post(payurl.geturl(), data=pm) as response:
+            async with Network.http_session() as session:
+                async with session.post(payurl.geturl(), data=pm, headers=ACK_HEADERS) as response:
                     resp_content = await response.read()
                     response.raise_for_status()
                     try:
@@ -353,6 +373,26 @@ def sign_request_with_alias(pr, alias, alias_privkey):
 def verify_cert_chain(chain):
     """ Verify a chain of certificates. The last certificate is the CA"""
     load_ca_list()
+    key = sha256(b''.join(len(c).to_bytes(4, 'big') + bytes(c) for c in chain))
+    with ca_lock:
+        r = verified_chains.get(key)
+        if r is not None:
+            verified_chains.move_to_end(key)
+    if r is not None:
+        x509_chain, ca = r
+        # any certificate of the chain may have expired since it was verified
+        for x in x509_chain:
+            x.check_date()
+        return x509_chain[0], ca
+    x509_chain, ca = _verify_cert_chain(chain)
+    with ca_lock:
+        verified_chains[key] = x509_chain, ca
+        while len(verified_chains) > MAX_VERIFIED_CHAINS:
+            verified_chains.popitem(last=False)
+    return x509_chain[0], ca
+
+
+def _verify_cert_chain(chain):
     # parse the chain
     cert_num = len(chain)
     x509_chain = []
@@ -370,9 +410,8 @@ def verify_cert_chain(chain):
     ca = x509_chain[cert_num-1]
     if ca.getFingerprint() not in ca_list:
         keyID = ca.get_issuer_keyID()
-        f = ca_keyID.get(keyID)
-        if f:
-            root = ca_list[f]
+        root = ca_list.get_by_keyID(keyID)
+        if root:
             x509_chain.append(root)
         else:
             raise Exception("Supplied CA Not Found in Trusted CA Store.")
@@ -399,8 +438,9 @@ def verify_cert_chain(chain):
             raise Exception("Algorithm not supported: {}".format(algo))
         if not verify:
             raise Exception("Certificate not Signed by Provided CA Certificate Chain")
-
-    return x509_chain[0], ca
+    for x in x509_chain[1:]:
+        x.check_date()
+    return x509_chain, ca
 
 
 def check_ssl_config(config):
@@ -10,7 +10,7 @@ import base64
 from electrum.plugin import BasePlugin, hook
 from electrum.crypto import aes_encrypt_with_iv, aes_decrypt_with_iv
 from electrum.i18n import _
-from electrum.util import log_exceptions, ignore_exceptions, make_aiohttp_session
+from electrum.util import log_exceptions, ignore_exceptions
 from electrum.network import Network
 
 
@@ -79,17 +79,13 @@ class LabelsPlugin(BasePlugin):
 
     async def do_get(self, url = "/labels"):
         url = 'https://' + self.target_host + url
-        network = Network.get_instance()
-        proxy = network.proxy if network else None
-        async with make_aiohttp_session(proxy) as session:
+        async with Network.http_session() as session:
             async with session.get(url) as result:
                 return await result.json()
 
     async def do_post(self, url = "/labels", data=None):
         url = 'https://' + self.target_host + url
-        network = Network.get_instance()
-        proxy = network.proxy if network else None
-        async with make_aiohttp_session(proxy) as session:
+        async with Network.http_session() as session:
             async with session.post(url, json=data) as result:
                 try:
                     return await result.json()
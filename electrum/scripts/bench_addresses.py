@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# Times validating 100k distinct addresses (p2pkh, p2sh, p2wpkh), and
+# repeated lookups for the addresses of a wallet, which hit the caches.
+import os
+import time
+
+from electrum import bitcoin
+
+
+NUM_ADDRESSES = 100000
+WALLET_SIZE = 20000
+
+
+def make_addresses():
+    addrs = []
+    for i in range(NUM_ADDRESSES):
+        h = os.urandom(20)
+        if i % 3 == 0:
+            addrs.append(bitcoin.hash160_to_p2pkh(h))
+        elif i % 3 == 1:
+            addrs.append(bitcoin.hash160_to_p2sh(h))
+        else:
+            addrs.append(bitcoin.hash_to_segwit_addr(h, witver=0))
+    return addrs
+
+
+def clear_caches():
+    bitcoin._is_address.cache_clear()
+    bitcoin._address_to_script.cache_clear()
+    bitcoin._address_to_scripthash.cache_clear()
+
+
+def timeit(name, f, addrs):
+    t0 = time.perf_counter()
+    for addr in addrs:
+        f(addr)
+    dt = time.perf_counter() - t0
+    print(f'{name:36s} {dt:8.3f} s  {dt / len(addrs) * 1e6:8.2f} us/addr')
+
+
+if __name__ == '__main__':
+    addrs = make_addresses()
+    clear_caches()
+    timeit(f'is_address, {NUM_ADDRESSES} distinct', bitcoin.is_address, addrs)
+    clear_caches()
+    timeit(f'address_to_scripthash, {NUM_ADDRESSES} distinct', bitcoin.address_to_scripthash, addrs)
+    wallet = addrs[:WALLET_SIZE]
+    clear_caches()
+    for run in ('first', 'cached'):
+        timeit(f'is_address, {WALLET_SIZE} {run}', bitcoin.is_address, wallet)
+        timeit(f'address_to_scripthash, {WALLET_SIZE} {run}', bitcoin.address_to_scripthash, wallet)
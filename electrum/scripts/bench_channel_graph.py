@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# Compares the resident memory of a synthetic channel graph kept
+# as dicts of NamedTuples with the same graph kept in a GraphStore.
+import os
+import random
+import resource
+from collections import defaultdict
+from multiprocessing import Pool
+
+from electrum.channel_db import ChannelInfo, Policy, GraphStore
+from electrum.lnutil import ShortChannelID
+
+
+NUM_NODES = 10000
+NUM_CHANNELS = 80000
+
+
+def rss_kb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def make_graph():
+    rnd = random.Random(0)
+    # fresh bytes objects per row, like rows read from sqlite
+    node_id = lambda i: bytes([2]) + i.to_bytes(32, 'big')
+    for i in range(NUM_CHANNELS):
+        n1, n2 = sorted(rnd.sample(range(NUM_NODES), 2))
+        scid = ShortChannelID.from_components(500000 + i // 1000, i % 1000, 0)
+        ci = ChannelInfo(scid, node_id(n1), node_id(n2), None)
+        policies = [Policy(key=scid + node_id(n), cltv_expiry_delta=144, htlc_minimum_msat=1000,
+                           htlc_maximum_msat=rnd.choice([None, 10**10]), fee_base_msat=1000,
+                           fee_proportional_millionths=rnd.randrange(5000), channel_flags=direction,
+                           message_flags=1, timestamp=1570000000 + rnd.randrange(10**6))
+                    for direction, n in enumerate((n1, n2))]
+        yield ci, policies
+
+
+def build_dicts():
+    channels = {}
+    policies = {}
+    channels_for_node = defaultdict(set)
+    for ci, pols in make_graph():
+        channels[ci.short_channel_id] = ci
+        channels_for_node[ci.node1_id].add(ci.short_channel_id)
+        channels_for_node[ci.node2_id].add(ci.short_channel_id)
+        for p in pols:
+            policies[(p.start_node, p.short_channel_id)] = p
+    return channels, policies, channels_for_node
+
+
+def build_graph_store():
+    g = GraphStore()
+    for ci, pols in make_graph():
+        g.add_channel(ci)
+        for p in pols:
+            g.set_policy(p)
+    g.compact()
+    return g
+
+
+def num_channels(graph):
+    if isinstance(graph, GraphStore):
+        return graph.num_channels
+    channels, policies, channels_for_node = graph
+    return len(channels)
+
+
+def measure(name):
+    before = rss_kb()
+    graph = {'dicts': build_dicts, 'graph_store': build_graph_store}[name]()
+    # measured while the graph is still alive
+    return rss_kb() - before, num_channels(graph)
+
+
+if __name__ == '__main__':
+    print(f'{NUM_CHANNELS} channels, {NUM_NODES} nodes')
+    with Pool(1, maxtasksperchild=1) as pool:
+        results = {name: pool.apply(measure, (name,)) for name in ('dicts', 'graph_store')}
+    for name, (kb, n) in results.items():
+        print(f'{name:12s} {kb / 1024:8.1f} MB  ({n} channels)')
+    print(f'reduction: {results["dicts"][0] / max(results["graph_store"][0], 1):.1f}x')
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# Times common EC workloads with python-ecdsa, and with libsecp256k1 if available:
+# BIP32 child derivation, LN per-commitment key derivation, and message signing.
+import time
+
+from electrum import ecc, ecc_fast
+from electrum.bip32 import BIP32Node
+from electrum.lnutil import (derive_pubkey, derive_privkey, derive_blinded_pubkey,
+                             get_per_commitment_secret_from_seed, secret_to_pubkey)
+
+
+XPRV = 'xprv9s21ZrQH143K3QTDL4LXw2F7HEK3wJUD2nW2nRk4stbPy6cq3jPPqjiChkVvvNKmPGJxWUtg6LnF5kejMRNNU3TGtRBeJgk33yuGBxrMPHi'
+NUM_RUNS = 200
+
+
+def timeit(f, n=NUM_RUNS):
+    t0 = time.perf_counter()
+    for i in range(n):
+        f(i)
+    return (time.perf_counter() - t0) / n * 1000
+
+
+def run_benchmarks():
+    node = BIP32Node.from_xkey(XPRV)
+    account = node.subkey_at_private_derivation("m/84'/0'/0'")
+    account_xpub = account.to_xpub()
+    secret = int.from_bytes(bytes(range(1, 33)), 'big')
+    basepoint = secret_to_pubkey(secret)
+    seed = bytes(32)
+    privkey = ecc.ECPrivkey(bytes(range(1, 33)))
+    results = {}
+    results['bip32 private derivation'] = timeit(lambda i: account.subkey_at_private_derivation([0, i]))
+    results['bip32 public derivation'] = timeit(lambda i: BIP32Node.from_xkey(account_xpub).subkey_at_public_derivation([0, i]))
+
+    def per_commitment(i):
+        pcp = secret_to_pubkey(int.from_bytes(get_per_commitment_secret_from_seed(seed, 2**48 - 1 - i), 'big'))
+        derive_pubkey(basepoint, pcp)
+        derive_privkey(secret, pcp)
+        derive_blinded_pubkey(basepoint, pcp)
+    results['ln per-commitment keys'] = timeit(per_commitment, 50)
+    results['sign_message'] = timeit(lambda i: privkey.sign_message(i.to_bytes(4, 'big'), True))
+    results['sign_transaction'] = timeit(lambda i: privkey.sign_transaction(bytes(28) + i.to_bytes(4, 'big')))
+    return results
+
+
+if __name__ == '__main__':
+    ecc_fast.undo_monkey_patching_of_python_ecdsa_internals_with_libsecp256k1()
+    slow = run_benchmarks()
+    ecc_fast.do_monkey_patching_of_python_ecdsa_internals_with_libsecp256k1()
+    fast = run_benchmarks() if ecc_fast.is_using_fast_ecc() else None
+    print(f'{"ms per operation":28s} {"python-ecdsa":>14s} {"libsecp256k1":>14s}')
+    for name, ms in slow.items():
+        fast_ms = f'{fast[name]:14.3f}' if fast else f'{"n/a":>14s}'
+        print(f'{name:28s} {ms:14.3f} {fast_ms}')
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# Counts the callback invocations caused by the events of a simulated
+# sync of a wallet with many transactions, with two wallet windows and a
+# LNWatcher registered, with the network's EventBus and with the old
+# one-callback-per-event fan-out.
+#
+#   bench_events.py [num_txs]
+import asyncio
+import sys
+import time
+from collections import Counter, defaultdict
+
+from electrum.util import EventBus
+
+
+NUM_TXS = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+TXS_PER_TICK = 50       # transactions processed between two loop iterations
+TXS_PER_HEADER = 200    # transactions per new header
+
+
+class FanOut:
+    """How Network.trigger_callback used to dispatch events."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.callbacks = defaultdict(list)
+
+    def register(self, callback, events, *, filter=None, priority=False):
+        for event in events:
+            self.callbacks[event].append(callback)
+
+    def trigger(self, event, *args):
+        for callback in self.callbacks[event][:]:
+            if asyncio.iscoroutinefunction(callback):
+                asyncio.run_coroutine_threadsafe(callback(event, *args), self.loop)
+            else:
+                self.loop.call_soon_threadsafe(callback, event, *args)
+
+
+class Window:
+
+    def __init__(self, wallet, counter):
+        self.wallet = wallet
+        self.counter = counter
+
+    def is_event_for_this_window(self, event, *args):
+        if event in ('wallet_updated', 'verified', 'new_transaction', 'channels_updated'):
+            return args[0] == self.wallet
+        return True
+
+    def on_network(self, event, *args):
+        self.counter['window'] += 1
+
+
+class Watcher:
+
+    def __init__(self, counter):
+        self.counter = counter
+
+    def is_own_event(self, event, *args):
+        return event not in ('verified', 'wallet_updated') or args[0] == self
+
+    async def on_network_update(self, event, *args):
+        self.counter['lnwatcher'] += 1
+
+
+def register(bus, counter):
+    wallet1, wallet2 = object(), object()
+    interests = ['wallet_updated', 'network_updated', 'blockchain_updated', 'new_transaction',
+                 'status', 'verified', 'fee']
+    for wallet in (wallet1, wallet2):
+        window = Window(wallet, counter)
+        bus.register(window.on_network, interests, filter=window.is_event_for_this_window)
+        bus.register(lambda event, *args: counter.update(['wallet']), ['blockchain_updated'])
+    watcher = Watcher(counter)
+    bus.register(watcher.on_network_update,
+                 ['network_updated', 'blockchain_updated', 'verified', 'wallet_updated', 'fee'],
+                 filter=watcher.is_own_event, priority=True)
+    return wallet1
+
+
+async def sync(bus, wallet):
+    for i in range(NUM_TXS):
+        txid = '%064x' % i
+        bus.trigger('new_transaction', wallet, txid)
+        bus.trigger('wallet_updated', wallet)
+        bus.trigger('verified', wallet, txid, (i, 0))
+        bus.trigger('status')
+        if i % TXS_PER_HEADER == 0:
+            bus.trigger('blockchain_updated')
+            bus.trigger('network_updated')
+        if i % TXS_PER_TICK == 0:
+            await asyncio.sleep(0)
+    await asyncio.sleep(0.1)
+
+
+def run(loop, bus_class):
+    counter = Counter()
+    bus = bus_class(loop)
+    wallet = register(bus, counter)
+    t0 = time.monotonic()
+    loop.run_until_complete(sync(bus, wallet))
+    return counter, time.monotonic() - t0
+
+
+if __name__ == '__main__':
+    loop = asyncio.get_event_loop()
+    print(f'{NUM_TXS} transactions')
+    print(f'{"":10s} {"windows":>10s} {"lnwatcher":>10s} {"wallets":>10s} {"total":>10s} {"time":>8s}')
+    for name, bus_class in [('fan-out', FanOut), ('event bus', EventBus)]:
+        counter, t = run(loop, bus_class)
+        print(f'{name:10s} {counter["window"]:10d} {counter["lnwatcher"]:10d} {counter["wallet"]:10d} '
+              f'{sum(counter.values()):10d} {t:7.2f}s')
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# Measures onion construction for a 20 hop route, and the per-HTLC
+# latency of peeling one layer off (process_onion_packet).
+import os
+import time
+
+from electrum import ecc
+from electrum.ecc_fast import is_using_fast_ecc
+from electrum.lnonion import (new_onion_packet, process_onion_packet, OnionHopsDataSingle,
+                              OnionPerHop)
+from electrum.lnutil import NUM_MAX_HOPS_IN_PAYMENT_PATH
+
+
+NUM_RUNS = 200
+
+
+def timeit(f, n=NUM_RUNS):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        f()
+    return (time.perf_counter() - t0) / n * 1000
+
+
+if __name__ == '__main__':
+    num_hops = NUM_MAX_HOPS_IN_PAYMENT_PATH
+    privkeys = [os.urandom(32) for _ in range(num_hops)]
+    pubkeys = [ecc.ECPrivkey(k).get_public_key_bytes() for k in privkeys]
+    hops_data = [OnionHopsDataSingle(OnionPerHop(bytes(8), (1000).to_bytes(8, 'big'), (144).to_bytes(4, 'big')))
+                 for _ in range(num_hops)]
+    session_key = os.urandom(32)
+    associated_data = os.urandom(32)
+    packet = new_onion_packet(pubkeys, session_key, hops_data, associated_data)
+
+    print(f'libsecp256k1: {is_using_fast_ecc()}')
+    print(f'new_onion_packet ({num_hops} hops): {timeit(lambda: new_onion_packet(pubkeys, session_key, hops_data, associated_data), 20):.2f} ms')
+    print(f'process_onion_packet: {timeit(lambda: process_onion_packet(packet, associated_data, privkeys[0])):.3f} ms')
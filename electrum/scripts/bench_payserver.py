@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# Opens many websockets watching payment requests on a local PayServer,
+# then pays every request and measures how long it takes until all the
+# watchers have been told. The watchers run in a separate process, so
+# that each process needs one file descriptor per watcher.
+#
+#   bench_payserver.py [num_watchers] [num_requests]
+import asyncio
+import os
+import resource
+import sys
+import tempfile
+import time
+from multiprocessing import Pipe, Process
+from types import SimpleNamespace
+
+import aiohttp
+
+from electrum.daemon import PayServer
+from electrum.simple_config import SimpleConfig
+from electrum.util import PR_PAID, PR_UNPAID
+
+
+NUM_WATCHERS = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+NUM_REQUESTS = int(sys.argv[2]) if len(sys.argv) > 2 else NUM_WATCHERS // 10
+PORT = 8083
+MAX_CONNECTING = 500
+
+
+class FakeNetwork:
+
+    def __init__(self):
+        self.callbacks = {}
+
+    def register_callback(self, callback, events):
+        for event in events:
+            self.callbacks[event] = callback
+
+    async def trigger_callback(self, event, *args):
+        await self.callbacks[event](event, *args)
+
+
+class FakeWallet:
+
+    def __init__(self, keys):
+        self.requests = {key: {'status': PR_UNPAID} for key in keys}
+
+    def get_request(self, key):
+        return self.requests.get(key)
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    if hard < NUM_WATCHERS + 100:
+        print(f'warning: the open file limit ({hard}) is too low for {NUM_WATCHERS} watchers')
+
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+
+def get_keys():
+    return ['%064x' % i for i in range(NUM_REQUESTS)]
+
+
+async def watch(session, key, connecting, connected, paid_times):
+    async with connecting:
+        ws = await session.ws_connect(f'http://127.0.0.1:{PORT}/api/get_status?{key}')
+    connected.append(ws)
+    async for msg in ws:
+        if msg.data == 'paid':
+            paid_times.append(time.time())
+            break
+    await ws.close()
+
+
+async def run_watchers(conn):
+    keys = get_keys()
+    connecting = asyncio.Semaphore(MAX_CONNECTING)
+    connected, paid_times = [], []
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        t0 = time.monotonic()
+        watchers = [asyncio.ensure_future(watch(session, keys[i % NUM_REQUESTS], connecting, connected, paid_times))
+                    for i in range(NUM_WATCHERS)]
+        while len(connected) < NUM_WATCHERS:
+            failed = [w for w in watchers if w.done() and w.exception()]
+            if failed:
+                conn.send(('failed', repr(failed[0].exception())))
+                for w in watchers:
+                    w.cancel()
+                return
+            await asyncio.sleep(0.05)
+        conn.send(('connected', time.monotonic() - t0))
+        results = await asyncio.gather(*watchers, return_exceptions=True)
+    errors = [r for r in results if isinstance(r, Exception)]
+    conn.send(('done', len(paid_times), max(paid_times, default=0), len(errors)))
+
+
+def watchers_process(conn):
+    raise_fd_limit()
+    loop = asyncio.new_event_loop()  # not the one inherited from the parent
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(run_watchers(conn))
+
+
+async def main():
+    keys = get_keys()
+    config = SimpleConfig({'electrum_path': tempfile.mkdtemp(), 'payserver_port': PORT,
+                           'payserver_host': '127.0.0.1'})
+    network = FakeNetwork()
+    wallet = FakeWallet(keys)
+    daemon = SimpleNamespace(config=config, network=network, wallet=wallet)
+    server = PayServer(daemon)
+    server_task = asyncio.ensure_future(server.run())
+    await asyncio.sleep(0.5)
+    rss_before = rss_mb()
+
+    loop = asyncio.get_event_loop()
+    conn, child_conn = Pipe()
+    process = Process(target=watchers_process, args=(child_conn,))
+    process.start()
+    msg = await loop.run_in_executor(None, conn.recv)
+    if msg[0] == 'failed':
+        print(f'watchers failed to connect: {msg[1]}')
+        process.join()
+        return
+    while server.hub.num_subscribers() < NUM_WATCHERS:
+        await asyncio.sleep(0.05)
+    print(f'{NUM_WATCHERS} watchers on {NUM_REQUESTS} requests connected in {msg[1]:.2f} s')
+    print(f'server memory: {rss_mb() - rss_before:.1f} MB')
+
+    t0 = time.monotonic()
+    await server.hub.send_keepalive()
+    print(f'keepalive round: {(time.monotonic() - t0) * 1000:.1f} ms')
+
+    t0 = time.time()
+    for key in keys:
+        wallet.requests[key]['status'] = PR_PAID
+        await network.trigger_callback('payment_received', wallet, key, PR_PAID)
+    _, num_paid, last_paid, num_errors = await loop.run_in_executor(None, conn.recv)
+    print(f'{num_paid} watchers notified in {(last_paid - t0) * 1000:.1f} ms, {num_errors} errors')
+    print(f'subscribers left: {server.hub.num_subscribers()}')
+    process.join()
+    server_task.cancel()
+
+
+if __name__ == '__main__':
+    raise_fd_limit()
+    asyncio.get_event_loop().run_until_complete(main())
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# Times descendant lookups and conflict removal on long chains of
+# unconfirmed wallet transactions: a CPFP-like chain where each tx spends
+# the previous one, and a batched payout whose outputs are each spent by
+# a child. Both are then replaced by a conflicting tx, which evicts the
+# whole set. The old recursive walk and per-tx removal scanning
+# spent_outpoints are timed for comparison.
+#
+#   bench_tx_chain.py [num_txs]
+import sys
+import time
+
+from electrum.address_synchronizer import AddressSynchronizer
+from electrum.bitcoin import address_to_script
+from electrum.json_db import JsonDB
+from electrum.transaction import Transaction
+
+
+NUM_TXS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+ADDRESS = 'bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4'
+FUNDING_TXID = '11' * 32
+
+
+def make_tx(prevouts, num_outputs=1, value=100000):
+    script = address_to_script(ADDRESS)
+    raw = '02000000' + '%02x' % len(prevouts)
+    for txid, n in prevouts:
+        raw += bytes.fromhex(txid)[::-1].hex() + n.to_bytes(4, 'little').hex() + '00' + 'fdffffff'
+    raw += '%02x' % num_outputs if num_outputs < 0xfd else 'fd' + num_outputs.to_bytes(2, 'little').hex()
+    for i in range(num_outputs):
+        raw += (value - i).to_bytes(8, 'little').hex() + '%02x' % (len(script) // 2) + script
+    raw += '00000000'
+    return Transaction(raw)
+
+
+def make_wallet():
+    adb = AddressSynchronizer(JsonDB({}, manual_upgrades=False))
+    adb.add_address(ADDRESS)
+    return adb
+
+
+def make_chain(num_txs):
+    txs = [make_tx([(FUNDING_TXID, 0)])]
+    for i in range(1, num_txs):
+        txs.append(make_tx([(txs[-1].txid(), 0)], value=100000 - i))
+    return txs
+
+
+def make_payout(num_txs):
+    parent = make_tx([(FUNDING_TXID, 0)], num_outputs=num_txs - 1)
+    return [parent] + [make_tx([(parent.txid(), i)]) for i in range(num_txs - 1)]
+
+
+def old_get_depending_transactions(adb, tx_hash):
+    children = set()
+    for n in adb.db.get_spent_outpoints(tx_hash):
+        other_hash = adb.db.get_spent_outpoint(tx_hash, n)
+        children.add(other_hash)
+        children |= old_get_depending_transactions(adb, other_hash)
+    return children
+
+
+def old_remove_transaction_without_tx(adb, tx_hash):
+    # what remove_transaction did when the tx object was missing
+    adb.db.remove_transaction(tx_hash)
+    for prevout_hash, prevout_n in adb.db.list_spent_outpoints():
+        if adb.db.get_spent_outpoint(prevout_hash, prevout_n) == tx_hash:
+            adb.db.remove_spent_outpoint(prevout_hash, prevout_n)
+    adb._remove_transaction(tx_hash)
+
+
+def timed(f, *args):
+    t0 = time.monotonic()
+    result = f(*args)
+    return result, (time.monotonic() - t0) * 1000
+
+
+def bench(name, txs):
+    adb = make_wallet()
+    _, t_add = timed(lambda: [adb.add_transaction(tx, allow_unrelated=True) for tx in txs])
+    root = txs[0].txid()
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10 * len(txs)))
+    old, t_old = timed(old_get_depending_transactions, adb, root)
+    new, t_new = timed(adb.get_depending_transactions, root)
+    assert old == new and len(new) == len(txs) - 1
+    # the rbf replacement of the root evicts everything
+    replacement = make_tx([(FUNDING_TXID, 0)], value=90000)
+    _, t_rbf = timed(lambda: adb.add_transaction(replacement, allow_unrelated=True))
+    assert adb.db.list_transactions() == [replacement.txid()]
+    # the same eviction, one tx at a time, without the tx objects
+    adb = make_wallet()
+    for tx in txs:
+        adb.add_transaction(tx, allow_unrelated=True)
+    to_remove = [root] + list(new)
+    _, t_old_remove = timed(lambda: [old_remove_transaction_without_tx(adb, h) for h in to_remove])
+    adb = make_wallet()
+    for tx in txs:
+        adb.add_transaction(tx, allow_unrelated=True)
+    for h in to_remove:
+        adb.db.remove_transaction(h)
+    _, t_new_remove = timed(adb.remove_transactions, to_remove)
+    print(f'{name:8s} {len(txs):6d} txs  add {t_add:8.1f} ms  '
+          f'descendants old {t_old:7.1f} ms new {t_new:7.1f} ms  '
+          f'rbf {t_rbf:7.1f} ms  '
+          f'remove without txs old {t_old_remove:8.1f} ms new {t_new_remove:7.1f} ms')
+
+
+if __name__ == '__main__':
+    bench('chain', make_chain(NUM_TXS))
+    bench('payout', make_payout(NUM_TXS))
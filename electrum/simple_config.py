@@ -21,6 +21,7 @@ from .logging import get_logger, Logger
 FEE_ETA_TARGETS = [25, 10, 5, 2]
 FEE_DEPTH_TARGETS = [10000000, 5000000, 2000000, 1000000, 500000, 200000, 100000]
 FEE_LN_ETA_TARGET = 2  # note: make sure the network is asking for estimates for this target
+FEE_ESTIMATES_UPDATE_INTERVAL = 60  # seconds
 
 # satoshi per kbyte
 FEERATE_MAX_DYNAMIC = 1500000
@@ -550,7 +551,7 @@ class SimpleConfig(Logger):
         Returns True if an update should be requested.
         """
         now = time.time()
-        return now - self.last_time_fee_estimates_requested > 60
+        return now - self.last_time_fee_estimates_requested > FEE_ESTIMATES_UPDATE_INTERVAL
 
     def requested_fee_estimates(self):
         self.last_time_fee_estimates_requested = time.time()
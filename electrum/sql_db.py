@@ -9,14 +9,30 @@ from .logging import Logger
 
 
 def sql(func):
-    """wrapper for sql methods"""
+    """wrapper for sql methods
+
+    Every call is a single request to the sql thread, resolved through one
+    future. Methods that take a list of rows (and use executemany) thus let
+    callers batch many writes into one round trip.
+    """
     def wrapper(self, *args, **kwargs):
         assert threading.currentThread() != self.sql_thread
-        f = asyncio.Future()
-        self.db_requests.put((f, func, args, kwargs))
+        loop = asyncio.get_event_loop()
+        f = loop.create_future()
+        self.db_requests.put((loop, f, func, args, kwargs))
         return f
     return wrapper
 
+
+def _set_future_result(future, result, exception):
+    if future.cancelled():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
 class SqlDB(Logger):
     
     def __init__(self, network, path, commit_interval=None):
@@ -31,21 +47,28 @@ class SqlDB(Logger):
     def run_sql(self):
         self.logger.info("SQL thread started")
         self.conn = sqlite3.connect(self.path)
+        # WAL lets readers proceed while we write, and with synchronous=NORMAL
+        # a commit no longer waits for an fsync of the main database file
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA temp_store=MEMORY")
         self.logger.info("Creating database")
         self.create_database()
         i = 0
         while self.network.asyncio_loop.is_running():
             try:
-                future, func, args, kwargs = self.db_requests.get(timeout=0.1)
+                loop, future, func, args, kwargs = self.db_requests.get(timeout=0.1)
             except queue.Empty:
                 continue
+            # futures belong to the caller's loop, and must be resolved
+            # from it, or the caller would only see the result once
+            # something else wakes up that loop
             try:
                 result = func(self, *args, **kwargs)
             except BaseException as e:
-                future.set_exception(e)
+                loop.call_soon_threadsafe(_set_future_result, future, None, e)
                 continue
-            if not future.cancelled():
-                future.set_result(result)
+            loop.call_soon_threadsafe(_set_future_result, future, result, None)
             # note: in sweepstore session.commit() is called inside
             # the sql-decorated methods, so commiting to disk is awaited
             if self.commit_interval:
@@ -54,5 +77,10 @@ class SqlDB(Logger):
                     self.conn.commit()
         # write
         self.conn.commit()
+        self.on_close()
         self.conn.close()
         self.logger.info("SQL thread terminated")
+
+    def on_close(self):
+        # called in the sql thread, after the final commit
+        pass
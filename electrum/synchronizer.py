@@ -31,7 +31,7 @@ import logging
 from aiorpcx import TaskGroup, run_in_thread, RPCError
 
 from .transaction import Transaction
-from .util import bh2u, make_aiohttp_session, NetworkJobOnDefaultServer
+from .util import bh2u, NetworkJobOnDefaultServer
 from .bitcoin import address_to_scripthash, is_address
 from .network import UntrustedServerReturnedError
 from .logging import Logger
@@ -168,6 +168,9 @@ class Synchronizer(SynchronizerBase):
         h = address_to_scripthash(addr)
         self._requests_sent += 1
         result = await self.network.get_history_for_scripthash(h)
+        if history_status([(item['tx_hash'], item['height']) for item in result]) != status:
+            # the status comes from the main server; the one that answered might be behind it
+            result = await self.network.get_history_for_scripthash(h, use_main_interface=True)
         self._requests_answered += 1
         self.logger.info(f"receiving history {addr} {len(result)}")
         hashes = set(map(lambda item: item['tx_hash'], result))
@@ -288,7 +291,7 @@ class Notifier(SynchronizerBase):
         data = {'address': addr, 'status': status}
         for url in self.watched_addresses[addr]:
             try:
-                async with make_aiohttp_session(proxy=self.network.proxy, headers=headers) as session:
+                async with self.network.http_session() as session:
                     async with session.post(url, json=data, headers=headers) as resp:
                         await resp.text()
             except Exception as e:
@@ -217,6 +217,30 @@ class Test_bitcoin(ElectrumTestCase):
         sig2 = eckey2.sign_transaction(bfh('642a2e66332f507c92bda910158dfe46fc10afbf72218764899d3af99a043fac'))
         self.assertEqual(bfh('30440220618513f4cfc87dde798ce5febae7634c23e7b9254a1eabf486be820f6a7c2c4702204fef459393a2b931f949e63ced06888f35e286e446dc46feb24b5b5f81c6ed52'), sig2)
 
+        msg_hash = bfh('642a2e66332f507c92bda910158dfe46fc10afbf72218764899d3af99a043fac')
+        self.assertEqual(eckey2.sign(msg_hash), eckey2.sign(msg_hash, verify=False))
+
+    @needs_test_with_all_ecc_implementations
+    def test_ecdh_and_tweaks(self):
+        # BOLT-08 act one
+        priv = bfh('1212121212121212121212121212121212121212121212121212121212121212')
+        pub = bfh('028d7500dd4c12685d1f568b4c2b5048e8534b873319f3a8daa612b469132ec7f7')
+        ss = bfh('1e2fb3c8fe8fb9f262f649f64d26ecf0f2c0a805a767cf02dc2d77a6ef1fdcc3')
+        self.assertEqual(ss, ecc.ecdh(priv, pub))
+        self.assertEqual(ss, crypto.sha256(ecc.pubkey_tweak_mul(pub, priv)))
+
+        G = ecc.generator()
+        n = G.order()
+        P = ecc.ECPubkey(pub)
+        self.assertEqual(P + 5 * G, P.tweak_add(5))
+        self.assertEqual(P, P.tweak_add(n))
+        self.assertTrue(((n - 1) * G).tweak_add(1).is_at_infinity())
+        self.assertEqual(7 * G, ecc.point_at_infinity().tweak_add(7))
+        self.assertEqual((7 * P).get_public_key_bytes(), ecc.pubkey_tweak_mul(pub, bytes(31) + b'\x07'))
+        self.assertEqual(P, ecc.ECPubkey(P.get_public_key_bytes(compressed=False)))
+        with self.assertRaises(Exception):
+            ecc.ECPubkey(b'\x06' + P.get_public_key_bytes(compressed=False)[1:])
+
     @needs_test_with_all_aes_implementations
     def test_aes_homomorphic(self):
         """Make sure AES is homomorphic."""
@@ -779,6 +803,18 @@ class TestBaseEncode(ElectrumTestCase):
         self.assertEqual(data_bytes,
                          base_decode(data_base58, None, 58))
 
+    def test_base58_leading_zeros_and_chunk_boundaries(self):
+        self.assertEqual('11', base_encode(b'\x00', 58))
+        self.assertEqual('112', base_encode(b'\x00\x00\x01', 58))
+        self.assertEqual(b'\x00\x00\x01', base_decode('112', None, 58))
+        for n in (9, 10, 11, 20, 21):
+            data = b'\x00' + bytes([0xff]) * n
+            self.assertEqual(data, base_decode(base_encode(data, 58), None, 58))
+            self.assertEqual(data, base_decode(base_encode(data, 43), None, 43))
+        self.assertIsNone(base_decode('112', 4, 58))
+        with self.assertRaises(ValueError):
+            base_decode('1O', None, 58)
+
     def test_base58check(self):
         data_hex = '0cd394bef396200774544c58a5be0189f3ceb6a41c8da023b099ce547dd4d8071ed6ed647259fba8c26382edbf5165dfd2404e7a8885d88437db16947a116e451a5d1325e3fd075f9d370120d2ab537af69f32e74fc0ba53aaaa637752964b3ac95cfea7'
         data_bytes = bfh(data_hex)
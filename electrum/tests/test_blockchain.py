@@ -122,6 +122,34 @@ class TestBlockchain(ElectrumTestCase):
         self.assertEqual(8, chain_l.get_height_of_last_common_block_with_chain(chain_z))
         self.assertEqual(8, chain_z.get_height_of_last_common_block_with_chain(chain_l))
 
+    def test_get_header_hashes(self):
+        blockchain.blockchains[constants.net.GENESIS] = chain_u = Blockchain(
+            config=self.config, forkpoint=0, parent=None,
+            forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        open(chain_u.path(), 'w+').close()
+        for name in 'ABCDEFOPQ':
+            self._append_header(chain_u, self.HEADERS[name])
+        chain_l = chain_u.fork(self.HEADERS['G'])
+        for name in 'HIJ':
+            self._append_header(chain_l, self.HEADERS[name])
+
+        hashes = chain_l.get_header_hashes([9, 1, 5, 6, 8, 20, -1])
+        self.assertEqual({1: hash_header(self.HEADERS['B']),
+                          5: hash_header(self.HEADERS['F']),
+                          6: hash_header(self.HEADERS['G']),
+                          8: hash_header(self.HEADERS['I']),
+                          9: hash_header(self.HEADERS['J']),
+                          20: None,
+                          -1: None}, hashes)
+        # heights far apart are read separately
+        blockchain.MAX_HEADER_READ_GAP = 2
+        try:
+            self.assertEqual({height: hash_header(chain_u.read_header(height)) for height in (0, 4, 5, 8)},
+                             chain_u.get_header_hashes([8, 0, 4, 5]))
+        finally:
+            blockchain.MAX_HEADER_READ_GAP = 2016
+        self.assertEqual({}, chain_u.get_header_hashes([]))
+
     def test_parents_after_forking(self):
         blockchain.blockchains[constants.net.GENESIS] = chain_u = Blockchain(
             config=self.config, forkpoint=0, parent=None,
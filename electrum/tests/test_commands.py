@@ -1,9 +1,14 @@
+import asyncio
+import threading
+import time
 import unittest
+from types import SimpleNamespace
 from unittest import mock
 from decimal import Decimal
 
 from electrum.util import create_and_start_event_loop
 from electrum.commands import Commands, eval_bool
+from electrum.daemon import CommandScheduler, CommandTimeout
 from electrum import storage
 from electrum.wallet import restore_wallet_from_text
 from electrum.simple_config import SimpleConfig
@@ -180,3 +185,100 @@ class TestCommandsTestnet(TestCaseForTestnet):
         }
         self.assertEqual("0200000000010139c5375fe9da7bd377c1783002b129f8c57d3e724d62f5eacb9739ca691a229d0100000000feffffff01301b0f0000000000160014ac0e2d229200bffb2167ed6fd196aef9d687d8bb02483045022100fa88a9e7930b2af269fd0a5cb7fbbc3d0a05606f3ac6ea8a40686ebf02fdd85802203dd19603b4ee8fdb81d40185572027686f70ea299c6a3e22bc2545e1396398b20121021f110909ded653828a254515b58498a6bafc96799fb0851554463ed44ca7d9da00000000",
                          cmds._run('serialize', (jsontx,)))
+
+
+class TestCommandScheduler(ElectrumTestCase):
+
+    class FakeWallet:
+        pass
+
+    def setUp(self):
+        super().setUp()
+        self.asyncio_loop, self._stop_loop, self._loop_thread = create_and_start_event_loop()
+        self.config = SimpleConfig({'electrum_path': self.electrum_path, 'rpc_timeout': 2})
+        self.scheduler = CommandScheduler(self.config)
+        self.wallet = self.FakeWallet()
+
+    def tearDown(self):
+        self.scheduler.stop()
+        self.asyncio_loop.call_soon_threadsafe(self._stop_loop.set_result, 1)
+        self._loop_thread.join(timeout=1)
+        super().tearDown()
+
+    def run_commands(self, *calls):
+        async def run(i, cmd, func):
+            await asyncio.sleep(0.01 * i)  # submit in order
+            return await self.scheduler.run(cmd, func, (), {}, wallet=self.wallet)
+        async def gather():
+            return await asyncio.gather(*[run(i, cmd, func) for i, (cmd, func) in enumerate(calls)],
+                                        return_exceptions=True)
+        return asyncio.run_coroutine_threadsafe(gather(), self.asyncio_loop).result(10)
+
+    @staticmethod
+    def command(name, *, blocking=True, modifies_wallet=False):
+        return SimpleNamespace(name=name, blocking=blocking, modifies_wallet=modifies_wallet)
+
+    def test_blocking_command_does_not_block_event_loop(self):
+        ticks = []
+        async def ticker():
+            for i in range(5):
+                ticks.append(i)
+                await asyncio.sleep(0.02)
+        def slow_read():
+            time.sleep(0.3)
+            return threading.current_thread().name
+        results = self.run_commands((self.command('slow_read'), slow_read),
+                                    (self.command('ticker', blocking=False), ticker))
+        self.assertTrue(results[0].startswith('RPC'))
+        self.assertEqual(list(range(5)), ticks)
+
+    def test_readers_run_concurrently_writers_exclusively(self):
+        running = []
+        overlaps = []
+        both_readers_in = threading.Barrier(2, timeout=2)
+        def read():
+            both_readers_in.wait()  # raises if the readers are serialized
+        def write():
+            running.append(1)
+            overlaps.append(len(running))
+            time.sleep(0.05)
+            running.pop()
+        results = self.run_commands((self.command('r1'), read),
+                                    (self.command('r2'), read),
+                                    (self.command('w1', modifies_wallet=True), write),
+                                    (self.command('w2', modifies_wallet=True), write))
+        self.assertEqual([None] * 4, results)
+        self.assertEqual([1, 1], overlaps)
+
+    def test_timeout_keeps_wallet_locked_until_thread_finishes(self):
+        self.scheduler.timeout = 0.1
+        events = []
+        def slow_read():
+            time.sleep(0.3)
+            events.append('read done')
+        async def write():
+            events.append('write')
+        results = self.run_commands((self.command('slow_read'), slow_read),
+                                    (self.command('write', blocking=False, modifies_wallet=True), write))
+        self.assertIsInstance(results[0], CommandTimeout)
+        self.assertIsInstance(results[1], CommandTimeout)
+        self.scheduler.timeout = 2
+        self.run_commands((self.command('write', blocking=False, modifies_wallet=True), write))
+        self.assertEqual(['read done', 'write'], events)
+
+    def test_async_commands_time_out_and_take_the_wallet_lock(self):
+        self.scheduler.timeout = 0.1
+        events = []
+        async def slow_read():
+            try:
+                await asyncio.sleep(1)
+            finally:
+                events.append('read cancelled')
+        async def write():
+            events.append('write')
+        results = self.run_commands((self.command('slow_read', blocking=False), slow_read),
+                                    (self.command('write', blocking=False, modifies_wallet=True), write))
+        self.assertIsInstance(results[0], CommandTimeout)
+        self.assertIsNone(results[1])
+        # the writer waited for the reader, which was cancelled when it timed out
+        self.assertEqual(['read cancelled', 'write'], events)
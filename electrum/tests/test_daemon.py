@@ -0,0 +1,68 @@
+import asyncio
+
+from electrum.daemon import RequestStatusHub
+
+from . import ElectrumTestCase
+
+
+class FakeWebSocket:
+
+    def __init__(self, *, broken=False):
+        self.sent = []
+        self.closed = False
+        self.broken = broken
+
+    async def send_str(self, data):
+        if self.broken:
+            raise ConnectionResetError()
+        self.sent.append(data)
+
+    async def close(self):
+        self.closed = True
+
+
+class TestRequestStatusHub(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        super().tearDown()
+
+    def test_publish_notifies_watchers_of_key_only(self):
+        hub = RequestStatusHub()
+        a1, a2, b = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        hub.subscribe('a', a1)
+        hub.subscribe('a', a2)
+        hub.subscribe('b', b)
+        self.assertEqual(3, hub.num_subscribers())
+        self.loop.run_until_complete(hub.publish('a', 'paid'))
+        self.assertEqual(['paid'], a1.sent)
+        self.assertEqual(['paid'], a2.sent)
+        self.assertTrue(a1.closed and a2.closed)
+        self.assertEqual([], b.sent)
+        self.assertEqual({'b'}, set(hub.subscribers))
+        # publishing to a key nobody watches is a no-op
+        self.loop.run_until_complete(hub.publish('c', 'expired'))
+
+    def test_unsubscribe_removes_empty_keys(self):
+        hub = RequestStatusHub()
+        ws1, ws2 = FakeWebSocket(), FakeWebSocket()
+        hub.subscribe('a', ws1)
+        hub.subscribe('a', ws2)
+        hub.unsubscribe('a', ws1)
+        self.assertEqual({'a': {ws2}}, hub.subscribers)
+        hub.unsubscribe('a', ws2)
+        hub.unsubscribe('a', ws2)
+        self.assertEqual({}, hub.subscribers)
+
+    def test_keepalive_drops_broken_websockets(self):
+        hub = RequestStatusHub()
+        ok, broken = FakeWebSocket(), FakeWebSocket(broken=True)
+        hub.subscribe('a', ok)
+        hub.subscribe('b', broken)
+        self.loop.run_until_complete(hub.send_keepalive())
+        self.assertEqual(['waiting'], ok.sent)
+        self.assertEqual({'a': {ok}}, hub.subscribers)
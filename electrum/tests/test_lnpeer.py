@@ -11,7 +11,7 @@ from electrum.ecc import ECPrivkey
 from electrum import simple_config, lnutil
 from electrum.lnaddr import lnencode, LnAddr, lndecode
 from electrum.bitcoin import COIN, sha256
-from electrum.util import bh2u, create_and_start_event_loop
+from electrum.util import bh2u, create_and_start_event_loop, EventBus
 from electrum.lnpeer import Peer
 from electrum.lnutil import LNPeerAddr, Keypair, privkey_to_pubkey
 from electrum.lnutil import LightningPeerConnectionClosed, RemoteMisbehaving
@@ -19,7 +19,8 @@ from electrum.lnutil import PaymentFailure, LnLocalFeatures
 from electrum.lnchannel import channel_states
 from electrum.lnrouter import LNPathFinder
 from electrum.channel_db import ChannelDB
-from electrum.lnworker import LNWallet, NoPathFound
+from electrum.address_synchronizer import ChangeLog
+from electrum.lnworker import LNWallet, NoPathFound, GossipSyncScheduler
 from electrum.lnmsg import encode_msg, decode_msg
 from electrum.logging import console_stderr_handler
 from electrum.lnworker import PaymentInfo, RECEIVED, PR_UNPAID
@@ -40,21 +41,17 @@ def noop_lock():
 
 class MockNetwork:
     def __init__(self, tx_queue):
-        self.callbacks = defaultdict(list)
         self.lnwatcher = None
         self.interface = None
         user_config = {}
         user_dir = tempfile.mkdtemp(prefix="electrum-lnpeer-test-")
         self.config = simple_config.SimpleConfig(user_config, read_user_dir_function=lambda: user_dir)
         self.asyncio_loop = asyncio.get_event_loop()
+        self.event_bus = EventBus(self.asyncio_loop)
         self.channel_db = ChannelDB(self)
         self.path_finder = LNPathFinder(self.channel_db)
         self.tx_queue = tx_queue
 
-    @property
-    def callback_lock(self):
-        return noop_lock()
-
     register_callback = Network.register_callback
     unregister_callback = Network.unregister_callback
     trigger_callback = Network.trigger_callback
@@ -78,6 +75,7 @@ class MockStorage:
 
 class MockWallet:
     storage = MockStorage()
+    changes = ChangeLog()
     def set_label(self, x, y):
         pass
 
@@ -264,5 +262,75 @@ class TestPeer(ElectrumTestCase):
         with self.assertRaises(PaymentFailure):
             run(f())
 
+
+class MockGossipPeer:
+
+    def __init__(self, pubkey):
+        self.pubkey = pubkey
+
+
+class TestGossipSyncScheduler(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.asyncio_loop, self._stop_loop, self._loop_thread = create_and_start_event_loop()
+
+    def tearDown(self):
+        super().tearDown()
+        self.asyncio_loop.call_soon_threadsafe(self._stop_loop.set_result, 1)
+        self._loop_thread.join(timeout=1)
+
+    def test_batches_are_spread_and_reassigned(self):
+        peer_a, peer_b = MockGossipPeer(b'\x02' + bytes(32)), MockGossipPeer(b'\x03' + bytes(32))
+        async def f():
+            sched = GossipSyncScheduler()
+            ids = [i.to_bytes(8, 'big') for i in range(GossipSyncScheduler.INITIAL_BATCH + 10)]
+            sched.add_ids(ids)
+            batch_a = await sched.get_batch(peer_a)
+            batch_b = await sched.get_batch(peer_b)
+            self.assertEqual(GossipSyncScheduler.INITIAL_BATCH, len(batch_a))
+            self.assertEqual(10, len(batch_b))
+            self.assertEqual(set(ids), set(batch_a) | set(batch_b))
+            self.assertEqual(len(ids), sched.num_unknown_ids())
+            # peer_b answers, then waits for more ids
+            sched.batch_done(peer_b)
+            self.assertEqual(len(batch_a), sched.num_unknown_ids())
+            waiter = asyncio.ensure_future(sched.get_batch(peer_b))
+            await asyncio.sleep(0.01)
+            self.assertFalse(waiter.done())
+            # peer_a goes away: its ids are handed to peer_b
+            sched.peer_lost(peer_a)
+            self.assertEqual(set(batch_a), set(await asyncio.wait_for(waiter, 1)))
+            # peer_b's batch size follows its throughput
+            sched.throughput[peer_b] = 10**6
+            self.assertEqual(GossipSyncScheduler.MAX_BATCH, sched.batch_size(peer_b))
+            sched.throughput[peer_b] = 1
+            self.assertEqual(GossipSyncScheduler.MIN_BATCH, sched.batch_size(peer_b))
+        run(f())
+
+    def test_old_connection_of_a_reconnected_peer_keeps_its_batch(self):
+        old, new = MockGossipPeer(b'\x02' + bytes(32)), MockGossipPeer(b'\x02' + bytes(32))
+        async def f():
+            sched = GossipSyncScheduler()
+            ids = [i.to_bytes(8, 'big') for i in range(10)]
+            sched.add_ids(ids)
+            await sched.get_batch(old)
+            # the peer reconnects before the old connection is closed
+            waiter = asyncio.ensure_future(sched.get_batch(new))
+            await asyncio.sleep(0.01)
+            self.assertFalse(waiter.done())
+            sched.peer_lost(old)
+            self.assertEqual(set(ids), set(await asyncio.wait_for(waiter, 1)))
+            # a late call for the old connection leaves the new one's batch alone
+            sched.batch_done(old)
+            sched.peer_lost(old)
+            self.assertEqual(set(), sched.unknown_ids)
+            self.assertEqual(len(ids), sched.num_unknown_ids())
+            sched.batch_done(new)
+            self.assertEqual(0, sched.num_unknown_ids())
+            self.assertIn(new, sched.throughput)
+        run(f())
+
+
 def run(coro):
     return asyncio.run_coroutine_threadsafe(coro, loop=asyncio.get_event_loop()).result()
@@ -8,6 +8,8 @@ from electrum.lnonion import (OnionHopsDataSingle, new_onion_packet, OnionPerHop
                               process_onion_packet, _decode_onion_error, decode_onion_error,
                               OnionFailureCode)
 from electrum import bitcoin, lnrouter
+from electrum.channel_db import ChannelInfo, Policy, GraphStore, serialize_graph_snapshot, deserialize_graph_snapshot
+from electrum.lnutil import ShortChannelID
 from electrum.constants import BitcoinTestnet
 from electrum.simple_config import SimpleConfig
 
@@ -207,3 +209,93 @@ class Test_LNRouter(TestCaseForTestnet):
         self.assertEqual(4, index_of_sender)
         self.assertEqual(OnionFailureCode.TEMPORARY_NODE_FAILURE, failure_msg.code)
         self.assertEqual(b'', failure_msg.data)
+
+    def test_graph_snapshot_roundtrip(self):
+        node_a = b'\x02' + b'a' * 32
+        node_b = b'\x03' + b'b' * 32
+        scid = ShortChannelID.from_components(600000, 12, 1)
+        channels = [ChannelInfo(short_channel_id=scid, node1_id=node_a, node2_id=node_b, capacity_sat=None)]
+        policies = [
+            Policy(key=scid + node_a, cltv_expiry_delta=144, htlc_minimum_msat=1000, htlc_maximum_msat=None,
+                   fee_base_msat=1000, fee_proportional_millionths=1, channel_flags=0, message_flags=0,
+                   timestamp=1570000000),
+            Policy(key=scid + node_b, cltv_expiry_delta=40, htlc_minimum_msat=1, htlc_maximum_msat=10**10,
+                   fee_base_msat=0, fee_proportional_millionths=250, channel_flags=1, message_flags=1,
+                   timestamp=1570000001),
+        ]
+        data = serialize_graph_snapshot(7, channels, policies)
+        graph_version, channels2, policies2 = deserialize_graph_snapshot(data)
+        self.assertEqual(7, graph_version)
+        self.assertEqual(channels, channels2)
+        self.assertEqual(policies, policies2)
+        self.assertEqual(scid, policies2[1].short_channel_id)
+        self.assertEqual(node_b, policies2[1].start_node)
+        # corruption is detected
+        corrupted = bytearray(data)
+        corrupted[40] ^= 1
+        with self.assertRaises(ValueError):
+            deserialize_graph_snapshot(corrupted)
+        with self.assertRaises(ValueError):
+            deserialize_graph_snapshot(data[:-1])
+        # loaded straight into a GraphStore; policies without channel are reported
+        orphan = policies[0]._replace(key=ShortChannelID.from_components(600000, 13, 0) + node_a)
+        data = serialize_graph_snapshot(8, channels, policies + [orphan])
+        g = GraphStore()
+        self.assertEqual((8, [orphan.key]), g.load_snapshot(data))
+        self.assertEqual((1, 2), (g.num_channels, g.num_policies))
+        self.assertEqual(channels[0], g.get_channel_info(scid))
+        self.assertEqual(policies, sorted(g.policies()))
+        self.assertEqual({scid}, g.get_channels_for_node(node_b))
+        with self.assertRaises(ValueError):
+            GraphStore().load_snapshot(corrupted)
+
+    def test_graph_store(self):
+        node_a = b'\x02' + b'a' * 32
+        node_b = b'\x02' + b'b' * 32
+        node_c = b'\x02' + b'c' * 32
+        scid = lambda i: ShortChannelID.from_components(600000, i, 0)
+        policy = lambda i, node, ts: Policy(
+            key=scid(i) + node, cltv_expiry_delta=144, htlc_minimum_msat=1000, htlc_maximum_msat=None,
+            fee_base_msat=1000, fee_proportional_millionths=i, channel_flags=0, message_flags=0, timestamp=ts)
+        g = GraphStore()
+        self.assertTrue(g.add_channel(ChannelInfo(scid(1), node_a, node_b, None)))
+        self.assertFalse(g.add_channel(ChannelInfo(scid(1), node_a, node_b, None)))
+        self.assertTrue(g.add_channel(ChannelInfo(scid(2), node_b, node_c, 50000)))
+        self.assertEqual(ChannelInfo(scid(2), node_b, node_c, 50000), g.get_channel_info(scid(2)))
+        self.assertEqual({scid(1), scid(2)}, g.get_channels_for_node(node_b))
+        self.assertTrue(g.set_policy(policy(1, node_b, 10)))
+        self.assertFalse(g.set_policy(policy(1, node_c, 10)))  # node_c is not an endpoint
+        self.assertFalse(g.set_policy(policy(3, node_a, 10)))  # unknown channel
+        self.assertEqual(policy(1, node_b, 10), g.get_policy(scid(1), node_b))
+        self.assertIsNone(g.get_policy(scid(1), node_a))
+        self.assertEqual([scid(2)], g.orphaned_channels())
+        self.assertEqual((2, 1), (g.num_channels, g.num_policies))
+        g.compact()
+        self.assertEqual({scid(1), scid(2)}, g.get_channels_for_node(node_b))
+        self.assertEqual(policy(1, node_b, 10), g.get_policy(scid(1), node_b))
+        # removing a channel drops its policies, and its slot gets reused
+        self.assertEqual(ChannelInfo(scid(1), node_a, node_b, None), g.remove_channel(scid(1)))
+        self.assertIsNone(g.get_channel_info(scid(1)))
+        self.assertEqual((1, 0), (g.num_channels, g.num_policies))
+        self.assertTrue(g.add_channel(ChannelInfo(scid(3), node_a, node_c, None)))
+        self.assertEqual({scid(3)}, g.get_channels_for_node(node_a))
+        self.assertEqual({scid(2)}, g.get_channels_for_node(node_b))
+        self.assertEqual({scid(2), scid(3)}, g.get_channels_for_node(node_c))
+        self.assertEqual({scid(2), scid(3)}, set(g.channel_ids()))
+        g.compact()
+        self.assertEqual({scid(3)}, g.get_channels_for_node(node_a))
+        self.assertEqual({scid(2), scid(3)}, g.get_channels_for_node(node_c))
+
+    def test_graph_store_bulk_add(self):
+        node_id = lambda i: b'\x02' + i.to_bytes(32, 'big')
+        channels = [ChannelInfo(ShortChannelID.from_components(600000, i, 0), node_id(i), node_id(i + 1), None)
+                    for i in range(5000)]
+        g = GraphStore()
+        compact = g.compact
+        calls = []
+        g.compact = lambda: calls.append(1) or compact()
+        self.assertEqual(5000, g.add_channels(channels + channels[:10]))
+        self.assertEqual(1, len(calls))
+        self.assertEqual(5000, g.num_channels)
+        self.assertEqual({channels[0].short_channel_id, channels[1].short_channel_id},
+                         g.get_channels_for_node(node_id(1)))
@@ -0,0 +1,227 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+from electrum.address_synchronizer import TX_HEIGHT_UNCONFIRMED
+from electrum.lnwatcher import LNWatcher, SweepStore
+from electrum.simple_config import SimpleConfig
+from electrum.transaction import Transaction
+from electrum.util import TxMinedInfo
+
+from . import ElectrumTestCase
+
+
+RAW_TX = '01000000012a5c9a94fcde98f5581cd00162c60a13936ceb75389ea65bf38633b424eb4031000000006c493046022100a82bbc57a0136751e5433f41cf000b3f1a99c6744775e76ec764fb78c54ee100022100f9e80b7de89de861dc6fb0c1429d5da72c2b6b2ee2406bc9bfb1beedd729d985012102e61d176da16edd1d258a200ad9759ef63adf8e14cd97f53227bae35cdb84d2f6ffffffff0140420f00000000001976a914230ac37834073a42146f11ef8414ae929feaafc388ac00000000'
+
+
+class MockTx:
+
+    def __init__(self, addresses):
+        self._outputs = [SimpleNamespace(address=addr) for addr in addresses]
+
+    def outputs(self):
+        return self._outputs
+
+
+class MockSynchronizer:
+
+    def add(self, address):
+        pass
+
+
+class MockNetwork:
+
+    def __init__(self):
+        self.config = SimpleConfig({'electrum_path': tempfile.mkdtemp(prefix="test_lnwatcher")})
+        self.height = 100
+        self.triggered = []
+
+    def register_callback(self, callback, events, *, filter=None, priority=False):
+        pass
+
+    def trigger_callback(self, event, *args):
+        self.triggered.append((event, args[0]))
+
+    def notify(self, event):
+        pass
+
+    def get_local_height(self):
+        return self.height
+
+
+class TestLNWatcherDirtySet(ElectrumTestCase):
+    """The watcher should only rebuild the spend trees of the channels
+    whose transactions or addresses changed."""
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+        self.network = MockNetwork()
+        self.watcher = LNWatcher(self.network)
+        self.watcher.synchronizer = MockSynchronizer()
+        # spending graph: outpoint -> txid, txid -> tx, txid -> height
+        self.spent = {}
+        self.txs = {}
+        self.heights = {}
+        self.watcher.db.get_spent_outpoint = lambda txid, n: self.spent.get('%s:%d' % (txid, n))
+        self.watcher.db.get_transaction = lambda txid: self.txs.get(txid)
+        self.watcher.get_tx_height = self.get_tx_height
+        self.built = []
+        build = self.watcher._build_spend_tree
+        def build_spend_tree(tree, outpoint, n):
+            if n == 0:
+                self.built.append(outpoint)
+            build(tree, outpoint, n)
+        self.watcher._build_spend_tree = build_spend_tree
+        self.watcher.add_channel('a' * 64 + ':0', 'addr_a')
+        self.watcher.add_channel('b' * 64 + ':0', 'addr_b')
+
+    def tearDown(self):
+        self.loop.close()
+        super().tearDown()
+
+    def get_tx_height(self, txid):
+        height = self.heights.get(txid, TX_HEIGHT_UNCONFIRMED)
+        conf = max(0, self.network.height - height + 1) if height > 0 else 0
+        return TxMinedInfo(height=height, conf=conf)
+
+    def update(self, event='network_updated'):
+        self.built.clear()
+        self.network.triggered.clear()
+        self.watcher.up_to_date = True
+        self.loop.run_until_complete(self.watcher.on_network_update(event))
+
+    def spend(self, outpoint, txid, height, address='addr_sweep'):
+        self.spent[outpoint] = txid
+        self.txs[txid] = MockTx([address])
+        self.heights[txid] = height
+        self.watcher.add_address(address)
+        self.watcher.changes.add(txid, outpoint.split(':')[0])
+
+    def test_only_dirty_channels_are_rebuilt(self):
+        self.update()
+        self.assertEqual({'a' * 64 + ':0', 'b' * 64 + ':0'}, set(self.built))
+        self.update()
+        self.assertEqual([], self.built)
+        self.assertEqual([], self.network.triggered)
+        self.spend('b' * 64 + ':0', 'c' * 64, 99)
+        self.update()
+        self.assertEqual(['b' * 64 + ':0'], self.built)
+        self.assertEqual([('update_closed_channel', 'b' * 64 + ':0')], self.network.triggered)
+        self.assertEqual('closed (2)', self.watcher.get_channel_status('b' * 64 + ':0'))
+        self.assertEqual('open', self.watcher.get_channel_status('a' * 64 + ':0'))
+
+    def test_new_block_notifies_without_rebuilding(self):
+        self.update()
+        self.network.height += 1
+        self.update('blockchain_updated')
+        self.assertEqual([], self.built)
+        self.assertEqual({('update_open_channel', 'a' * 64 + ':0'), ('update_open_channel', 'b' * 64 + ':0')},
+                         set(self.network.triggered))
+        self.update('fee')
+        self.assertEqual(2, len(self.network.triggered))
+
+    def test_deep_channels_are_left_alone(self):
+        # the outputs we inspect are all spent, and deeply mined
+        self.spend('a' * 64 + ':0', 'c' * 64, 1)
+        self.spend('c' * 64 + ':0', 'd' * 64, 1)
+        self.spend('d' * 64 + ':0', 'e' * 64, 1)
+        self.network.height = 200
+        self.update()
+        self.assertEqual('closed (deep)', self.watcher.get_channel_status('a' * 64 + ':0'))
+        self.assertTrue(self.watcher.spend_trees['a' * 64 + ':0'].done)
+        self.network.height += 1
+        self.update('blockchain_updated')
+        self.assertEqual([('update_open_channel', 'b' * 64 + ':0')], self.network.triggered)
+        # a reorg that changes the closing tx makes us look again
+        self.watcher.changes.add('c' * 64)
+        self.update()
+        self.assertEqual(['a' * 64 + ':0'], self.built)
+
+
+class TestSweepStore(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.asyncio_loop = asyncio.new_event_loop()
+        self.start_loop()
+        self.network = SimpleNamespace(asyncio_loop=self.asyncio_loop)
+        self.path = os.path.join(self.electrum_path, 'watchtower_db')
+
+    def start_loop(self):
+        self._loop_thread = threading.Thread(target=self.asyncio_loop.run_forever)
+        self._loop_thread.start()
+        # the sql thread stops as soon as it finds the loop not running
+        while not self.asyncio_loop.is_running():
+            time.sleep(0.001)
+
+    def tearDown(self):
+        self.asyncio_loop.call_soon_threadsafe(self.asyncio_loop.stop)
+        self._loop_thread.join(timeout=1)
+        self.asyncio_loop.close()
+        super().tearDown()
+
+    def run_sql(self, method, *args):
+        async def f():
+            return await method(*args)
+        return asyncio.run_coroutine_threadsafe(f(), self.asyncio_loop).result(timeout=5)
+
+    def close(self, store):
+        self.asyncio_loop.call_soon_threadsafe(self.asyncio_loop.stop)
+        store.sql_thread.join(timeout=5)
+        self._loop_thread.join(timeout=1)
+        self.start_loop()
+
+    def test_batched_writes_and_index(self):
+        store = SweepStore(self.path, self.network)
+        ctns = self.run_sql(store.get_ctns, [('f1:0', 'addr1'), ('f2:0', 'addr2')])
+        self.assertEqual({'f1:0': 0, 'f2:0': 0}, ctns)
+        self.assertEqual(0, store.get_known_ctn('f1:0'))
+        self.assertIsNone(store.get_known_ctn('f3:0'))
+        tx = Transaction(RAW_TX)
+        rows = [('f1:0', 1, 'c1:0', tx.serialize()),
+                ('f1:0', 1, 'c1:1', tx.serialize()),
+                ('f1:0', 2, 'c2:0', tx),
+                ('f2:0', 5, 'c3:0', tx.serialize())]
+        self.run_sql(store.add_sweep_txs, rows)
+        self.assertEqual({'f1:0', 'f2:0'}, store.list_sweep_tx())
+        self.assertEqual(3, store.get_num_tx('f1:0'))
+        self.assertTrue(store.has_sweep_tx('f1:0', 'c1:1'))
+        self.assertFalse(store.has_sweep_tx('f1:0', 'f1:0'))
+        self.assertEqual({'f1:0': 2, 'f2:0': 5}, self.run_sql(store.get_ctns, [('f1:0', 'addr1'), ('f2:0', 'addr2')]))
+        txs = self.run_sql(store.get_sweep_txs, 'f1:0', ['c1:0', 'c2:0', 'c9:0'])
+        self.assertEqual({'c1:0', 'c2:0'}, set(txs))
+        self.assertEqual(tx.txid(), txs['c2:0'][0].txid())
+        self.run_sql(store.remove_sweep_tx, 'f2:0')
+        self.assertFalse(store.has_sweep_tx('f2:0', 'c3:0'))
+        self.assertEqual(0, store.get_known_ctn('f2:0'))
+        # the index is rebuilt from the database
+        self.close(store)
+        store = SweepStore(self.path, self.network)
+        self.assertEqual(2, self.run_sql(store.get_ctn, 'f1:0', 'addr1'))
+        self.assertEqual(3, store.get_num_tx('f1:0'))
+        self.assertEqual([('f1:0', 'addr1'), ('f2:0', 'addr2')], sorted(self.run_sql(store.list_channels)))
+        self.close(store)
+
+    def test_index_is_loaded_before_it_answers(self):
+        store = SweepStore(self.path, self.network)
+        tx = Transaction(RAW_TX)
+        self.run_sql(store.get_ctns, [('f1:0', 'addr1')])
+        self.run_sql(store.add_sweep_txs, [('f1:0', 1, 'c1:0', tx), ('f1:0', 1, 'c1:1', tx)])
+        self.close(store)
+        load_index = SweepStore._load_index
+        def slow_load_index(store):
+            time.sleep(0.2)
+            load_index(store)
+        with mock.patch.object(SweepStore, '_load_index', slow_load_index):
+            store = SweepStore(self.path, self.network)
+            self.assertEqual(2, store.get_num_tx('f1:0'))
+        self.assertEqual({'f1:0'}, store.list_sweep_tx())
+        self.assertEqual(1, store.get_known_ctn('f1:0'))
+        txs = self.run_sql(store.get_sweep_txs, 'f1:0', ['c1:1'])
+        self.assertEqual(['c1:1'], list(txs))
+        self.close(store)
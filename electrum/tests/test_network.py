@@ -1,13 +1,19 @@
 import asyncio
+import queue
 import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
 
 from electrum import constants
 from electrum.simple_config import SimpleConfig
 from electrum import blockchain
-from electrum.interface import Interface
+from electrum.interface import Interface, RequestTimedOut
+from electrum.network import Network, ServerStats, SERVER_RETRY_INTERVAL
 from electrum.crypto import sha256
 from electrum.util import bh2u
+from electrum.logging import Logger
 
 from . import ElectrumTestCase
 
@@ -117,6 +123,359 @@ class TestNetwork(ElectrumTestCase):
         self.assertEqual(self.interface.q.qsize(), 0)
 
 
+class TestServerStats(ElectrumTestCase):
+
+    def test_percentile_needs_samples(self):
+        stats = ServerStats()
+        for i in range(ServerStats.MIN_SAMPLES_FOR_PERCENTILE - 1):
+            stats.add_rtt(0.1)
+        self.assertIsNone(stats.percentile(95))
+        for i in range(20):
+            stats.add_rtt(0.1)
+        stats.add_rtt(2.0)
+        self.assertEqual(0.1, stats.percentile(50))
+        self.assertEqual(2.0, stats.percentile(99))
+
+    def test_errors_make_server_unhealthy_then_decay(self):
+        stats = ServerStats()
+        self.assertEqual(0, stats.score())
+        stats.add_rtt(0.2)
+        self.assertAlmostEqual(0.2, stats.score())
+        for i in range(3):
+            stats.add_error()
+        self.assertFalse(stats.is_healthy())
+        self.assertGreater(stats.score(), 0.2)
+        for i in range(5):
+            stats.add_rtt(0.2)
+        self.assertTrue(stats.is_healthy())
+
+
+class MockSession:
+
+    def __init__(self, server):
+        self.server = server
+        self.delay = 0
+        self.error = None
+        self.num_requests = 0
+
+    async def send_request(self, method, params, timeout=None):
+        self.num_requests += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.server
+
+
+class MockReadInterface:
+
+    def __init__(self, loop, server, chain, tip):
+        self.server = server
+        self.session = MockSession(server)
+        self.ready = loop.create_future()
+        self.ready.set_result(1)
+        self.got_disconnected = loop.create_future()
+        self.blockchain = chain
+        self.tip = tip
+
+
+class MockReadNetwork(Logger):
+
+    def __init__(self, interfaces):
+        Logger.__init__(self)
+        self.interfaces = {iface.server: iface for iface in interfaces}
+        self.interface = interfaces[0]
+        self.interfaces_lock = threading.Lock()
+        self.server_stats = {}
+
+    get_server_stats = Network.get_server_stats
+    _get_read_interfaces = Network._get_read_interfaces
+    _send_timed_request = Network._send_timed_request
+    _send_read_request = Network._send_read_request
+
+
+class TestReadRequestRouting(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+        chain = object()
+        self.main, self.fast, self.behind = [MockReadInterface(self.loop, server, chain, tip)
+                                             for server, tip in [('main', 100), ('fast', 100), ('behind', 99)]]
+        self.network = MockReadNetwork([self.main, self.fast, self.behind])
+        self.set_rtt(self.main, 0.05)
+        self.set_rtt(self.fast, 0.01)
+        self.set_rtt(self.behind, 0.001)
+
+    def tearDown(self):
+        self.loop.close()
+        super().tearDown()
+
+    def set_rtt(self, iface, rtt):
+        stats = self.network.get_server_stats(iface.server)
+        for i in range(10):
+            stats.add_rtt(rtt)
+
+    def send(self, validate=None):
+        return self.loop.run_until_complete(
+            self.network._send_read_request('blockchain.transaction.get', ['00'], validate=validate))
+
+    def test_fastest_interface_on_the_main_chain_answers(self):
+        self.assertEqual([self.fast, self.main], self.network._get_read_interfaces())
+        self.assertEqual('fast', self.send())
+        self.assertEqual(0, self.main.session.num_requests)
+
+    def test_request_is_hedged_when_p95_is_exceeded(self):
+        self.fast.session.delay = 10
+        t0 = time.monotonic()
+        self.assertEqual('main', self.send())
+        self.assertLess(time.monotonic() - t0, 1)
+        self.assertEqual(1, self.fast.session.num_requests)
+
+    def test_failing_interface_is_hedged_then_skipped(self):
+        self.fast.session.error = RequestTimedOut()
+        for i in range(3):
+            self.assertEqual('main', self.send())
+        self.assertFalse(self.network.get_server_stats('fast').is_healthy())
+        self.assertEqual([self.main], self.network._get_read_interfaces())
+        self.assertEqual('main', self.send())
+        self.assertEqual(3, self.fast.session.num_requests)
+
+    def test_unhealthy_interface_recovers_with_time(self):
+        self.fast.session.error = RequestTimedOut()
+        for i in range(3):
+            self.send()
+        self.assertEqual([self.main], self.network._get_read_interfaces())
+        self.fast.session.error = None
+        later = time.monotonic() + 2 * ServerStats.ERROR_HALF_LIFE
+        with mock.patch('time.monotonic', return_value=later):
+            self.assertEqual([self.fast, self.main], self.network._get_read_interfaces())
+
+    def test_error_of_the_main_interface_is_raised(self):
+        self.fast.session.error = RequestTimedOut()
+        self.main.session.error = ValueError()
+        with self.assertRaises(ValueError):
+            self.send()
+
+    def test_invalid_answer_is_an_error_of_the_interface_that_sent_it(self):
+        def validate(result):
+            if result != 'main':
+                raise ValueError(result)
+        for i in range(3):
+            self.assertEqual('main', self.send(validate))
+        self.assertFalse(self.network.get_server_stats('fast').is_healthy())
+        self.assertTrue(self.network.get_server_stats('main').is_healthy())
+        self.assertEqual([self.main], self.network._get_read_interfaces())
+
+    def test_answer_of_the_main_interface_is_not_validated(self):
+        del self.network.server_stats['main']  # main has no samples yet, so it comes first
+        def validate(result):
+            raise ValueError(result)
+        self.assertEqual('main', self.send(validate))
+        self.assertEqual(0, self.fast.session.num_requests)
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000000.0
+
+    def time(self):
+        return self.now
+
+
+class MockTaskGroupWithSpawn:
+    _closed = False
+
+    async def spawn(self, coro, *args):
+        if args:
+            coro = coro(*args)
+        return asyncio.ensure_future(coro)
+
+
+class MockSessionInterface:
+
+    def __init__(self, network, server):
+        self.network = network
+        self.server = server
+        self.ready = asyncio.Future()
+        self.ready.set_result(1)
+        self.group = MockTaskGroupWithSpawn()
+
+    def is_main_server(self):
+        return self.network.interface is self
+
+    def bucket_based_on_ipaddress(self):
+        return ''
+
+    async def close(self):
+        pass
+
+
+class MockSessionsNetwork:
+    """A network whose interfaces connect instantly, unless their server
+    is down, and whose _maintain_sessions runs on a fake clock.
+    """
+
+    def __init__(self, config, clock, *, auto_connect, num_servers=5, num_server=3):
+        self.config = config
+        self.clock = clock
+        self.auto_connect = auto_connect
+        self.num_server = num_server
+        self.protocol = 's'
+        self.servers = {f'server{i}.test': {'s': '50002'} for i in range(num_servers)}
+        self.default_server = 'server0.test:50002:s'
+        self.interface = None
+        self.interfaces = {}
+        self.interfaces_lock = threading.Lock()
+        self.connecting = set()
+        self.disconnected_servers = set()
+        self.down = set()
+        self.server_retry_time = self.nodes_retry_time = clock.time()
+        self.connection_status = 'disconnected'
+        self.main_taskgroup = MockTaskGroupWithSpawn()
+        self.asyncio_loop = asyncio.get_event_loop()
+        self.logger = mock.Mock()
+        self.switches = []  # (time, server)
+        self.num_fee_requests = 0
+        self.num_iterations = 0
+        self.num_timer_wakeups = 0
+        self.scheduled = []  # (time, coroutine function)
+
+    _maintain_sessions = Network._maintain_sessions
+    trigger_session_maintenance = Network.trigger_session_maintenance
+    _get_time_until_session_maintenance = Network._get_time_until_session_maintenance
+    _start_interface = Network._start_interface
+    _start_random_interface = Network._start_random_interface
+    _ensure_there_is_a_main_interface = Network._ensure_there_is_a_main_interface
+    _switch_to_random_interface = Network._switch_to_random_interface
+    check_interface_against_healthy_spread_of_connected_servers = \
+        Network.check_interface_against_healthy_spread_of_connected_servers
+    _close_interface = Network._close_interface
+    connection_down = Network.connection_down
+    get_interfaces = Network.get_interfaces
+    is_connected = Network.is_connected
+    is_connecting = Network.is_connecting
+
+    def get_servers(self):
+        return self.servers
+
+    def trigger_callback(self, *args):
+        pass
+
+    def _set_status(self, status):
+        self.connection_status = status
+
+    async def _request_fee_estimates(self, interface):
+        self.config.requested_fee_estimates()
+        self.num_fee_requests += 1
+
+    async def _run_new_interface(self, server):
+        await asyncio.sleep(0)
+        self.connecting.discard(server)
+        if server in self.down:
+            await self.connection_down(MockSessionInterface(self, server))
+        else:
+            self.interfaces[server] = MockSessionInterface(self, server)
+            if server == self.default_server:
+                await self.switch_to_interface(server)
+        self.trigger_session_maintenance()
+
+    async def switch_to_interface(self, server):
+        self.default_server = server
+        if server not in self.interfaces:
+            self.interface = None
+            self._start_interface(server)
+            return
+        if self.interface is not self.interfaces[server]:
+            self.interface = self.interfaces[server]
+            self.connection_status = 'connected'
+            self.switches.append((self.clock.time(), server))
+
+    async def _wait_for_session_maintenance(self, timeout):
+        self.num_iterations += 1
+        for i in range(10):  # let the spawned tasks run
+            await asyncio.sleep(0)
+        if self._session_maintenance_trigger.is_set():
+            return
+        self.scheduled.sort(key=lambda x: x[0])
+        deadline = self.end_time if timeout is None else min(self.end_time, self.clock.time() + timeout)
+        if self.scheduled and self.scheduled[0][0] <= deadline:
+            self.clock.now, action = self.scheduled.pop(0)
+            await action()
+            return
+        if timeout is None or deadline >= self.end_time:
+            raise asyncio.CancelledError()
+        self.clock.now = deadline
+        self.num_timer_wakeups += 1
+
+    def run(self, duration):
+        self.end_time = self.clock.time() + duration
+        self._session_maintenance_trigger = asyncio.Event()
+        self.server_queue = queue.Queue()
+        self._start_interface(self.default_server)
+        try:
+            self.asyncio_loop.run_until_complete(self._maintain_sessions())
+        except asyncio.CancelledError:
+            pass
+        self.clock.now = self.end_time
+
+
+class TestSessionMaintenance(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.clock = FakeClock()
+        patcher = mock.patch('time.time', self.clock.time)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.config = SimpleConfig({'electrum_path': self.electrum_path})
+
+    def schedule_server_down(self, network, at, server, *, up_at=None):
+        async def go_down():
+            network.down.add(server)
+            await network.connection_down(network.interfaces[server])
+        async def go_up():
+            network.down.discard(server)
+        network.scheduled.append((self.clock.time() + at, go_down))
+        if up_at is not None:
+            network.scheduled.append((self.clock.time() + up_at, go_up))
+
+    def test_idle_network_only_wakes_up_for_fee_estimates(self):
+        network = MockSessionsNetwork(self.config, self.clock, auto_connect=True)
+        network.run(3600)
+        self.assertEqual([(1000000.0, 'server0.test:50002:s')], network.switches)
+        self.assertEqual(3, len(network.interfaces))
+        # fee estimates are still refreshed every minute
+        self.assertEqual(60, network.num_fee_requests)
+        # and nothing else wakes the loop up; the old one woke up 36000 times in an hour
+        self.assertEqual(59, network.num_timer_wakeups)
+        self.assertLess(network.num_iterations, 70)
+
+    def test_switches_to_other_server_when_main_goes_down(self):
+        network = MockSessionsNetwork(self.config, self.clock, auto_connect=True)
+        t0 = self.clock.time()
+        self.schedule_server_down(network, 100, 'server0.test:50002:s')
+        network.run(600)
+        self.assertEqual(2, len(network.switches))
+        t, server = network.switches[1]
+        self.assertEqual(t0 + 100, t)
+        self.assertNotEqual('server0.test:50002:s', server)
+        # the lost connection was replaced
+        self.assertEqual(3, len(network.interfaces))
+        self.assertLess(network.num_iterations, 30)
+
+    def test_retries_main_server_without_auto_connect(self):
+        network = MockSessionsNetwork(self.config, self.clock, auto_connect=False)
+        t0 = self.clock.time()
+        self.schedule_server_down(network, 100, 'server0.test:50002:s', up_at=125)
+        network.run(600)
+        self.assertEqual(2, len(network.switches))
+        t, server = network.switches[1]
+        self.assertEqual('server0.test:50002:s', server)
+        self.assertLessEqual(t, t0 + 125 + SERVER_RETRY_INTERVAL + 1)
+        self.assertLess(network.num_iterations, 40)
+
+
 if __name__=="__main__":
     constants.set_regtest()
     unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+from decimal import Decimal
+
+from electrum.util import OrderedDictWithIndex, Satoshis
+
+from . import ElectrumTestCase
+
+try:
+    from PyQt5.QtCore import QObject
+except ImportError:
+    QObject = None
+
+
+UNCONFIRMED = (1e9, -1)
+
+
+class MockWallet:
+
+    def __init__(self):
+        self.txpos = {}
+
+    def get_txpos(self, txid):
+        return self.txpos[txid]
+
+
+def tx_item(txid, value):
+    return {'txid': txid, 'value': Satoshis(Decimal(value))}
+
+
+@unittest.skipIf(QObject is None, 'PyQt5 is not installed')
+class TestHistoryModelUpdateRows(ElectrumTestCase):
+
+    def create_model(self, rows):
+        from electrum.gui.qt.history_list import HistoryModel
+        window = QObject()
+        window.wallet = MockWallet()
+        model = HistoryModel(window)
+        transactions = OrderedDictWithIndex()
+        for txid, value, txpos in rows:
+            transactions[txid] = tx_item(txid, value)
+            window.wallet.txpos[txid] = txpos
+        model._txpos = dict(window.wallet.txpos)
+        model.apply_history_diff(transactions)
+        return model
+
+    def get_rows(self, model):
+        return [(txid, model.get_balance(row)) for row, txid in enumerate(model.transactions)]
+
+    def test_one_batch_moves_several_rows(self):
+        rows = [('c0', 1, (1, 0)),
+                ('u0', 2, UNCONFIRMED),
+                ('u1', 4, UNCONFIRMED),
+                ('u2', 8, UNCONFIRMED),
+                ('u3', 16, UNCONFIRMED)]
+        # block 2 mines u1 and u2; u0 stays unconfirmed between them
+        batch = [('u1', tx_item('u1', 4), (2, 0)),
+                 ('u2', tx_item('u2', 8), (2, 1))]
+        for tx_items in (batch, batch[::-1]):
+            model = self.create_model(rows)
+            model.parent.wallet.txpos.update({'u1': (2, 0), 'u2': (2, 1)})
+            model.update_rows(tx_items)
+            self.assertEqual([('c0', 1), ('u1', 5), ('u2', 13), ('u0', 15), ('u3', 31)], self.get_rows(model))
+            self.assertEqual(5, model._num_onchain_rows)
+
+    def test_update_in_place_and_remove(self):
+        model = self.create_model([('c0', 1, (1, 0)),
+                                   ('c1', 2, (1, 1)),
+                                   ('u0', 4, UNCONFIRMED)])
+        del model.parent.wallet.txpos['c0']
+        model.update_rows([('c1', tx_item('c1', 3), (1, 1)),
+                           ('c0', None, None)])
+        self.assertEqual([('c1', 3), ('u0', 7)], self.get_rows(model))
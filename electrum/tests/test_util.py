@@ -1,7 +1,11 @@
+import asyncio
 from decimal import Decimal
 
+from aiohttp import web
+
 from electrum.util import (format_satoshis, format_fee_satoshis, parse_URI,
-                           is_hash256_str, chunks, is_ip_address, list_enabled_bits)
+                           is_hash256_str, chunks, is_ip_address, list_enabled_bits,
+                           EventBus, HttpSessionPool, make_aiohttp_session, OrderedDictWithIndex)
 
 from . import ElectrumTestCase
 
@@ -129,3 +133,162 @@ class TestUtil(ElectrumTestCase):
         self.assertFalse(is_ip_address("2001:db8:0:0:g:ff00:42:8329"))
         self.assertFalse(is_ip_address("lol"))
         self.assertFalse(is_ip_address(":@ASD:@AS\x77\x22\xff¬!"))
+
+    def test_ordered_dict_with_index_insert_and_delete(self):
+        d = OrderedDictWithIndex()
+        for key in 'abcd':
+            d[key] = key.upper()
+        d.insert(1, 'x', 'X')
+        d.insert(5, 'y', 'Y')
+        del d['c']
+        del d['a']
+        self.assertEqual(['x', 'b', 'd', 'y'], list(d.keys()))
+        for pos, key in enumerate(d):
+            self.assertEqual(pos, d.pos_from_key(key))
+            self.assertEqual(key.upper(), d.value_from_pos(pos))
+        with self.assertRaises(KeyError):
+            d.value_from_pos(4)
+
+
+class TestEventBus(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+        self.bus = EventBus(self.loop)
+        self.calls = []
+
+    def tearDown(self):
+        self.loop.close()
+        super().tearDown()
+
+    def callback(self, event, *args):
+        self.calls.append((event,) + args)
+
+    def run_loop(self):
+        self.loop.call_later(0.01, self.loop.stop)
+        self.loop.run_forever()
+
+    def test_idempotent_events_are_coalesced_per_subject(self):
+        self.bus.register(self.callback, ['wallet_updated', 'verified', 'network_updated'])
+        wallet1, wallet2 = object(), object()
+        for i in range(3):
+            self.bus.trigger('network_updated')
+            self.bus.trigger('wallet_updated', wallet1)
+            self.bus.trigger('wallet_updated', wallet2)
+            self.bus.trigger('verified', wallet1, 'txid1', i)
+        self.bus.trigger('verified', wallet1, 'txid2', 0)
+        self.assertEqual([], self.calls)
+        self.run_loop()
+        self.assertEqual([('network_updated',),
+                          ('wallet_updated', wallet1),
+                          ('wallet_updated', wallet2),
+                          ('verified', wallet1, 'txid1', 2),
+                          ('verified', wallet1, 'txid2', 0)], self.calls)
+        # the next tick starts afresh
+        self.bus.trigger('network_updated')
+        self.run_loop()
+        self.assertEqual(('network_updated',), self.calls[-1])
+        self.assertEqual(6, len(self.calls))
+
+    def test_other_events_are_not_coalesced(self):
+        self.bus.register(self.callback, ['request_status'])
+        self.bus.trigger('request_status', 'key', 0)
+        self.bus.trigger('request_status', 'key', 3)
+        self.run_loop()
+        self.assertEqual([('request_status', 'key', 0), ('request_status', 'key', 3)], self.calls)
+
+    def test_filter_and_priority(self):
+        wallet1, wallet2 = object(), object()
+        self.bus.register(self.callback, ['wallet_updated', 'fee'])
+        calls = []
+        self.bus.register(lambda event, *args: calls.append(event) or self.calls.append('lightning'),
+                          ['wallet_updated', 'fee'], priority=True,
+                          filter=lambda event, *args: event != 'wallet_updated' or args[0] is wallet1)
+        self.bus.trigger('wallet_updated', wallet1)
+        self.bus.trigger('wallet_updated', wallet2)
+        self.bus.trigger('fee', 10)
+        self.run_loop()
+        self.assertEqual(['wallet_updated', 'fee'], calls)
+        self.assertEqual(['lightning', 'lightning',
+                          ('wallet_updated', wallet1), ('wallet_updated', wallet2), ('fee', 10)], self.calls)
+
+    def test_coroutine_callbacks_and_unregister(self):
+        async def on_event(event, *args):
+            self.calls.append(event)
+        self.bus.register(on_event, ['fee'])
+        self.bus.register(self.callback, ['fee'])
+        self.bus.trigger('fee', 10)
+        self.run_loop()
+        self.assertEqual(2, len(self.calls))
+        self.bus.unregister(on_event)
+        self.bus.unregister(self.callback)
+        self.bus.trigger('fee', 10)
+        self.run_loop()
+        self.assertEqual(2, len(self.calls))
+
+
+class TestHttpSessionPool(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+        self.connections = set()
+        self.runner = None
+        self.url = self.loop.run_until_complete(self.start_server())
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.runner.cleanup())
+        self.loop.close()
+        super().tearDown()
+
+    async def start_server(self):
+        async def handle(request):
+            self.connections.add(request.transport.get_extra_info('peername'))
+            return web.Response(text='ok')
+        app = web.Application()
+        app.router.add_get('/', handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f'http://127.0.0.1:{port}/'
+
+    async def get(self, session):
+        async with session.get(self.url) as resp:
+            return await resp.text()
+
+    def test_connections_are_reused(self):
+        pool = HttpSessionPool(limit_per_host=4)
+        async def run():
+            for i in range(2):
+                results = await asyncio.gather(*[self.get(pool.get_session(None)) for i in range(500)])
+                self.assertEqual(['ok'] * 500, results)
+            await pool.close()
+        self.loop.run_until_complete(run())
+        # 1000 requests, at most limit_per_host handshakes
+        self.assertLessEqual(len(self.connections), 4)
+
+    def test_one_session_per_request_connects_every_time(self):
+        async def run():
+            for i in range(50):
+                async with make_aiohttp_session(None) as session:
+                    await self.get(session)
+        self.loop.run_until_complete(run())
+        self.assertEqual(50, len(self.connections))
+
+    def test_session_is_rebuilt_when_proxy_changes(self):
+        pool = HttpSessionPool()
+        proxy = {'mode': 'socks5', 'host': '127.0.0.1', 'port': '9050'}
+        async def run():
+            session = pool.get_session(None)
+            self.assertIs(session, pool.get_session(None))
+            proxied = pool.get_session(dict(proxy))
+            self.assertIsNot(session, proxied)
+            self.assertIs(proxied, pool.get_session(dict(proxy)))
+            await asyncio.sleep(0)
+            self.assertTrue(session.closed)
+            await pool.close()
+            self.assertTrue(proxied.closed)
+        self.loop.run_until_complete(run())
@@ -3,19 +3,25 @@ import tempfile
 import sys
 import os
 import json
+import math
+import datetime
 from decimal import Decimal
 import time
 
 from io import StringIO
+from unittest import mock
 from electrum.storage import WalletStorage
 from electrum.json_db import FINAL_SEED_VERSION
 from electrum.wallet import (Abstract_Wallet, Standard_Wallet, create_new_wallet,
                              restore_wallet_from_text, Imported_Wallet)
-from electrum.exchange_rate import ExchangeBase, FxThread
+from electrum.exchange_rate import ExchangeBase, FxThread, HistoricalRates
 from electrum.util import TxMinedInfo
+from electrum.address_synchronizer import AddressSynchronizer, ChangeLog
+from electrum.bitcoin import address_to_script
 from electrum.bitcoin import COIN
 from electrum.json_db import JsonDB
 from electrum.simple_config import SimpleConfig
+from electrum.transaction import Transaction
 
 from . import ElectrumTestCase
 
@@ -93,8 +99,10 @@ class FakeFxThread:
 
     remove_thousands_separator = staticmethod(FxThread.remove_thousands_separator)
     timestamp_rate = FxThread.timestamp_rate
+    timestamp_rates = FxThread.timestamp_rates
     ccy_amount_str = FxThread.ccy_amount_str
     history_rate = FxThread.history_rate
+    history_rates = FxThread.history_rates
 
 class FakeWallet:
     def __init__(self, fiat_value):
@@ -148,6 +156,50 @@ class TestFiat(ElectrumTestCase):
         self.assertNotIn(ccy, self.fiat_value)
 
 
+class TestHistoricalRates(WalletTestCase):
+
+    def test_lookup_by_day(self):
+        h = HistoricalRates.from_dict({'2019-01-01': 3500.5, '2019-01-03': '3600', 'bad': 1}, 0)
+        self.assertEqual(3, len(h))
+        self.assertEqual(3500.5, h.get(datetime.date(2019, 1, 1).toordinal()))
+        self.assertTrue(math.isnan(h.get(datetime.date(2019, 1, 2).toordinal())))
+        self.assertEqual(3600, h.get(datetime.date(2019, 1, 3).toordinal()))
+        self.assertTrue(math.isnan(h.get(datetime.date(2018, 12, 31).toordinal())))
+        h2 = HistoricalRates.from_bytes(h.to_bytes(), 0)
+        self.assertEqual(h.first_day, h2.first_day)
+        self.assertEqual(h.rates.tobytes(), h2.rates.tobytes())
+        with self.assertRaises(ValueError):
+            HistoricalRates.from_bytes(h.to_bytes()[:-1], 0)
+
+    def test_legacy_json_cache_is_converted(self):
+        exchange = FakeExchange(Decimal('1000'))
+        exchange.on_history = lambda: None
+        with open(os.path.join(self.user_dir, exchange.name() + '_TEST'), 'w') as f:
+            f.write(json.dumps({'2019-01-01': 3500.5, '2019-01-03': 3600}))
+        h = exchange.read_historical_rates('TEST', self.user_dir)
+        self.assertEqual(3500.5, exchange.historical_rate('TEST', datetime.datetime(2019, 1, 1, 12)))
+        self.assertEqual('NaN', exchange.historical_rate('TEST', datetime.datetime(2019, 1, 2)))
+        rates_file = os.path.join(self.user_dir, exchange.name() + '_TEST.rates')
+        self.assertTrue(os.path.exists(rates_file))
+        exchange2 = FakeExchange(Decimal('1000'))
+        exchange2.on_history = lambda: None
+        h2 = exchange2.read_historical_rates('TEST', self.user_dir)
+        self.assertEqual(h.rates.tobytes(), h2.rates.tobytes())
+        self.assertAlmostEqual(h.timestamp, h2.timestamp, places=3)
+
+    def test_history_rates_falls_back_to_spot_for_recent_days(self):
+        fx = FakeFxThread(FakeExchange(Decimal('1000')))
+        fx.exchange.history['TEST'] = HistoricalRates.from_dict({'2019-01-01': 3500.5}, 0)
+        today = datetime.date.today().toordinal()
+        rates = fx.history_rates([datetime.date(2019, 1, 1).toordinal(), datetime.date(2019, 1, 2).toordinal(),
+                                  today, None])
+        self.assertEqual(Decimal(3500.5), rates[0])
+        self.assertTrue(rates[1].is_nan())
+        self.assertEqual(Decimal('1000'), rates[2])
+        self.assertTrue(rates[3].is_nan())
+        self.assertTrue(fx.history_used_spot)
+
+
 class TestCreateRestoreWallet(WalletTestCase):
 
     def test_create_new_wallet(self):
@@ -227,3 +279,202 @@ class TestCreateRestoreWallet(WalletTestCase):
         # also test addr deletion
         wallet.delete_address('bc1qnp78h78vp92pwdwq5xvh8eprlga5q8gu66960c')
         self.assertEqual(1, len(wallet.get_receiving_addresses()))
+
+
+class TestWalletChangeLog(WalletTestCase):
+
+    def test_get_changes_since(self):
+        changes = ChangeLog()
+        self.assertEqual((0, None), changes.get_changes_since(None))
+        self.assertEqual((0, set()), changes.get_changes_since(0))
+        changes.add('a', 'b')
+        pos, keys = changes.get_changes_since(0)
+        self.assertEqual({'a', 'b'}, keys)
+        self.assertEqual((pos, set()), changes.get_changes_since(pos))
+        changes.add('c')
+        self.assertEqual((pos + 1, {'c'}), changes.get_changes_since(pos))
+
+    def test_truncated_log_asks_for_full_reload(self):
+        changes = ChangeLog()
+        changes.add(*map(str, range(ChangeLog.MAX_ENTRIES + 1)))
+        self.assertEqual((ChangeLog.MAX_ENTRIES + 1, None), changes.get_changes_since(0))
+        pos, keys = changes.get_changes_since(1)
+        self.assertEqual(ChangeLog.MAX_ENTRIES, len(keys))
+
+    def test_wallet_records_label_and_address_changes(self):
+        text = 'bc1q2ccr34wzep58d4239tl3x3734ttle92a8srmuw bc1qnp78h78vp92pwdwq5xvh8eprlga5q8gu66960c'
+        wallet = restore_wallet_from_text(text, path=self.wallet_path, config=self.config)['wallet']
+        pos = wallet.changes.get_position()
+        wallet.set_label('bc1q2ccr34wzep58d4239tl3x3734ttle92a8srmuw', 'savings')
+        wallet.delete_address('bc1qnp78h78vp92pwdwq5xvh8eprlga5q8gu66960c')
+        pos, keys = wallet.changes.get_changes_since(pos)
+        self.assertEqual({'bc1q2ccr34wzep58d4239tl3x3734ttle92a8srmuw',
+                          'bc1qnp78h78vp92pwdwq5xvh8eprlga5q8gu66960c'}, keys)
+        self.assertEqual((pos, set()), wallet.changes.get_changes_since(pos))
+
+
+class TestDependingTransactions(ElectrumTestCase):
+
+    ADDRESS = 'bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4'
+    FUNDING_TXID = '11' * 32
+
+    def make_tx(self, prevouts, num_outputs=1, value=100000):
+        script = address_to_script(self.ADDRESS)
+        raw = '02000000' + '%02x' % len(prevouts)
+        for txid, n in prevouts:
+            raw += bytes.fromhex(txid)[::-1].hex() + n.to_bytes(4, 'little').hex() + '00' + 'fdffffff'
+        raw += '%02x' % num_outputs
+        for i in range(num_outputs):
+            raw += (value - i).to_bytes(8, 'little').hex() + '%02x' % (len(script) // 2) + script
+        return Transaction(raw + '00000000')
+
+    def setUp(self):
+        super().setUp()
+        self.adb = AddressSynchronizer(JsonDB({}, manual_upgrades=False))
+        self.adb.add_address(self.ADDRESS)
+
+    def add_chain(self, length):
+        txs = [self.make_tx([(self.FUNDING_TXID, 0)])]
+        for i in range(1, length):
+            txs.append(self.make_tx([(txs[-1].txid(), 0)], value=100000 - i))
+        for tx in txs:
+            self.assertTrue(self.adb.add_transaction(tx, allow_unrelated=True))
+        return txs
+
+    def test_deep_chain_is_walked_iteratively(self):
+        # deeper than the default recursion limit
+        txs = self.add_chain(1500)
+        children = self.adb.get_depending_transactions(txs[0].txid())
+        self.assertEqual({tx.txid() for tx in txs[1:]}, children)
+
+    def test_diamond(self):
+        parent = self.make_tx([(self.FUNDING_TXID, 0)], num_outputs=2)
+        left = self.make_tx([(parent.txid(), 0)])
+        right = self.make_tx([(parent.txid(), 1)])
+        child = self.make_tx([(left.txid(), 0), (right.txid(), 0)])
+        for tx in (parent, left, right, child):
+            self.adb.add_transaction(tx, allow_unrelated=True)
+        self.assertEqual({left.txid(), right.txid(), child.txid()},
+                         self.adb.get_depending_transactions(parent.txid()))
+        self.assertEqual({child.txid()}, self.adb.get_depending_transactions(left.txid(), right.txid()))
+        self.assertEqual({(left.txid(), '0'), (right.txid(), '0')},
+                         set(self.adb.db.get_spent_prevouts(child.txid())))
+
+    def test_replacement_evicts_descendants(self):
+        txs = self.add_chain(50)
+        replacement = self.make_tx([(self.FUNDING_TXID, 0)], value=90000)
+        self.assertTrue(self.adb.add_transaction(replacement, allow_unrelated=True))
+        self.assertEqual([replacement.txid()], self.adb.db.list_transactions())
+        self.assertEqual([(self.FUNDING_TXID, '0')], self.adb.db.list_spent_outpoints())
+        self.assertEqual({replacement.txid()}, set(self.adb.db._spent_prevouts))
+        for tx in txs[1:]:
+            self.assertIsNone(self.adb.db.get_transaction(tx.txid()))
+
+    def test_remove_transactions_without_tx(self):
+        txs = self.add_chain(10)
+        # the spends are undone even if we no longer have the txs themselves
+        for tx in txs[3:]:
+            self.adb.db.remove_transaction(tx.txid())
+        self.adb.remove_transactions([tx.txid() for tx in txs[3:]])
+        self.assertEqual(set(), self.adb.get_depending_transactions(txs[2].txid()))
+        self.assertEqual(3, len(self.adb.db.list_spent_outpoints()))
+        self.assertEqual([], self.adb.db.get_spent_prevouts(txs[5].txid()))
+
+
+class TestUndoVerifications(ElectrumTestCase):
+
+    class FakeBlockchain:
+
+        def __init__(self, hashes):
+            self.hashes = hashes
+            self.requested = []
+
+        def get_header_hashes(self, heights):
+            heights = list(heights)
+            self.requested.append(heights)
+            return {height: self.hashes.get(height) for height in heights}
+
+    def setUp(self):
+        super().setUp()
+        self.adb = AddressSynchronizer(JsonDB({}, manual_upgrades=False))
+        for height in range(1, 101):
+            for i in range(3):
+                txid = '%032x%032x' % (height, i)
+                self.adb.db.add_verified_tx(txid, TxMinedInfo(height=height, timestamp=0, txpos=i,
+                                                              header_hash='%064x' % height))
+
+    def test_only_txs_above_fork_are_checked(self):
+        hashes = {height: '%064x' % height for height in range(1, 101)}
+        hashes[100] = 'ff' * 32
+        chain = self.FakeBlockchain(hashes)
+        txs = self.adb.undo_verifications(chain, 98)
+        self.assertEqual([[99, 99, 99, 100, 100, 100]], chain.requested)
+        self.assertEqual({'%032x%032x' % (100, i) for i in range(3)}, txs)
+        self.assertEqual(['%032x%032x' % (99, i) for i in range(3)], self.adb.db.list_verified_tx_above(98))
+        self.assertEqual(100, self.adb.unverified_tx['%032x%032x' % (100, 0)])
+
+    def test_height_index_follows_updates(self):
+        txid = '%032x%032x' % (5, 0)
+        self.adb.db.add_verified_tx(txid, TxMinedInfo(height=200, timestamp=0, txpos=0, header_hash='00' * 32))
+        self.assertEqual([txid], self.adb.db.list_verified_tx_above(100))
+        self.assertEqual(300, len(self.adb.db.list_verified_tx_above(0)))
+        self.adb.db.remove_verified_tx(txid)
+        self.assertEqual([], self.adb.db.list_verified_tx_above(100))
+        self.assertEqual(299, len(self.adb.db.list_verified_tx_above(0)))
+        # the index is rebuilt when the db is loaded
+        db = JsonDB(self.adb.db.dump(), manual_upgrades=False)
+        self.assertEqual(self.adb.db.list_verified_tx_above(50), db.list_verified_tx_above(50))
+
+
+class TestAddressPools(WalletTestCase):
+
+    def setUp(self):
+        super().setUp()
+        text = 'zpub6nydoME6CFdJtMpzHW5BNoPz6i6XbeT9qfz72wsRqGdgGEYeivso6xjfw8cGcCyHwF7BNW4LDuHF35XrZsovBLWMF4qXSjmhTXYiHbWqGLt'
+        self.wallet = restore_wallet_from_text(text, path=self.wallet_path, gap_limit=5, config=self.config)['wallet']
+        self.receiving = self.wallet.get_receiving_addresses()
+
+    def add_request(self, addr, *, expiration=3600, age=0):
+        req = self.wallet.make_payment_request(addr, 10000, 'test', expiration)
+        req['time'] -= age
+        self.wallet.add_payment_request(req)
+
+    def test_requests_reserve_addresses(self):
+        wallet, receiving = self.wallet, self.receiving
+        self.assertEqual(receiving, wallet.get_unused_addresses())
+        self.assertEqual(receiving[0], wallet.get_unused_address())
+        self.add_request(receiving[0])
+        self.add_request(receiving[2], expiration=None)
+        self.assertEqual(receiving[1], wallet.get_unused_address())
+        self.assertEqual(receiving[1], wallet.get_receiving_address())
+        self.assertEqual([receiving[1]] + receiving[3:], wallet.get_unused_addresses())
+        # expired requests no longer reserve their address
+        self.add_request(receiving[0], expiration=60, age=120)
+        self.assertEqual(receiving[0], wallet.get_unused_address())
+        self.assertEqual(receiving[1], wallet.get_receiving_address())
+        wallet.remove_payment_request(receiving[2])
+        self.assertEqual(receiving, wallet.get_unused_addresses())
+
+    def test_request_expiring_later_frees_address(self):
+        self.add_request(self.receiving[0], expiration=60)
+        self.assertEqual(self.receiving[1], self.wallet.get_unused_address())
+        with mock.patch('time.time', return_value=time.time() + 120):
+            self.assertEqual(self.receiving[0], self.wallet.get_unused_address())
+
+    def test_history_and_new_addresses(self):
+        wallet, receiving = self.wallet, self.receiving
+        wallet.receive_history_callback(receiving[0], [('00' * 32, 100)], {})
+        self.assertEqual(receiving[1:], wallet.get_unused_addresses())
+        new_addr = wallet.create_new_address(for_change=False)
+        self.assertEqual(receiving[1:] + [new_addr], wallet.get_unused_addresses())
+        change = wallet.get_change_addresses()
+        self.assertEqual(change, wallet.calc_unused_change_addresses())
+        new_change = wallet.create_new_address(for_change=True)
+        self.assertEqual(change + [new_change], wallet.calc_unused_change_addresses())
+
+    def test_truncated_change_log_rebuilds_pools(self):
+        wallet, receiving = self.wallet, self.receiving
+        self.assertEqual(receiving[0], wallet.get_unused_address())
+        wallet.db.history[receiving[0]] = [('00' * 32, 100)]
+        wallet.changes.add(*map(str, range(ChangeLog.MAX_ENTRIES + 1)))
+        self.assertEqual(receiving[1], wallet.get_unused_address())
@@ -4,13 +4,18 @@ import shutil
 import tempfile
 from typing import Sequence
 import asyncio
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
 
-from electrum import storage, bitcoin, keystore, bip32
+from electrum import storage, bitcoin, keystore, bip32, ecc
 from electrum import Transaction
 from electrum import SimpleConfig
 from electrum.address_synchronizer import TX_HEIGHT_UNCONFIRMED, TX_HEIGHT_UNCONF_PARENT
 from electrum.wallet import sweep, Multisig_Wallet, Standard_Wallet, Imported_Wallet, restore_wallet_from_text, Abstract_Wallet
-from electrum.util import bfh, bh2u
+from electrum.util import bfh, bh2u, InvalidPassword, TxMinedInfo, PR_PAID, PR_UNPAID, PR_EXPIRED, PR_UNKNOWN
+from electrum.util import PR_TYPE_LN
+from electrum.exchange_rate import HistoricalRates
 from electrum.transaction import TxOutput, Transaction, PartialTransaction, PartialTxOutput, PartialTxInput, tx_from_any
 from electrum.mnemonic import seed_type
 
@@ -19,6 +24,7 @@ from electrum.plugins.trustedcoin import trustedcoin
 from . import TestCaseForTestnet
 from . import ElectrumTestCase
 from .test_bitcoin import needs_test_with_all_ecc_implementations
+from .test_wallet import FakeExchange, FakeFxThread
 
 
 UNICODE_HORROR_HEX = 'e282bf20f09f988020f09f98882020202020e3818620e38191e3819fe381be20e3828fe3828b2077cda2cda2cd9d68cda16fcda2cda120ccb8cda26bccb5cd9f6eccb4cd98c7ab77ccb8cc9b73cd9820cc80cc8177cd98cda2e1b8a9ccb561d289cca1cda27420cca7cc9568cc816fccb572cd8fccb5726f7273cca120ccb6cda1cda06cc4afccb665cd9fcd9f20ccb6cd9d696ecda220cd8f74cc9568ccb7cca1cd9f6520cd9fcd9f64cc9b61cd9c72cc95cda16bcca2cca820cda168ccb465cd8f61ccb7cca2cca17274cc81cd8f20ccb4ccb7cda0c3b2ccb5ccb666ccb82075cca7cd986ec3adcc9bcd9c63cda2cd8f6fccb7cd8f64ccb8cda265cca1cd9d3fcd9e'
@@ -549,6 +555,41 @@ class TestWalletKeystoreAddressIntegrityForTestnet(TestCaseForTestnet):
         self.assertEqual(w.get_change_addresses()[0], 'tb1q0fj5mra96hhnum80kllklc52zqn6kppt3hyzr49yhr3ecr42z3ts5777jl')
 
 
+class TestKeystoreSigningSession(ElectrumTestCase):
+
+    def _check_session(self, ks, sequences):
+        ks.update_password(None, 'pw')
+        expected = {seq: ks.get_private_key(seq, 'pw') for seq in sequences}
+        ks.start_signing_session('pw')
+        session = ks._signing_session
+        for seq in sequences + sequences:
+            self.assertEqual(expected[seq], ks._get_private_key_maybe_from_session(seq, 'pw'))
+        self.assertEqual(len(sequences), len(session._privkeys))
+        self.assertEqual(ks.sign_message(sequences[0], b'hello', 'pw'),
+                         ecc.ECPrivkey(expected[sequences[0]][0]).sign_message(b'hello', expected[sequences[0]][1]))
+        # a different password does not use the session
+        with self.assertRaises(InvalidPassword):
+            ks.sign_message(sequences[0], b'hello', 'wrong')
+        cached = [privkey for privkey, _ in session._privkeys.values()]
+        ks.end_signing_session()
+        self.assertIsNone(ks._signing_session)
+        for privkey in cached:
+            self.assertEqual(bytes(len(privkey)), privkey)
+        # sessions expire
+        ks.start_signing_session('pw', timeout=0)
+        self.assertIsNone(ks._get_signing_session('pw'))
+        self.assertEqual(expected[sequences[0]], ks._get_private_key_maybe_from_session(sequences[0], 'pw'))
+        ks.end_signing_session()
+
+    def test_bip32(self):
+        ks = keystore.from_seed('bitter grass shiver impose acquire brush forget axis eager alone wine silver', '', False)
+        self._check_session(ks, [(0, 0), (0, 7), (1, 3)])
+
+    def test_old(self):
+        ks = keystore.from_seed('powerful random nobody notice nothing important anyway look away hidden message over', '', False)
+        self._check_session(ks, [(0, 0), (1, 2)])
+
+
 class TestWalletSending(TestCaseForTestnet):
 
     def setUp(self):
@@ -1360,6 +1401,60 @@ class TestWalletSending(TestCaseForTestnet):
         wallet.receive_tx_callback(tx.txid(), tx, TX_HEIGHT_UNCONFIRMED)
         self.assertEqual((0, 3_900_000, 0), wallet.get_balance())
 
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_unconfirmed_base_tx_for_batching(self, mock_write):
+        wallet = self.create_standard_wallet_from_seed('frost repair depend effort salon ring foam oak cancel receive save usage')
+        funding_tx = Transaction('01000000000102acd6459dec7c3c51048eb112630da756f5d4cb4752b8d39aa325407ae0885cba020000001716001455c7f5e0631d8e6f5f05dddb9f676cec48845532fdffffffd146691ef6a207b682b13da5f2388b1f0d2a2022c8cfb8dc27b65434ec9ec8f701000000171600147b3be8a7ceaf15f57d7df2a3d216bc3c259e3225fdffffff02a9875b000000000017a914ea5a99f83e71d1c1dfc5d0370e9755567fe4a141878096980000000000160014d4ca56fcbad98fb4dcafdc573a75d6a6fffb09b702483045022100dde1ba0c9a2862a65791b8d91295a6603207fb79635935a67890506c214dd96d022046c6616642ef5971103c1db07ac014e63fa3b0e15c5729eacdd3e77fcb7d2086012103a72410f185401bb5b10aaa30989c272b554dc6d53bda6da85a76f662723421af024730440220033d0be8f74e782fbcec2b396647c7715d2356076b442423f23552b617062312022063c95cafdc6d52ccf55c8ee0f9ceb0f57afb41ea9076eb74fe633f59c50c6377012103b96a4954d834fbcfb2bbf8cf7de7dc2b28bc3d661c1557d1fd1db1bfc123a94abb391400')
+        wallet.receive_tx_callback(funding_tx.txid(), funding_tx, TX_HEIGHT_UNCONFIRMED)
+        # incoming txs are not candidates
+        self.assertIsNone(wallet.get_unconfirmed_base_tx_for_batching())
+
+        tx = Transaction('01000000000101c0ec8b6cdcb6638fa117ead71a8edebc189b30e6e5415bdfb3c8260aa269e6520100000000fdffffff02a02526000000000017a9145a71fc1a7a98ddd67be935ade1600981c0d066f987585d720000000000160014f0fe5c1867a174a12e70165e728a072619455ed50247304402205442705e988abe74bf391b293bb1b886674284a92ed0788c33024f9336d60aef022013a93049d3bed693254cd31a704d70bb988a36750f0b74d0a5b4d9e29c54ca9d0121028d4c44ca36d2c4bff3813df8d5d3c0278357521ecb892cd694c473c03970e4c5bb391400')
+        txid = tx.txid()
+        wallet.add_transaction(tx)
+        self.assertEqual(txid, wallet.get_unconfirmed_base_tx_for_batching().txid())
+        wallet.receive_tx_callback(txid, tx, TX_HEIGHT_UNCONFIRMED)
+        self.assertEqual(txid, wallet.get_unconfirmed_base_tx_for_batching().txid())
+        # mined
+        wallet.add_unverified_tx(txid, 1325500)
+        self.assertIsNone(wallet.get_unconfirmed_base_tx_for_batching())
+        # back in the mempool after a reorg
+        wallet.add_unverified_tx(txid, TX_HEIGHT_UNCONFIRMED)
+        self.assertEqual(txid, wallet.get_unconfirmed_base_tx_for_batching().txid())
+
+        # a tx spending its change would be cancelled by a replacement
+        coins = [c for c in wallet.get_spendable_coins(domain=None) if c.prevout.txid.hex() == txid]
+        outputs = [PartialTxOutput.from_address_and_value('2N1VTMMFb91SH9SNRAkT7z8otP5eZEct4KL', 1_000_000)]
+        child = wallet.make_unsigned_transaction(coins=coins, outputs=outputs, fee=5000)
+        wallet.sign_transaction(child, password=None)
+        wallet.receive_tx_callback(child.txid(), child, TX_HEIGHT_UNCONFIRMED)
+        self.assertIsNone(wallet.get_unconfirmed_base_tx_for_batching())
+        wallet.remove_transaction(child.txid())
+        self.assertEqual(txid, wallet.get_unconfirmed_base_tx_for_batching().txid())
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_unconfirmed_base_tx_for_batching_picks_oldest(self, mock_write):
+        wallet = self.create_standard_wallet_from_seed('frost repair depend effort salon ring foam oak cancel receive save usage')
+        funding_tx1 = Transaction('01000000000102acd6459dec7c3c51048eb112630da756f5d4cb4752b8d39aa325407ae0885cba020000001716001455c7f5e0631d8e6f5f05dddb9f676cec48845532fdffffffd146691ef6a207b682b13da5f2388b1f0d2a2022c8cfb8dc27b65434ec9ec8f701000000171600147b3be8a7ceaf15f57d7df2a3d216bc3c259e3225fdffffff02a9875b000000000017a914ea5a99f83e71d1c1dfc5d0370e9755567fe4a141878096980000000000160014d4ca56fcbad98fb4dcafdc573a75d6a6fffb09b702483045022100dde1ba0c9a2862a65791b8d91295a6603207fb79635935a67890506c214dd96d022046c6616642ef5971103c1db07ac014e63fa3b0e15c5729eacdd3e77fcb7d2086012103a72410f185401bb5b10aaa30989c272b554dc6d53bda6da85a76f662723421af024730440220033d0be8f74e782fbcec2b396647c7715d2356076b442423f23552b617062312022063c95cafdc6d52ccf55c8ee0f9ceb0f57afb41ea9076eb74fe633f59c50c6377012103b96a4954d834fbcfb2bbf8cf7de7dc2b28bc3d661c1557d1fd1db1bfc123a94abb391400')
+        wallet.receive_tx_callback(funding_tx1.txid(), funding_tx1, TX_HEIGHT_UNCONFIRMED)
+        funding_tx2 = Transaction('01000000000101c0ec8b6cdcb6638fa117ead71a8edebc189b30e6e5415bdfb3c8260aa269e6520000000017160014ba9ca815474a674ff1efb3fc82cf0f3460de8c57fdffffff0230390f000000000017a9148b59abaca8215c0d4b18cbbf715550aa2b50c85b87404b4c000000000016001483c3bc7234f17a209cc5dcce14903b54ee4dab9002473044022038a05f7d38bcf810dfebb39f1feda5cc187da4cf5d6e56986957ddcccedc75d302203ab67ccf15431b4e2aeeab1582b9a5a7821e7ac4be8ebf512505dbfdc7e094fd0121032168234e0ba465b8cedc10173ea9391725c0f6d9fa517641af87926626a5144abd391400')
+        wallet.receive_tx_callback(funding_tx2.txid(), funding_tx2, TX_HEIGHT_UNCONFIRMED)
+        # one outgoing RBF tx spending each funding tx
+        txs = []
+        for funding_tx in (funding_tx1, funding_tx2):
+            coins = [c for c in wallet.get_spendable_coins(domain=None) if c.prevout.txid.hex() == funding_tx.txid()]
+            outputs = [PartialTxOutput.from_address_and_value('2N1VTMMFb91SH9SNRAkT7z8otP5eZEct4KL', 1_000_000)]
+            tx = wallet.make_unsigned_transaction(coins=coins, outputs=outputs, fee=5000)
+            tx.set_rbf(True)
+            wallet.sign_transaction(tx, password=None)
+            txs.append(tx)
+        wallet.receive_tx_callback(txs[0].txid(), txs[0], TX_HEIGHT_UNCONF_PARENT)
+        wallet.receive_tx_callback(txs[1].txid(), txs[1], TX_HEIGHT_UNCONFIRMED)
+        # like the history, unconfirmed txs come before the ones with unconfirmed parents
+        self.assertEqual(txs[1].txid(), wallet.get_unconfirmed_base_tx_for_batching().txid())
+        wallet.add_unverified_tx(txs[1].txid(), 1325500)
+        self.assertEqual(txs[0].txid(), wallet.get_unconfirmed_base_tx_for_batching().txid())
+
     @needs_test_with_all_ecc_implementations
     @mock.patch.object(storage.WalletStorage, '_write')
     def test_cpfp_p2wpkh(self, mock_write):
@@ -2259,6 +2354,108 @@ class TestWalletHistory_SimpleRandomOrder(TestCaseForTestnet):
             w.receive_tx_callback(tx.txid(), tx, TX_HEIGHT_UNCONFIRMED)
         self.assertEqual(27633300, sum(w.get_balance()))
 
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_batched_fiat_valuation_matches_per_tx(self, mock_write):
+        w = self.create_old_wallet()
+        for txid in self.txid_list:
+            tx = Transaction(self.transactions[txid])
+            w.receive_tx_callback(tx.txid(), tx, TX_HEIGHT_UNCONFIRMED)
+        # mine the txns one per day, in an order where some children come before their parents
+        day0 = datetime(2018, 1, 1)
+        for i, txid in enumerate(reversed(self.txid_list)):
+            w.unverified_tx.pop(txid)
+            w.db.add_verified_tx(txid, TxMinedInfo(height=1000 + i, timestamp=int((day0 + timedelta(days=i)).timestamp()),
+                                                   txpos=0, header_hash='00' * 32))
+        fx = FakeFxThread(FakeExchange(Decimal('5000')))
+        fx.exchange.history['TEST'] = HistoricalRates.from_dict(
+            {(day0 + timedelta(days=i)).strftime('%Y-%m-%d'): 1000 + 37 * i for i in range(0, 30, 2)}, time.time())
+        w.set_fiat_value(self.txid_list[3], 'TEST', '123.45', fx, w.get_tx_value(self.txid_list[3]))
+        history = list(w.get_onchain_history())
+        expected = [w.get_tx_item_fiat(item['txid'], item['bc_value'].value, fx, item['fee_sat'])
+                    for item in history]
+        self.assertEqual(expected, w.get_tx_items_fiat(history, fx))
+        self.assertTrue(any('capital_gain' in item for item in expected))
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_onchain_history_item_matches_full_history(self, mock_write):
+        w = self.create_old_wallet()
+        for txid in self.txid_list:
+            tx = Transaction(self.transactions[txid])
+            w.receive_tx_callback(tx.txid(), tx, TX_HEIGHT_UNCONFIRMED)
+        day0 = datetime(2018, 1, 1)
+        for i, txid in enumerate(self.txid_list[:10]):
+            w.unverified_tx.pop(txid)
+            w.db.add_verified_tx(txid, TxMinedInfo(height=1000 + i, timestamp=int((day0 + timedelta(days=i)).timestamp()),
+                                                   txpos=0, header_hash='00' * 32))
+        fx = FakeFxThread(FakeExchange(Decimal('5000')))
+        fx.exchange.history['TEST'] = HistoricalRates.from_dict(
+            {(day0 + timedelta(days=i)).strftime('%Y-%m-%d'): 1000 + 37 * i for i in range(0, 30, 2)}, time.time())
+        addr = w.get_receiving_addresses()[0]
+        for domain in (None, [addr]):
+            history = w.get_full_history(fx, onchain_domain=domain)
+            self.assertTrue(history)
+            for txid, item in history.items():
+                del item['balance'], item['bc_balance']
+                self.assertEqual(item, w.get_onchain_history_item(txid, domain=domain, fx=fx))
+        not_in_domain = [txid for txid in self.txid_list if txid not in w.get_full_history(onchain_domain=[addr])]
+        self.assertTrue(not_in_domain)
+        self.assertIsNone(w.get_onchain_history_item(not_in_domain[0], domain=[addr]))
+        self.assertIsNone(w.get_onchain_history_item('00' * 32))
+
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_request_status_index_follows_wallet_changes(self, mock_write):
+        w = self.create_old_wallet()
+        w.network = mock.Mock(get_local_height=lambda: 1100)
+        addrs = w.get_receiving_addresses()
+        for i, addr in enumerate(addrs[:-1]):
+            w.add_payment_request(w.make_payment_request(addr, 1000, 'req %d' % i, 3600))
+        expired = w.make_payment_request(addrs[-1], 1000, 'expired', 10)
+        expired['time'] -= 20
+        w.add_payment_request(expired)
+        for txid in self.txid_list:
+            tx = Transaction(self.transactions[txid])
+            w.receive_tx_callback(tx.txid(), tx, TX_HEIGHT_UNCONFIRMED)
+        funded = [addr for addr in addrs[:-1] if w.get_address_history(addr)]
+        unused = [addr for addr in addrs[:-1] if not w.get_address_history(addr)]
+        self.assertIn(mock.call('payment_received', w, funded[0], PR_PAID),
+                      w.network.trigger_callback.call_args_list)
+        self.assertEqual((PR_PAID, 0), w.get_request_status(funded[0]))
+        self.assertEqual((PR_UNPAID, None), w.get_request_status(unused[0]))
+        self.assertEqual((PR_EXPIRED, None), w.get_request_status(addrs[-1]))
+        self.assertEqual(PR_UNKNOWN, w.get_request_status('not a request'))
+
+        def check_index():
+            for addr in addrs:
+                paid, conf = w.get_payment_status(addr, w.receive_requests[addr]['amount'])
+                self.assertEqual(conf, w.get_request_status(addr)[1])
+                self.assertEqual(paid, w.get_request_status(addr)[0] == PR_PAID)
+        for i, txid in enumerate(self.txid_list):
+            w.add_verified_tx(txid, TxMinedInfo(height=1000 + i, timestamp=0, txpos=0, header_hash='00' * 32))
+        check_index()
+        self.assertTrue(w.get_request_status(funded[0])[1] > 0)
+        txid = w.get_address_history(funded[0])[0][0]
+        w.undo_verifications(mock.Mock(get_header_hashes=lambda heights: {}), w.db.get_verified_tx(txid).height - 1)
+        check_index()
+        w.remove_transaction(txid)
+        check_index()
+
+        w._on_request_expiry()
+        w.network.trigger_callback.assert_called_with('request_status', addrs[-1], PR_EXPIRED)
+        w.remove_payment_request(addrs[-1])
+        self.assertEqual(PR_UNKNOWN, w.get_request_status(addrs[-1]))
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_lightning_request_expiry(self, mock_write):
+        w = self.create_old_wallet()
+        w.network = mock.Mock()
+        statuses = {'aa' * 32: PR_UNPAID, 'bb' * 32: PR_PAID}
+        w.lnworker = mock.Mock(get_payment_status=lambda rhash: statuses[rhash.hex()])
+        for rhash in statuses:
+            w.add_payment_request({'type': PR_TYPE_LN, 'rhash': rhash, 'message': 'ln', 'amount': 1000,
+                                   'time': int(time.time()) - 20, 'exp': 10})
+        w._on_request_expiry()
+        w.network.trigger_callback.assert_called_once_with('request_status', 'aa' * 32, PR_EXPIRED)
 
 class TestWalletHistory_EvilGapLimit(TestCaseForTestnet):
     transactions = {
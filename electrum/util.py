@@ -22,8 +22,9 @@
 # SOFTWARE.
 import binascii
 import os, sys, re, json
-from collections import defaultdict, OrderedDict
-from typing import NamedTuple, Union, TYPE_CHECKING, Tuple, Optional, Callable, Any, Sequence
+from collections import defaultdict, OrderedDict, deque
+from functools import partial
+from typing import NamedTuple, Union, TYPE_CHECKING, Tuple, Optional, Callable, Any, Sequence, Dict, List
 from datetime import datetime
 import decimal
 from decimal import Decimal
@@ -1030,17 +1031,10 @@ class TxMinedInfo(NamedTuple):
     header_hash: Optional[str] = None  # hash of block that mined tx
 
 
-def make_aiohttp_session(proxy: Optional[dict], headers=None, timeout=None):
-    if headers is None:
-        headers = {'User-Agent': 'Electrum'}
-    if timeout is None:
-        timeout = aiohttp.ClientTimeout(total=30)
-    elif isinstance(timeout, (int, float)):
-        timeout = aiohttp.ClientTimeout(total=timeout)
+def make_aiohttp_connector(proxy: Optional[dict], **kwargs) -> aiohttp.TCPConnector:
     ssl_context = ssl.create_default_context(purpose=ssl.Purpose.SERVER_AUTH, cafile=ca_path)
-
     if proxy:
-        connector = SocksConnector(
+        return SocksConnector(
             socks_ver=SocksVer.SOCKS5 if proxy['mode'] == 'socks5' else SocksVer.SOCKS4,
             host=proxy['host'],
             port=int(proxy['port']),
@@ -1048,13 +1042,81 @@ def make_aiohttp_session(proxy: Optional[dict], headers=None, timeout=None):
             password=proxy.get('password', None),
             rdns=True,
             ssl=ssl_context,
+            **kwargs,
         )
-    else:
-        connector = aiohttp.TCPConnector(ssl=ssl_context)
+    return aiohttp.TCPConnector(ssl=ssl_context, **kwargs)
 
+
+def make_aiohttp_session(proxy: Optional[dict], headers=None, timeout=None, connector=None):
+    if headers is None:
+        headers = {'User-Agent': 'Electrum'}
+    if timeout is None:
+        timeout = aiohttp.ClientTimeout(total=30)
+    elif isinstance(timeout, (int, float)):
+        timeout = aiohttp.ClientTimeout(total=timeout)
+    if connector is None:
+        connector = make_aiohttp_connector(proxy)
     return aiohttp.ClientSession(headers=headers, timeout=timeout, connector=connector)
 
 
+class _PooledSessionContext:
+    # like a ClientSession in an 'async with', but does not close it on exit
+
+    def __init__(self, session: aiohttp.ClientSession):
+        self.session = session
+
+    async def __aenter__(self) -> aiohttp.ClientSession:
+        return self.session
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class HttpSessionPool(Logger):
+    """A long-lived aiohttp session, so that outbound HTTP requests reuse
+    their TCP, TLS and proxy handshakes. Connections are kept alive for
+    keepalive_timeout seconds, at most limit_per_host of them per host,
+    and DNS answers are cached for dns_cache_ttl seconds. The session is
+    rebuilt when the proxy changes. It must only be used on the loop it
+    was created on.
+    """
+
+    def __init__(self, *, limit: int = 100, limit_per_host: int = 8,
+                 keepalive_timeout: float = 30, dns_cache_ttl: int = 300):
+        Logger.__init__(self)
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self._session = None  # type: Optional[aiohttp.ClientSession]
+        self._proxy = None  # type: Optional[dict]
+
+    def get_session(self, proxy: Optional[dict]) -> aiohttp.ClientSession:
+        if self._session is not None and not self._session.closed and proxy == self._proxy:
+            return self._session
+        if self._session is not None:
+            self.logger.info('proxy changed, rebuilding http session')
+            asyncio.ensure_future(self._session.close())
+        connector = make_aiohttp_connector(
+            proxy,
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_cache_ttl,
+        )
+        self._session = make_aiohttp_session(proxy, connector=connector)
+        self._proxy = dict(proxy) if proxy else None
+        return self._session
+
+    def session(self, proxy: Optional[dict]) -> _PooledSessionContext:
+        return _PooledSessionContext(self.get_session(proxy))
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
 class SilentTaskGroup(TaskGroup):
 
     def spawn(self, *args, **kwargs):
@@ -1064,6 +1126,187 @@ class SilentTaskGroup(TaskGroup):
         return super().spawn(*args, **kwargs)
 
 
+class ReadWriteLock:
+    """An asyncio lock that can be held by many readers or by one writer.
+    Waiters are served in FIFO order, so a writer is not starved by a
+    steady stream of readers. release() is synchronous, so that it can
+    be called from a done-callback.
+    """
+    def __init__(self):
+        self._readers = 0
+        self._writer = False
+        self._waiters = deque()  # of (future, exclusive)
+
+    def locked(self) -> bool:
+        return self._writer or self._readers > 0
+
+    def _can_take(self, exclusive: bool) -> bool:
+        return not self._writer and (not exclusive or self._readers == 0)
+
+    def _take(self, exclusive: bool):
+        if exclusive:
+            self._writer = True
+        else:
+            self._readers += 1
+
+    async def acquire(self, *, exclusive: bool):
+        if not self._waiters and self._can_take(exclusive):
+            self._take(exclusive)
+            return
+        fut = asyncio.get_event_loop().create_future()
+        self._waiters.append((fut, exclusive))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # the lock was handed to us just before we got cancelled
+                self.release(exclusive=exclusive)
+            else:
+                self._wake_up_waiters()
+            raise
+
+    def release(self, *, exclusive: bool):
+        if exclusive:
+            assert self._writer
+            self._writer = False
+        else:
+            assert self._readers > 0
+            self._readers -= 1
+        self._wake_up_waiters()
+
+    def _wake_up_waiters(self):
+        while self._waiters:
+            fut, exclusive = self._waiters[0]
+            if fut.done():
+                self._waiters.popleft()
+                continue
+            if not self._can_take(exclusive):
+                break
+            self._waiters.popleft()
+            self._take(exclusive)
+            fut.set_result(None)
+
+
+class EventBus(Logger):
+    """Dispatches events to the callbacks registered for them, on the
+    asyncio event loop. Events can be triggered from any thread.
+
+    Events that only tell subscribers to refresh some state are coalesced:
+    if such an event is triggered several times for the same subject
+    before the loop gets to dispatch it, each subscriber is called once,
+    with the latest arguments. The subject of an event is made of its
+    first COALESCED_EVENTS[event] arguments.
+
+    A subscriber can pass a filter, which is called with the event and
+    its arguments, to skip events it is not interested in. Subscribers
+    registered with priority=True are called before the other ones, for
+    all the pending events.
+    """
+
+    COALESCED_EVENTS = {
+        'network_updated': 0,
+        'blockchain_updated': 0,
+        'status': 0,
+        'updated': 0,
+        'banner': 0,
+        'fee': 0,
+        'fee_histogram': 0,
+        'servers': 0,
+        'interfaces': 0,
+        'on_quotes': 0,
+        'on_history': 0,
+        'gossip_peers': 0,
+        'unknown_channels': 0,
+        'channel_db': 0,
+        'wallet_updated': 1,    # wallet
+        'channels_updated': 1,  # wallet
+        'channel': 1,           # chan
+        'verified': 2,          # wallet, txid
+    }
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        Logger.__init__(self)
+        self.loop = loop
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(list)  # type: Dict[str, List[_EventSubscriber]]  # note: needs self._lock
+        self._pending = OrderedDict()  # note: needs self._lock
+        self._num_triggered = 0
+        self._flush_scheduled = False
+
+    def register(self, callback, events, *, filter: Callable[..., bool] = None, priority: bool = False):
+        with self._lock:
+            for event in events:
+                self._subscribers[event].append(_EventSubscriber(callback, filter, priority))
+
+    def unregister(self, callback):
+        with self._lock:
+            for event, subscribers in list(self._subscribers.items()):
+                subscribers[:] = [sub for sub in subscribers if sub.callback != callback]
+                if not subscribers:
+                    del self._subscribers[event]
+
+    def trigger(self, event, *args):
+        num_subject_args = self.COALESCED_EVENTS.get(event)
+        with self._lock:
+            if event not in self._subscribers:
+                return
+            self._num_triggered += 1
+            if num_subject_args is None:
+                key = self._num_triggered
+            else:
+                key = (event,) + tuple(a if isinstance(a, (str, bytes, int)) else id(a)
+                                       for a in args[:num_subject_args])
+                # move it to the end, after the events it might depend on
+                self._pending.pop(key, None)
+            self._pending[key] = (event, args)
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        try:
+            self.loop.call_soon_threadsafe(self._flush)
+        except BaseException:
+            with self._lock:
+                self._flush_scheduled = False
+            raise
+
+    def _flush(self):
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+            self._flush_scheduled = False
+            subscribers = {event: list(self._subscribers.get(event, []))
+                           for event in set(event for event, args in pending)}
+        for priority in (True, False):
+            for event, args in pending:
+                for sub in subscribers[event]:
+                    if sub.priority != priority:
+                        continue
+                    if sub.filter is not None and not sub.filter(event, *args):
+                        continue
+                    self._call(sub.callback, event, args)
+
+    def _call(self, callback, event, args):
+        if asyncio.iscoroutinefunction(callback):
+            fut = asyncio.ensure_future(callback(event, *args), loop=self.loop)
+            fut.add_done_callback(partial(self._on_callback_done, event))
+            return
+        try:
+            callback(event, *args)
+        except Exception:
+            self.logger.exception(f'error in callback for {event}')
+
+    def _on_callback_done(self, event, fut: asyncio.Future):
+        if not fut.cancelled() and fut.exception() is not None:
+            e = fut.exception()
+            self.logger.error(f'error in callback for {event}', exc_info=(type(e), e, e.__traceback__))
+
+
+class _EventSubscriber(NamedTuple):
+    callback: Callable
+    filter: Optional[Callable[..., bool]]
+    priority: bool
+
+
 class NetworkJobOnDefaultServer(Logger):
     """An abstract base class for a job that runs on the main network
     interface. Every time the main interface changes, the job is
@@ -1190,10 +1433,29 @@ class OrderedDictWithIndex(OrderedDict):
         self._recalc_index()
         return ret
 
-    def __delitem__(self, *args, **kwargs):
-        ret = super().__delitem__(*args, **kwargs)
-        self._recalc_index()
-        return ret
+    def __delitem__(self, key):
+        pos = self._key_to_pos[key]
+        tail = [self._pos_to_key[i] for i in range(pos + 1, len(self))]
+        super().__delitem__(key)
+        del self._key_to_pos[key]
+        del self._pos_to_key[len(self)]
+        self._set_positions(pos, tail)
+
+    def insert(self, pos, key, value):
+        """Adds a new key at position pos.
+        Only the positions of the keys after it are recalculated.
+        """
+        assert key not in self, key
+        tail = [self._pos_to_key[i] for i in range(pos, len(self))]
+        super().__setitem__(key, value)
+        for k in tail:
+            super().move_to_end(k)
+        self._set_positions(pos, [key] + tail)
+
+    def _set_positions(self, pos, keys):
+        for i, key in enumerate(keys, pos):
+            self._key_to_pos[key] = i
+            self._pos_to_key[i] = key
 
     def __setitem__(self, key, *args, **kwargs):
         is_new_key = key not in self
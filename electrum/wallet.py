@@ -30,11 +30,14 @@ import os
 import sys
 import random
 import time
+import itertools
 import json
 import copy
 import errno
 import traceback
 import operator
+import heapq
+import asyncio
 from functools import partial
 from collections import defaultdict
 from numbers import Number
@@ -197,6 +200,48 @@ class InternalAddressCorruption(Exception):
                  "Please restore your wallet from seed, and compare the addresses in both files")
 
 
+class AddressPool:
+    """Set of addresses kept in wallet order, with the first one
+    available in O(log n). Removed addresses are dropped lazily from
+    the heap."""
+
+    def __init__(self, key):
+        self._key = key
+        self._members = set()  # type: Set[str]
+        self._heap = []  # type: List[Tuple[Any, str]]
+
+    def __contains__(self, address):
+        return address in self._members
+
+    def __len__(self):
+        return len(self._members)
+
+    def add(self, address: str) -> None:
+        if address in self._members:
+            return
+        self._members.add(address)
+        heapq.heappush(self._heap, (self._key(address), address))
+        if len(self._heap) > 2 * len(self._members) + 16:
+            self._heap = [(self._key(addr), addr) for addr in self._members]
+            heapq.heapify(self._heap)
+
+    def discard(self, address: str) -> None:
+        self._members.discard(address)
+
+    def clear(self) -> None:
+        self._members.clear()
+        self._heap.clear()
+
+    def first(self) -> Optional[str]:
+        heap = self._heap
+        while heap and heap[0][1] not in self._members:
+            heapq.heappop(heap)
+        return heap[0][1] if heap else None
+
+    def to_list(self) -> List[str]:
+        return sorted(self._members, key=self._key)
+
+
 class TxWalletDetails(NamedTuple):
     txid: Optional[str]
     status: str
@@ -254,7 +299,9 @@ class Abstract_Wallet(AddressSynchronizer):
                 outputs = [PartialTxOutput.from_legacy_tuple(*output) for output in invoice.get('outputs')]
                 invoice['outputs'] = outputs
         self._prepare_onchain_invoice_paid_detection()
-        self.calc_unused_change_addresses()
+        self._prepare_address_pools()
+        self._prepare_batching_candidates()
+        self._prepare_request_status_index()
         # save wallet type the first time
         if self.storage.get('wallet_type') is None:
             self.storage.put('wallet_type', self.wallet_type)
@@ -290,6 +337,8 @@ class Abstract_Wallet(AddressSynchronizer):
         self.storage.write()
 
     def stop_threads(self):
+        if self.network and self._request_expiry_timer:
+            self.network.asyncio_loop.call_soon_threadsafe(self._request_expiry_timer.cancel)
         super().stop_threads()
         if any([ks.is_requesting_to_be_rewritten_to_wallet_file for ks in self.get_keystores()]):
             self.save_keystore()
@@ -308,6 +357,7 @@ class Abstract_Wallet(AddressSynchronizer):
         if self.lnworker:
             network.maybe_init_lightning()
             self.lnworker.start_network(network)
+        self._schedule_request_expiry_check()
 
     def load_and_cleanup(self):
         self.load_keystore()
@@ -343,13 +393,63 @@ class Abstract_Wallet(AddressSynchronizer):
 
     def calc_unused_change_addresses(self):
         with self.lock:
-            if hasattr(self, '_unused_change_addresses'):
-                addrs = self._unused_change_addresses
+            self._sync_address_pools()
+            return self._unused_change.to_list()
+
+    def _prepare_address_pools(self):
+        # receiving addresses without history and without a request that
+        # is still valid, the ones without any request at all, and the
+        # change addresses without (local) history. They are kept up to
+        # date from the ChangeLog and the request index.
+        key = self._get_address_pool_key
+        self._unused_receiving = AddressPool(key)
+        self._unrequested_receiving = AddressPool(key)
+        self._unused_change = AddressPool(key)
+        # (expiry, address) of the requests that reserve an address
+        self._reserved_addresses_heap = []  # type: List[Tuple[float, str]]
+        self._address_pools_pos = None  # type: Optional[int]
+
+    def _get_address_pool_key(self, address):
+        # the order of get_receiving_addresses and get_change_addresses,
+        # or None if address is not one of them
+        return address if self.is_mine(address) else None
+
+    def _sync_address_pools(self):
+        pos, changed = self.changes.get_changes_since(self._address_pools_pos)
+        self._address_pools_pos = pos
+        if changed is None:
+            for pool in (self._unused_receiving, self._unrequested_receiving, self._unused_change):
+                pool.clear()
+            changed = itertools.chain(self.get_receiving_addresses(), self.get_change_addresses())
+        for key in changed:
+            self._update_address_pools(key)
+        now = time.time()
+        heap = self._reserved_addresses_heap
+        while heap and heap[0][0] < now:
+            expiry, address = heapq.heappop(heap)
+            self._update_address_pools(address)
+
+    def _update_address_pools(self, address):
+        with self.lock:
+            if self._get_address_pool_key(address) is None:
+                is_fresh = is_change = False
+            elif self.is_change(address):
+                is_fresh, is_change = self.get_address_history_len(address) == 0, True
             else:
-                addrs = self.get_change_addresses()
-            self._unused_change_addresses = [addr for addr in addrs if
-                                            self.get_address_history_len(addr) == 0]
-            return list(self._unused_change_addresses)
+                is_fresh, is_change = not self.db.get_addr_history(address), False
+            has_request = is_fresh and not is_change and address in self.receive_requests
+            expiry = self._request_expiry.get(address) if has_request else None
+            is_reserved = has_request and (expiry is None or time.time() <= expiry)
+            if is_reserved and expiry is not None:
+                # it will be back in the pool once the request expires
+                heapq.heappush(self._reserved_addresses_heap, (expiry, address))
+            for pool, is_member in ((self._unused_change, is_fresh and is_change),
+                                    (self._unrequested_receiving, is_fresh and not is_change and not has_request),
+                                    (self._unused_receiving, is_fresh and not is_change and not is_reserved)):
+                if is_member:
+                    pool.add(address)
+                else:
+                    pool.discard(address)
 
     def is_deterministic(self):
         return self.keystore.is_deterministic()
@@ -369,6 +469,7 @@ class Abstract_Wallet(AddressSynchronizer):
         if changed:
             run_hook('set_label', self, name, text)
             self.storage.put('labels', self.labels)
+            self.changes.add(name)
         return changed
 
     def set_fiat_value(self, txid, ccy, text, fx, value_sat):
@@ -569,19 +670,48 @@ class Abstract_Wallet(AddressSynchronizer):
 
     def get_onchain_history(self, *, domain=None):
         for hist_item in self.get_history(domain=domain):
-            yield {
-                'txid': hist_item.txid,
-                'fee_sat': hist_item.fee,
-                'height': hist_item.tx_mined_status.height,
-                'confirmations': hist_item.tx_mined_status.conf,
-                'timestamp': hist_item.tx_mined_status.timestamp,
-                'incoming': True if hist_item.delta>0 else False,
-                'bc_value': Satoshis(hist_item.delta),
-                'bc_balance': Satoshis(hist_item.balance),
-                'date': timestamp_to_datetime(hist_item.tx_mined_status.timestamp),
-                'label': self.get_label(hist_item.txid),
-                'txpos_in_block': hist_item.tx_mined_status.txpos,
-            }
+            tx_item = self._get_onchain_history_item(hist_item.txid, hist_item.tx_mined_status,
+                                                     hist_item.delta, hist_item.fee)
+            tx_item['bc_balance'] = Satoshis(hist_item.balance)
+            yield tx_item
+
+    def _get_onchain_history_item(self, tx_hash, tx_mined_status, delta, fee):
+        return {
+            'txid': tx_hash,
+            'fee_sat': fee,
+            'height': tx_mined_status.height,
+            'confirmations': tx_mined_status.conf,
+            'timestamp': tx_mined_status.timestamp,
+            'incoming': True if delta>0 else False,
+            'bc_value': Satoshis(delta),
+            'date': timestamp_to_datetime(tx_mined_status.timestamp),
+            'label': self.get_label(tx_hash),
+            'txpos_in_block': tx_mined_status.txpos,
+        }
+
+    def get_onchain_history_item(self, tx_hash, *, domain=None, fx=None) -> Optional[dict]:
+        """Returns the get_full_history item of a single on-chain tx,
+        without the running balance, or None if the tx is not in the
+        history of domain.
+        """
+        with self.transaction_lock:
+            if not self.db.get_transaction(tx_hash):
+                return None
+            addrs = set(self.db.get_txi_addresses(tx_hash)) | set(self.db.get_txo_addresses(tx_hash))
+            if domain is not None:
+                addrs &= set(domain)
+            if not addrs:
+                return None
+            delta = sum(self.get_tx_delta(tx_hash, addr) for addr in addrs)
+        tx_item = self._get_onchain_history_item(tx_hash, self.get_tx_height(tx_hash),
+                                                 delta, self.get_tx_fee(tx_hash))
+        value = Decimal(delta)
+        tx_item['value'] = Satoshis(value)
+        if fx:
+            fx_rate = fx.timestamp_rates([tx_item['timestamp'] or time.time()])[0]
+            tx_item['fiat_value'] = Fiat(value / Decimal(bitcoin.COIN) * fx_rate, fx.ccy)
+            tx_item['fiat_default'] = True
+        return tx_item
 
     def create_invoice(self, outputs: List[PartialTxOutput], message, pr, URI):
         if '!' in (x.value for x in outputs):
@@ -731,8 +861,10 @@ class Abstract_Wallet(AddressSynchronizer):
                 key = tx_item['payment_hash'] if 'payment_hash' in tx_item else tx_item['type'] + tx_item['channel_id']
                 transactions[key] = tx_item
         now = time.time()
+        if fx:
+            fx_rates = fx.timestamp_rates([item['timestamp'] or now for item in transactions.values()])
         balance = 0
-        for item in transactions.values():
+        for i, item in enumerate(transactions.values()):
             # add on-chain and lightning values
             value = Decimal(0)
             if item.get('bc_value'):
@@ -743,8 +875,7 @@ class Abstract_Wallet(AddressSynchronizer):
             balance += value
             item['balance'] = Satoshis(balance)
             if fx:
-                timestamp = item['timestamp'] or now
-                fiat_value = value / Decimal(bitcoin.COIN) * fx.timestamp_rate(timestamp)
+                fiat_value = value / Decimal(bitcoin.COIN) * fx_rates[i]
                 item['fiat_value'] = Fiat(fiat_value, fx.ccy)
                 item['fiat_default'] = True
         return transactions
@@ -781,9 +912,11 @@ class Abstract_Wallet(AddressSynchronizer):
                 expenditures += -value
             else:
                 income += value
-            # fiat computations
-            if fx and fx.is_enabled() and fx.get_history_config():
-                fiat_fields = self.get_tx_item_fiat(tx_hash, value, fx, tx_fee)
+            out.append(item)
+        # fiat computations
+        if fx and fx.is_enabled() and fx.get_history_config():
+            for item, fiat_fields in zip(out, self.get_tx_items_fiat(out, fx)):
+                value = item['bc_value'].value
                 fiat_value = fiat_fields['fiat_value'].value
                 item.update(fiat_fields)
                 if value < 0:
@@ -791,7 +924,6 @@ class Abstract_Wallet(AddressSynchronizer):
                     fiat_expenditures += -fiat_value
                 else:
                     fiat_income += fiat_value
-            out.append(item)
         # add summary
         if out:
             b, v = out[0]['bc_balance'].value, out[0]['bc_value'].value
@@ -833,23 +965,71 @@ class Abstract_Wallet(AddressSynchronizer):
         return value_sat / Decimal(COIN) * self.price_at_timestamp(tx_hash, fx.timestamp_rate)
 
     def get_tx_item_fiat(self, tx_hash, value, fx, tx_fee):
+        fiat_rate = self.price_at_timestamp(tx_hash, fx.timestamp_rate)
+        average_price = lambda: self.average_price(tx_hash, fx.timestamp_rate, fx.ccy)
+        return self._get_tx_item_fiat(tx_hash, value, fx.ccy, tx_fee, fiat_rate, average_price)
+
+    def get_tx_items_fiat(self, items, fx) -> List[dict]:
+        """get_tx_item_fiat for a list of onchain history items.
+        Rates are looked up for all items in one pass, and the acquisition
+        price of each transaction is computed at most once.
+        """
+        ccy = fx.ccy
+        now = time.time()
+        prices = dict(zip([item['txid'] for item in items],
+                          fx.timestamp_rates([item['timestamp'] or now for item in items])))
+        avg_prices = {}  # txid -> average acquisition price of its inputs
+
+        def price_at_timestamp(txid):
+            if txid not in prices:
+                prices[txid] = self.price_at_timestamp(txid, fx.timestamp_rate)
+            return prices[txid]
+
+        def coin_price(txid, txin_value):
+            # see self.coin_price
+            if txin_value is None:
+                return Decimal('NaN')
+            if self.db.get_txi_addresses(txid):
+                return average_price(txid) * txin_value/Decimal(COIN)
+            fiat_value = self.get_fiat_value(txid, ccy)
+            if fiat_value is not None:
+                return fiat_value
+            return price_at_timestamp(txid) * txin_value/Decimal(COIN)
+
+        def average_price(txid):
+            # see self.average_price
+            if txid not in avg_prices:
+                input_value = 0
+                total_price = 0
+                for addr in self.db.get_txi_addresses(txid):
+                    for ser, v in self.db.get_txi_addr(txid, addr):
+                        input_value += v
+                        total_price += coin_price(ser.split(':')[0], v)
+                avg_prices[txid] = total_price / (input_value/Decimal(COIN))
+            return avg_prices[txid]
+
+        return [self._get_tx_item_fiat(item['txid'], item['bc_value'].value, ccy, item['fee_sat'],
+                                       price_at_timestamp(item['txid']),
+                                       lambda txid=item['txid']: average_price(txid))
+                for item in items]
+
+    def _get_tx_item_fiat(self, tx_hash, value, ccy, tx_fee, fiat_rate, average_price):
         item = {}
-        fiat_value = self.get_fiat_value(tx_hash, fx.ccy)
+        fiat_value = self.get_fiat_value(tx_hash, ccy)
         fiat_default = fiat_value is None
-        fiat_rate = self.price_at_timestamp(tx_hash, fx.timestamp_rate)
-        fiat_value = fiat_value if fiat_value is not None else self.default_fiat_value(tx_hash, fx, value)
+        fiat_value = fiat_value if fiat_value is not None else value / Decimal(COIN) * fiat_rate
         fiat_fee = tx_fee / Decimal(COIN) * fiat_rate if tx_fee is not None else None
-        item['fiat_currency'] = fx.ccy
-        item['fiat_rate'] = Fiat(fiat_rate, fx.ccy)
-        item['fiat_value'] = Fiat(fiat_value, fx.ccy)
-        item['fiat_fee'] = Fiat(fiat_fee, fx.ccy) if fiat_fee else None
+        item['fiat_currency'] = ccy
+        item['fiat_rate'] = Fiat(fiat_rate, ccy)
+        item['fiat_value'] = Fiat(fiat_value, ccy)
+        item['fiat_fee'] = Fiat(fiat_fee, ccy) if fiat_fee else None
         item['fiat_default'] = fiat_default
         if value < 0:
-            acquisition_price = - value / Decimal(COIN) * self.average_price(tx_hash, fx.timestamp_rate, fx.ccy)
+            acquisition_price = - value / Decimal(COIN) * average_price()
             liquidation_price = - fiat_value
-            item['acquisition_price'] = Fiat(acquisition_price, fx.ccy)
+            item['acquisition_price'] = Fiat(acquisition_price, ccy)
             cg = liquidation_price - acquisition_price
-            item['capital_gain'] = Fiat(cg, fx.ccy)
+            item['capital_gain'] = Fiat(cg, ccy)
         return item
 
     def get_label(self, tx_hash: str) -> str:
@@ -913,39 +1093,71 @@ class Abstract_Wallet(AddressSynchronizer):
     def dust_threshold(self):
         return dust_threshold(self.network)
 
+    def _prepare_batching_candidates(self):
+        # txid -> (is_rbf, indices of is_mine outputs) of the unconfirmed
+        # and local txs that are outgoing and spend only is_mine coins.
+        # Kept up to date from the ChangeLog; heights and spent outputs
+        # are checked when a candidate is picked.
+        self._batching_candidates = {}  # type: Dict[str, Tuple[bool, Tuple[int, ...]]]
+        self._batching_candidates_pos = None  # type: Optional[int]
+
+    def _sync_batching_candidates(self):
+        pos, changed = self.changes.get_changes_since(self._batching_candidates_pos)
+        self._batching_candidates_pos = pos
+        if changed is None:
+            self._batching_candidates.clear()
+            changed = self.db.list_transactions()
+        for key in changed:
+            self._update_batching_candidate(key)
+
+    def _update_batching_candidate(self, txid):
+        with self.lock:
+            self._batching_candidates.pop(txid, None)
+            if self.get_tx_height(txid).height not in (TX_HEIGHT_UNCONFIRMED,
+                                                       TX_HEIGHT_UNCONF_PARENT,
+                                                       TX_HEIGHT_LOCAL):
+                return
+            tx = self.db.get_transaction(txid)
+            if not tx:
+                return
+            # tx should be "outgoing" from wallet
+            if self.get_tx_value(txid) >= 0:
+                return
+            # all inputs should be is_mine
+            if not all([self.is_mine(self.get_txin_address(txin)) for txin in tx.inputs()]):
+                return
+            own_outputs = tuple(output_idx for output_idx, o in enumerate(tx.outputs())
+                                if self.is_mine(o.address))
+            self._batching_candidates[txid] = (not tx.is_final(), own_outputs)
+
     def get_unconfirmed_base_tx_for_batching(self) -> Optional[Transaction]:
+        with self.lock:
+            self._sync_batching_candidates()
+            candidates = list(self._batching_candidates.items())
+        # same order as get_history: oldest first
+        candidates.sort(key=lambda item: self.get_txpos(item[0]))
         candidate = None
-        for hist_item in self.get_history():
+        for txid, (is_rbf, own_outputs) in candidates:
+            tx_mined_status = self.get_tx_height(txid)
             # tx should not be mined yet
-            if hist_item.tx_mined_status.conf > 0: continue
+            if tx_mined_status.conf > 0: continue
             # conservative future proofing of code: only allow known unconfirmed types
-            if hist_item.tx_mined_status.height not in (TX_HEIGHT_UNCONFIRMED,
-                                                        TX_HEIGHT_UNCONF_PARENT,
-                                                        TX_HEIGHT_LOCAL):
-                continue
-            # tx should be "outgoing" from wallet
-            if hist_item.delta >= 0:
-                continue
-            tx = self.db.get_transaction(hist_item.txid)
-            if not tx:
+            if tx_mined_status.height not in (TX_HEIGHT_UNCONFIRMED,
+                                              TX_HEIGHT_UNCONF_PARENT,
+                                              TX_HEIGHT_LOCAL):
                 continue
             # is_mine outputs should not be spent yet
             # to avoid cancelling our own dependent transactions
-            txid = tx.txid()
-            if any([self.is_mine(o.address) and self.db.get_spent_outpoint(txid, output_idx)
-                    for output_idx, o in enumerate(tx.outputs())]):
-                continue
-            # all inputs should be is_mine
-            if not all([self.is_mine(self.get_txin_address(txin)) for txin in tx.inputs()]):
+            if any([self.db.get_spent_outpoint(txid, output_idx) for output_idx in own_outputs]):
                 continue
             # prefer txns already in mempool (vs local)
-            if hist_item.tx_mined_status.height == TX_HEIGHT_LOCAL:
-                candidate = tx
+            if tx_mined_status.height == TX_HEIGHT_LOCAL:
+                candidate = txid
                 continue
             # tx must have opted-in for RBF
-            if tx.is_final(): continue
-            return tx
-        return candidate
+            if not is_rbf: continue
+            return self.db.get_transaction(txid)
+        return self.db.get_transaction(candidate) if candidate else None
 
     def get_change_addresses_for_new_transaction(self, preferred_change_addr=None) -> List[str]:
         change_addrs = []
@@ -1009,8 +1221,8 @@ class Abstract_Wallet(AddressSynchronizer):
             # Let the coin chooser select the coins to spend
             coin_chooser = coinchooser.get_coin_chooser(self.config)
             # If there is an unconfirmed RBF tx, merge with it
-            base_tx = self.get_unconfirmed_base_tx_for_batching()
-            if self.config.get('batch_rbf', False) and base_tx:
+            base_tx = self.get_unconfirmed_base_tx_for_batching() if self.config.get('batch_rbf', False) else None
+            if base_tx:
                 # make sure we don't try to spend change from the tx-to-be-replaced:
                 coins = [c for c in coins if c.prevout.txid.hex() != base_tx.txid()]
                 is_local = self.get_tx_height(base_tx.txid()).height == TX_HEIGHT_LOCAL
@@ -1094,6 +1306,7 @@ class Abstract_Wallet(AddressSynchronizer):
             else:
                 self.frozen_addresses -= set(addrs)
             self.storage.put('frozen_addresses', list(self.frozen_addresses))
+            self.changes.add(*addrs)
             return True
         return False
 
@@ -1451,20 +1664,24 @@ class Abstract_Wallet(AddressSynchronizer):
         return wrapper
 
     def get_unused_addresses(self):
-        domain = self.get_receiving_addresses()
-        in_use = [k for k in self.receive_requests.keys() if self.get_request_status(k)[0] != PR_EXPIRED]
-        return [addr for addr in domain if not self.db.get_addr_history(addr)
-                and addr not in in_use]
+        with self.lock:
+            self._sync_address_pools()
+            return self._unused_receiving.to_list()
 
     @check_returned_address
     def get_unused_address(self):
-        addrs = self.get_unused_addresses()
-        if addrs:
-            return addrs[0]
+        with self.lock:
+            self._sync_address_pools()
+            return self._unused_receiving.first()
 
     @check_returned_address
     def get_receiving_address(self):
         # always return an address
+        with self.lock:
+            self._sync_address_pools()
+            addr = self._unrequested_receiving.first()
+        if addr:
+            return addr
         domain = self.get_receiving_addresses()
         if not domain:
             return
@@ -1481,25 +1698,131 @@ class Abstract_Wallet(AddressSynchronizer):
         raise Exception("this wallet cannot generate new addresses")
 
     def get_payment_status(self, address, amount):
-        local_height = self.get_local_height()
+        paid, height = self._get_payment_height(address, amount)
+        return paid, self._get_payment_conf(paid, height)
+
+    def _get_payment_conf(self, paid: bool, height: Optional[int]) -> Optional[int]:
+        if not paid:
+            return None
+        if height is None:
+            return 0
+        return self.get_local_height() - height + 1
+
+    def _get_payment_height(self, address, amount) -> Tuple[bool, Optional[int]]:
+        """Returns whether 'amount' was received on 'address', and the
+        height of the output that completed the payment, counting the
+        most confirmed outputs first. The height is None if that output
+        is not verified. Unlike the number of confirmations, this does
+        not change with new blocks, so it can be cached.
+        """
         received, sent = self.get_addr_io(address)
         l = []
         for txo, x in received.items():
             h, v, is_cb = x
             txid, n = txo.split(':')
             info = self.db.get_verified_tx(txid)
-            if info:
-                conf = local_height - info.height + 1
-            else:
-                conf = 0
-            l.append((conf, v))
+            l.append((info.height if info else None, v))
+        l.sort(key=lambda x: (x[0] is None, x[0] or 0, -x[1]))
         vsum = 0
-        for conf, v in reversed(sorted(l)):
+        for height, v in l:
             vsum += v
             if vsum >= amount:
-                return True, conf
+                return True, height
         return False, None
 
+    def _prepare_request_status_index(self):
+        # address -> (paid, height), see _get_payment_height
+        self._request_payments = {}  # type: Dict[str, Tuple[bool, Optional[int]]]
+        self._request_payments_pos = self.changes.get_position()
+        # key -> expiry time of the request
+        self._request_expiry = {}  # type: Dict[str, float]
+        self._request_expiry_heap = []  # type: List[Tuple[float, str]]
+        self._request_expiry_timer = None  # type: Optional[asyncio.TimerHandle]
+        for key, req in self.receive_requests.items():
+            self._add_request_to_index(key, req)
+
+    @staticmethod
+    def _get_request_expiry(req) -> Optional[int]:
+        timestamp = req.get('time', 0)
+        if timestamp and type(timestamp) != int:
+            timestamp = 0
+        expiration = req.get('exp')
+        if expiration is None:
+            return None
+        if expiration and type(expiration) != int:
+            expiration = 0
+        return timestamp + expiration
+
+    def _add_request_to_index(self, key, req):
+        expiry = self._get_request_expiry(req)
+        with self.lock:
+            self._request_payments.pop(key, None)
+            if expiry is None:
+                self._request_expiry.pop(key, None)
+            else:
+                self._request_expiry[key] = expiry
+                heapq.heappush(self._request_expiry_heap, (expiry, key))
+            self._update_address_pools(key)
+
+    def _remove_request_from_index(self, key):
+        # stale heap entries are skipped when they are popped
+        with self.lock:
+            self._request_payments.pop(key, None)
+            self._request_expiry.pop(key, None)
+            self._update_address_pools(key)
+
+    def _get_request_payment(self, address, amount) -> Tuple[bool, Optional[int]]:
+        # called from the GUI, the network loop and the RPC threads
+        with self.lock:
+            pos, changed = self.changes.get_changes_since(self._request_payments_pos)
+            self._request_payments_pos = pos
+            if changed is None:
+                self._request_payments.clear()
+            else:
+                for key in changed:
+                    self._request_payments.pop(key, None)
+                    # txids are logged when their verification status changes
+                    for addr in self.db.get_txo_addresses(key):
+                        self._request_payments.pop(addr, None)
+            r = self._request_payments.get(address)
+            if r is None:
+                r = self._request_payments[address] = self._get_payment_height(address, amount)
+            return r
+
+    def _schedule_request_expiry_check(self):
+        if self.network:
+            self.network.asyncio_loop.call_soon_threadsafe(self._rearm_request_expiry_timer)
+
+    def _rearm_request_expiry_timer(self):
+        # runs on the network event loop
+        if self._request_expiry_timer:
+            self._request_expiry_timer.cancel()
+            self._request_expiry_timer = None
+        with self.lock:
+            if not self._request_expiry_heap:
+                return
+            delay = self._request_expiry_heap[0][0] - time.time()
+        loop = self.network.asyncio_loop
+        # requests expire strictly after their expiry time
+        self._request_expiry_timer = loop.call_later(max(delay, 0) + 1, self._on_request_expiry)
+
+    def _on_request_expiry(self):
+        self._request_expiry_timer = None
+        now = time.time()
+        expired = []
+        with self.lock:
+            heap = self._request_expiry_heap
+            while heap and heap[0][0] < now:
+                expiry, key = heapq.heappop(heap)
+                if self._request_expiry.get(key) == expiry:
+                    expired.append(key)
+        for key in expired:
+            req = self.get_request(key)
+            # the status of lightning requests does not account for expiry
+            if req and req['status'] in (PR_UNPAID, PR_EXPIRED):
+                self.network.trigger_callback('request_status', key, PR_EXPIRED)
+        self._rearm_request_expiry_timer()
+
     def get_request_URI(self, addr):
         req = self.receive_requests[addr]
         message = self.labels.get(addr, '')
@@ -1522,21 +1845,16 @@ class Abstract_Wallet(AddressSynchronizer):
         if r is None:
             return PR_UNKNOWN
         amount = r.get('amount', 0) or 0
-        timestamp = r.get('time', 0)
-        if timestamp and type(timestamp) != int:
-            timestamp = 0
-        expiration = r.get('exp')
-        if expiration and type(expiration) != int:
-            expiration = 0
-        paid, conf = self.get_payment_status(address, amount)
+        paid, height = self._get_request_payment(address, amount)
         if not paid:
-            if expiration is not None and time.time() > timestamp + expiration:
+            expiry = self._request_expiry.get(address)
+            if expiry is not None and time.time() > expiry:
                 status = PR_EXPIRED
             else:
                 status = PR_UNPAID
         else:
             status = PR_PAID
-        return status, conf
+        return status, self._get_payment_conf(paid, height)
 
     def get_request(self, key):
         req = self.receive_requests.get(key)
@@ -1599,6 +1917,7 @@ class Abstract_Wallet(AddressSynchronizer):
         req['name'] = pr.pki_data
         req['sig'] = bh2u(pr.signature)
         self.receive_requests[key] = req
+        self._add_request_to_index(key, req)
         self.storage.put('payment_requests', self.receive_requests)
 
     def add_payment_request(self, req):
@@ -1617,6 +1936,8 @@ class Abstract_Wallet(AddressSynchronizer):
             raise Exception('Unknown request type')
         amount = req.get('amount')
         self.receive_requests[key] = req
+        self._add_request_to_index(key, req)
+        self._schedule_request_expiry_check()
         self.storage.put('payment_requests', self.receive_requests)
         self.set_label(key, message) # should be a default label
         return req
@@ -1640,6 +1961,7 @@ class Abstract_Wallet(AddressSynchronizer):
         if addr not in self.receive_requests:
             return False
         self.receive_requests.pop(addr)
+        self._remove_request_from_index(addr)
         self.storage.put('payment_requests', self.receive_requests)
         return True
 
@@ -1926,8 +2248,7 @@ class Imported_Wallet(Simple_Wallet):
                         transactions_new.add(tx_hash)
             transactions_to_remove -= transactions_new
             self.db.remove_addr_history(address)
-            for tx_hash in transactions_to_remove:
-                self.remove_transaction(tx_hash)
+            self.remove_transactions(transactions_to_remove)
         self.set_label(address, None)
         self.remove_payment_request(address)
         self.set_frozen_state_of_addresses([address], False)
@@ -1946,6 +2267,7 @@ class Imported_Wallet(Simple_Wallet):
             else:
                 self.keystore.delete_imported_key(pubkey)
                 self.save_keystore()
+        self.changes.add(address)
         self.storage.write()
 
     def is_mine(self, address) -> bool:
@@ -2050,6 +2372,11 @@ class Deterministic_Wallet(Abstract_Wallet):
         for addr_found in addresses_sample1 + addresses_sample2:
             self.check_address(addr_found)
 
+    def _get_address_pool_key(self, address):
+        # not the ephemeral addresses get_address_index also knows about
+        index = self.db.get_address_index(address)
+        return index[1] if index else None
+
     def check_address(self, addr):
         if addr and self.is_mine(addr):
             if addr != self.derive_address(*self.get_address_index(addr)):
@@ -2124,9 +2451,7 @@ class Deterministic_Wallet(Abstract_Wallet):
             address = self.derive_address(for_change, n)
             self.db.add_change_address(address) if for_change else self.db.add_receiving_address(address)
             self.add_address(address)
-            if for_change:
-                # note: if it's actually used, it will get filtered later
-                self._unused_change_addresses.append(address)
+            self._update_address_pools(address)
             return address
 
     def synchronize_sequence(self, for_change):
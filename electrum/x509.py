@@ -24,8 +24,12 @@
 # SOFTWARE.
 
 import hashlib
+import json
+import os
+import threading
 import time
 from datetime import datetime
+from typing import Dict, List, Optional
 
 import ecdsa
 
@@ -342,6 +346,117 @@ def load_certificates(ca_path):
     return ca_list, ca_keyID
 
 
+class CertificateStore:
+    """The CA certificates of a PEM bundle, indexed by fingerprint and
+    by keyID. Certificates are parsed, and their dates checked, on first
+    use. Building the keyID index requires parsing every certificate, so
+    it is only done when needed, and persisted to cache_path, keyed by
+    the mtime and size of the bundle.
+    """
+
+    def __init__(self, ca_path: str, cache_path: str = None):
+        from . import pem
+        self.ca_path = ca_path
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        with open(ca_path, 'r', encoding='utf-8') as f:
+            s = f.read()
+        st = os.stat(ca_path)
+        self._bundle_id = [st.st_mtime, st.st_size]
+        self._der = {}  # type: Dict[bytes, bytearray]  # fingerprint -> DER
+        for b in pem.dePemList(s, "CERTIFICATE"):
+            self._der[hashlib.sha1(b).digest()] = b
+        self._parsed = {}  # type: Dict[bytes, Optional[X509]]  # None if invalid
+        self._keyID = None  # type: Optional[Dict[str, List[bytes]]]
+
+    def __len__(self):
+        return len(self._der)
+
+    def __contains__(self, fingerprint: bytes):
+        return self.get(fingerprint) is not None
+
+    def get(self, fingerprint: bytes) -> Optional[X509]:
+        """Returns the certificate, if it is in the bundle and valid now."""
+        b = self._der.get(fingerprint)
+        if b is None:
+            return None
+        with self._lock:
+            if fingerprint not in self._parsed:
+                try:
+                    self._parsed[fingerprint] = X509(b)
+                except BaseException as e:
+                    _logger.info(f"cert error: {e}")
+                    self._parsed[fingerprint] = None
+            x = self._parsed[fingerprint]
+        if x is None:
+            return None
+        try:
+            x.check_date()
+        except CertificateError as e:
+            _logger.info(f"cert error: {e}")
+            return None
+        return x
+
+    def get_by_keyID(self, keyID: str) -> Optional[X509]:
+        for fingerprint in self._get_keyID_index().get(keyID, []):
+            x = self.get(fingerprint)
+            if x is not None:
+                return x
+        return None
+
+    def _get_keyID_index(self) -> Dict[str, List[bytes]]:
+        with self._lock:
+            if self._keyID is None:
+                self._keyID = self._read_keyID_index()
+            if self._keyID is None:
+                self._keyID = self._build_keyID_index()
+                self._write_keyID_index()
+            return self._keyID
+
+    @profiler
+    def _build_keyID_index(self) -> Dict[str, List[bytes]]:
+        index = {}
+        for fingerprint, b in self._der.items():
+            try:
+                x = self._parsed[fingerprint] = X509(b)
+            except BaseException as e:
+                _logger.info(f"cert error: {e}")
+                self._parsed[fingerprint] = None
+                continue
+            index.setdefault(x.get_keyID(), []).append(fingerprint)
+        return index
+
+    def _read_keyID_index(self) -> Optional[Dict[str, List[bytes]]]:
+        if not self.cache_path:
+            return None
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                d = json.loads(f.read())
+            if d.get('ca_path') != self.ca_path or d.get('bundle') != self._bundle_id:
+                return None
+            index = {keyID: [bytes.fromhex(fp) for fp in fps] for keyID, fps in d['keyIDs'].items()}
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            _logger.info(f"cannot read CA index: {e!r}")
+            return None
+        if any(fp not in self._der for fps in index.values() for fp in fps):
+            return None
+        return index
+
+    def _write_keyID_index(self):
+        if not self.cache_path:
+            return
+        d = {
+            'ca_path': self.ca_path,
+            'bundle': self._bundle_id,
+            'keyIDs': {keyID: [fp.hex() for fp in fps] for keyID, fps in self._keyID.items()},
+        }
+        try:
+            with open(self.cache_path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(d))
+        except OSError as e:
+            _logger.info(f"cannot write CA index: {e!r}")
+
+
 if __name__ == "__main__":
     import certifi
 